@@ -0,0 +1,151 @@
+"""JSON API for the mobile client and internal services.
+
+    GET /api/timeline                 the logged-in user's home timeline
+    GET /api/users/<id>/messages      one user's messages
+    GET /api/messages?ids=1,2,3       up to PER_PAGE messages by id
+    GET /api/trending?window=24h      most liked messages (1h, 24h or 7d)
+
+Rows are read as plain column tuples and turned straight into dicts; no
+User or Message instances are built, which is most of the cost of the HTML
+pages at volume. Lists page with the same ?before= / ?after= cursors as the
+HTML pages; "next" and "prev" are the URLs of the neighbouring pages, or
+null.
+"""
+
+from flask import Blueprint, abort, g, jsonify, request
+
+from database import read_only
+from models import db, Message, TimelineEntry, User
+from pagination import PER_PAGE, page_url, paginate_request
+import trending
+
+api = Blueprint('api', __name__, url_prefix='/api')
+
+# every message carries its author's public details
+MESSAGE_COLUMNS = (Message.id, Message.text, Message.timestamp,
+                   Message.user_id, User.username, User.image_url)
+
+
+def message_rows():
+    """Query for MESSAGE_COLUMNS tuples (messages joined to authors)."""
+
+    return (db.session.query(*MESSAGE_COLUMNS)
+            .join(User, User.id == Message.user_id))
+
+
+def serialize_message(row):
+    return {
+        'id': row.id,
+        'text': row.text,
+        'timestamp': row.timestamp.isoformat(),
+        'user': {
+            'id': row.user_id,
+            'username': row.username,
+            'image_url': row.image_url,
+        },
+    }
+
+
+def serialize_messages(rows):
+    """Dicts for message rows, each saying whether the viewer liked it."""
+
+    liked = (g.user.liked_message_ids(row.id for row in rows)
+             if g.user else set())
+
+    return [dict(serialize_message(row), liked=row.id in liked)
+            for row in rows]
+
+
+def page_response(page):
+    return jsonify(
+        messages=serialize_messages(page.items),
+        next=page_url(page.next_args) if page.next_args else None,
+        prev=page_url(page.prev_args) if page.prev_args else None)
+
+
+@api.route('/timeline')
+@read_only
+def timeline_messages():
+    """The logged-in user's home timeline, newest first."""
+
+    if not g.user:
+        abort(401)
+
+    page = paginate_request(
+        message_rows()
+        .join(TimelineEntry, TimelineEntry.message_id == Message.id)
+        .filter(TimelineEntry.user_id == g.user.id),
+        # entries carry their message's timestamp (see timeline.py)
+        keys=(TimelineEntry.timestamp, TimelineEntry.message_id),
+        row_key=lambda row: (row.timestamp, row.id))
+
+    return page_response(page)
+
+
+@api.route('/users/<int:user_id>/messages')
+@read_only
+def user_messages(user_id):
+    """One user's messages, newest first."""
+
+    if not db.session.query(User.id).filter(User.id == user_id).scalar():
+        abort(404)
+
+    page = paginate_request(
+        message_rows().filter(Message.user_id == user_id),
+        keys=(Message.timestamp, Message.id),
+        row_key=lambda row: (row.timestamp, row.id))
+
+    return page_response(page)
+
+
+@api.route('/messages')
+@read_only
+def messages_by_id():
+    """Messages for ?ids=1,2,3, in the order asked for.
+
+    Ids that don't exist (any more) are simply left out.
+    """
+
+    try:
+        ids = [int(part) for part in request.args.get('ids', '').split(',')
+               if part]
+    except ValueError:
+        abort(400)
+
+    # repeats are answered once
+    ids = list(dict.fromkeys(ids))
+    if len(ids) > PER_PAGE:
+        abort(400)
+
+    rows = message_rows().filter(Message.id.in_(ids)).all() if ids else []
+    position = {message_id: n for n, message_id in enumerate(ids)}
+    rows.sort(key=lambda row: position[row.id])
+
+    return jsonify(messages=serialize_messages(rows))
+
+
+@api.route('/trending')
+@read_only
+def trending_messages():
+    """The most liked messages in ?window=, with their like counts."""
+
+    window = request.args.get('window', trending.DEFAULT_WINDOW)
+    if window not in trending.WINDOWS:
+        abort(400)
+
+    counts = dict(trending.top_messages().get(window))
+    rows = (message_rows().filter(Message.id.in_(list(counts))).all()
+            if counts else [])
+    rows.sort(key=lambda row: (-counts[row.id], -row.id))
+
+    messages = [dict(message, likes=counts[message['id']])
+                for message in serialize_messages(rows)]
+
+    return jsonify(window=window, messages=messages)
+
+
+@api.errorhandler(400)
+@api.errorhandler(401)
+@api.errorhandler(404)
+def api_error(error):
+    return jsonify(error=error.description), error.code
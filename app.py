@@ -1,46 +1,105 @@
 import os
+from datetime import datetime
 
-from flask import Flask, render_template, request, flash, redirect, session, g
-from flask_debugtoolbar import DebugToolbarExtension
+from flask import (Flask, Blueprint, render_template, request, flash,
+                   redirect, session, g, abort, jsonify, current_app)
+from jinja2 import FileSystemBytecodeCache
+from sqlalchemy import func
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import configure_mappers, joinedload
 
 
+from api import api
 from forms import UserAddForm, LoginForm, MessageForm, UserEditForm
-from models import db, connect_db, User, Message, Follows, Likes
-
-import pdb
+from models import db, connect_db, User, Message, Follows, Likes, TimelineEntry
+from commands import register_commands, compile_templates
+from config import get_config
+from database import read_only
+from pagination import Page, paginate_request, page_url, stream_request
+from search import count_users, search_users
+from streaming import stream_template
+from http_cache import conditional, cache_control, apply_default_cache_headers
+import follow_graph
+import fragment_cache
+import jobs
+import metrics
+import passwords
+import slow_queries
+import soft_delete
+import counters
+import database
+import timeline
+import trending
 
 CURR_USER_KEY = "curr_user"
 
-app = Flask(__name__)
+# user cards per page on /users and the follower/following pages
+USERS_PER_PAGE = 48
+
+bp = Blueprint('warbler', __name__)
+
+
+def create_app(config=None):
+    """Build the Warbler app with a profile from config.py.
+
+    `config` is a profile name ('development', 'production'), a config
+    class, or None to choose by FLASK_ENV.
+    """
+
+    app = Flask(__name__)
+    app.config.from_object(get_config(config))
+
+    if app.config['DEBUG_TB_ENABLED']:
+        # a heavy import that production workers never need
+        from flask_debugtoolbar import DebugToolbarExtension
+        DebugToolbarExtension(app)
+
+    if app.config['TEMPLATE_CACHE_DIR']:
+        os.makedirs(app.config['TEMPLATE_CACHE_DIR'], exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(
+            app.config['TEMPLATE_CACHE_DIR'])
+
+    database.init_app(app)
+    connect_db(app)
+    slow_queries.init_app(app)
+    passwords.init_app(app)
+    fragment_cache.init_app(app)
+    soft_delete.init_app(app)
+    jobs.init_app(app)
+    follow_graph.init_app(app)
+    trending.init_app(app)
+    register_commands(app)
+
+    app.jinja_env.globals['page_url'] = page_url
 
-# Get DB_URI from environ variable (useful for production/testing) or,
-# if not set there, use development local db.
-app.config['SQLALCHEMY_DATABASE_URI'] = (
-    os.environ.get('DATABASE_URL', 'postgres:///warbler'))
+    # first, so the timing covers the other before_request hooks
+    metrics.init_app(app)
+    app.register_blueprint(bp)
+    app.register_blueprint(api)
 
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SQLALCHEMY_ECHO'] = False
-app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = True
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
+    # Caching: routes wrapped in @conditional answer revalidation with 304s;
+    # everything else keeps the old no-store headers (useful for dev; in
+    # production, this kind of stuff is typically handled elsewhere).
+    app.after_request(apply_default_cache_headers)
 
-# Add a new feature that allows a user to “like” a w arble. 
-# They should only be able to like warbles written by other users. T
-# hey should put a star (or some other similar symbol) next to liked warbles.
-# They should be able to unlike a warble, by clicking on that star.
-# On a profile page, it should show how many warblers that user has liked, 
-# and this should link to a page showing their liked warbles.
+    if app.config['WARM_START']:
+        warm_up(app)
 
-toolbar = DebugToolbarExtension(app)
+    return app
 
-connect_db(app)
+
+def warm_up(app):
+    """Do the work a cold worker would otherwise put on its first requests."""
+
+    compile_templates(app)
+    configure_mappers()
 
 
 ##############################################################################
 # User signup/login/logout
 
 
-@app.before_request
+@bp.before_app_request
 def add_user_to_g():
    
     """If we're logged in, add curr user to Flask global."""
@@ -65,7 +124,7 @@ def do_logout():
         del session[CURR_USER_KEY]
 
 
-@app.route('/signup', methods=["GET", "POST"])
+@bp.route('/signup', methods=["GET", "POST"])
 def signup():
     """Handle user signup.
 
@@ -101,7 +160,7 @@ def signup():
         return render_template('users/signup.html', form=form)
 
 
-@app.route('/login', methods=["GET", "POST"])
+@bp.route('/login', methods=["GET", "POST"])
 def login():
     """Handle user login."""
 
@@ -112,6 +171,7 @@ def login():
                                  form.password.data)
 
         if user:
+            db.session.commit()  # saves the hash if it was upgraded
             do_login(user)
             flash(f"Hello, {user.username}!", "success")
             return redirect("/")
@@ -121,7 +181,7 @@ def login():
     return render_template('users/login.html', form=form)
 
 
-@app.route('/logout')
+@bp.route('/logout')
 
 def logout():
     """Handle logout of user."""
@@ -132,41 +192,156 @@ def logout():
 ##############################################################################
 # General user routes:
 
-@app.route('/users')
+def follow_states_for(user_ids):
+    """Follow state of the logged-in user towards each of `user_ids`.
+
+    One query for a whole page of user cards; empty when logged out.
+    """
+
+    if not g.user:
+        return {}
+
+    return g.user.follow_states(user_ids)
+
+
+@bp.route('/users')
 def list_users():
     """Page with listing of users.
 
-    Can take a 'q' param in querystring to search by that username.
+    Can take a 'q' param in querystring to search by that username;
+    results are ranked exact, prefix, then substring matches.
     """
 
     search = request.args.get('q')
+    follow_states = {}
 
     if not search:
-        users = User.query.all()
+        # each batch of cards brings its follow states along
+        users = stream_request(
+            User.query,
+            keys=(User.username, User.id),
+            row_key=lambda user: (user.username, user.id),
+            per_page=USERS_PER_PAGE,
+            descending=False,
+            on_chunk=lambda chunk: follow_states.update(
+                follow_states_for(user.id for user in chunk)))
+        total = db.session.query(func.count(User.id)).scalar()
+        shown = None
     else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
+        # one page of the best matches; the count covers all of them
+        users = Page(search_users(search, limit=USERS_PER_PAGE))
+        total = count_users(search)
+        shown = len(users)
+        follow_states = follow_states_for(user.id for user in users)
 
-    return render_template('users/index.html', users=users)
+    return stream_template('users/index.html', users=users, total=total,
+                           shown=shown, follow_states=follow_states)
 
 
-@app.route('/users/<int:user_id>')
+def profile_validators(user_id):
+    """Validators for a page that shows one user's profile.
+
+    A logged-in viewer also sees the "followed by" badge, which changes
+    with each reload of the follow graph.
+    """
+
+    stamp = db.session.query(User.updated_at).filter(User.id == user_id).scalar()
+
+    if stamp is None:
+        return None
+
+    if not g.user:
+        return (user_id, stamp), stamp
+
+    loaded_on = follow_graph.follow_graph().loaded_on
+    return ((user_id, stamp, loaded_on),
+            max(filter(None, [stamp, loaded_on])))
+
+
+def follow_page_validators(page):
+    """Validators for a follower/following page listed by `page`.
+
+    Besides the profile itself, the cards show each listed user's name and
+    pictures, so their change stamps are part of it too.
+    """
+
+    def validators(user_id):
+        profile = profile_validators(user_id) if g.user else None
+
+        if profile is None:
+            return None
+
+        listed = [(row.id, row.updated_at)
+                  for row in page(user_id, User.id, User.updated_at)]
+        parts, stamp = profile
+
+        return (parts, listed), max([stamp] + [at for _, at in listed])
+
+    return validators
+
+
+@bp.route('/users/<int:user_id>')
+@read_only
+@conditional(profile_validators)
 def users_show(user_id):
     """Show user profile."""
 
     user = User.query.get_or_404(user_id)
+    likes = set()
 
     # snagging messages in order from the database;
     # user.messages won't be in order by default
-    messages = (Message
-                .query
-                .filter(Message.user_id == user_id)
-                .order_by(Message.timestamp.desc())
-                .limit(100)
-                .all())
-    return render_template('users/show.html', user=user, messages=messages)
+    messages = stream_request(
+        (Message
+         .query
+         .options(joinedload(Message.user))
+         .filter(Message.user_id == user_id)),
+        keys=(Message.timestamp, Message.id),
+        row_key=lambda msg: (msg.timestamp, msg.id),
+        on_chunk=lambda chunk: likes.update(
+            g.user.liked_message_ids(msg.id for msg in chunk)
+            if g.user else ()))
+
+    return stream_template('users/show.html', user=user, messages=messages,
+                           likes=likes)
+
+
+def following_page(user_id, *columns):
+    """This request's page of users `user_id` follows.
+
+    Pass `columns` to fetch just those instead of whole User objects.
+    """
 
+    query = db.session.query(*columns) if columns else User.query
 
-@app.route('/users/<int:user_id>/following')
+    # ordered along ix_follows_user_following_id_followed_id
+    return paginate_request(
+        (query
+         .join(Follows, Follows.user_being_followed_id == User.id)
+         .filter(Follows.user_following_id == user_id)),
+        keys=(Follows.user_being_followed_id,),
+        row_key=lambda followed: (followed.id,),
+        per_page=USERS_PER_PAGE)
+
+
+def followers_page(user_id, *columns):
+    """This request's page of users following `user_id`."""
+
+    query = db.session.query(*columns) if columns else User.query
+
+    # ordered along the follows primary key
+    return paginate_request(
+        (query
+         .join(Follows, Follows.user_following_id == User.id)
+         .filter(Follows.user_being_followed_id == user_id)),
+        keys=(Follows.user_following_id,),
+        row_key=lambda follower: (follower.id,),
+        per_page=USERS_PER_PAGE)
+
+
+@bp.route('/users/<int:user_id>/following')
+@read_only
+@conditional(follow_page_validators(following_page))
 def show_following(user_id):
     """Show list of people this user is following."""
 
@@ -175,10 +350,16 @@ def show_following(user_id):
         return redirect("/")
 
     user = User.query.get_or_404(user_id)
-    return render_template('users/following.html', user=user)
+    following = following_page(user_id)
+    follow_states = follow_states_for(u.id for u in following)
 
+    return render_template('users/following.html', user=user,
+                           following=following, follow_states=follow_states)
 
-@app.route('/users/<int:user_id>/followers')
+
+@bp.route('/users/<int:user_id>/followers')
+@read_only
+@conditional(follow_page_validators(followers_page))
 def users_followers(user_id):
     """Show list of followers of this user."""
 
@@ -187,10 +368,14 @@ def users_followers(user_id):
         return redirect("/")
 
     user = User.query.get_or_404(user_id)
-    return render_template('users/followers.html', user=user)
+    followers = followers_page(user_id)
+    follow_states = follow_states_for(u.id for u in followers)
+
+    return render_template('users/followers.html', user=user,
+                           followers=followers, follow_states=follow_states)
 
 
-@app.route('/users/follow/<int:follow_id>', methods=['POST'])
+@bp.route('/users/follow/<int:follow_id>', methods=['POST'])
 def add_follow(follow_id):
     """Add a follow for the currently-logged-in user."""
 
@@ -199,13 +384,19 @@ def add_follow(follow_id):
         return redirect("/")
 
     followed_user = User.query.get_or_404(follow_id)
-    g.user.following.append(followed_user)
+    if followed_user.id == g.user.id:
+        return abort(403)
+
+    db.session.add(Follows(user_being_followed_id=followed_user.id,
+                           user_following_id=g.user.id))
+    db.session.flush()
+    jobs.enqueue(timeline.add_follow, g.user.id, followed_user.id)
     db.session.commit()
 
     return redirect(f"/users/{g.user.id}/following")
 
 
-@app.route('/users/stop-following/<int:follow_id>', methods=['POST'])
+@bp.route('/users/stop-following/<int:follow_id>', methods=['POST'])
 def stop_following(follow_id):
     """Have currently-logged-in-user stop following this user."""
 
@@ -213,14 +404,19 @@ def stop_following(follow_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    followed_user = User.query.get(follow_id)
-    g.user.following.remove(followed_user)
+    # a deleted user's follows already left the counts, and their purge
+    # removes the rows
+    User.query.get_or_404(follow_id)
+
+    follow = Follows.query.get_or_404((follow_id, g.user.id))
+    db.session.delete(follow)
+    timeline.remove_follow(g.user.id, follow_id)
     db.session.commit()
 
     return redirect(f"/users/{g.user.id}/following")
 
 
-@app.route('/users/profile', methods=["GET", "POST"])
+@bp.route('/users/profile', methods=["GET", "POST"])
 def profile():
     """Update profile for current user."""
     if not g.user:
@@ -247,8 +443,10 @@ def profile():
             user.image_url = form.image_url.data or "/static/images/default-pic.png"
             user.header_image_url = form.header_image_url.data or "/static/images/warbler-hero.jpg"
             user.bio = form.bio.data
+            user.updated_at = datetime.utcnow()
 
             db.session.commit()
+            fragment_cache.message_fragments().invalidate_author(user.id)
             return redirect(f"/users/{user.id}")
 
         flash("Wrong password, please try again.", 'danger')
@@ -264,7 +462,7 @@ def profile():
     # IMPLEMENT THIS TO EDIT PROFILE
 
 
-@app.route('/users/delete', methods=["POST"])
+@bp.route('/users/delete', methods=["POST"])
 def delete_user():
     """Delete user."""
 
@@ -274,8 +472,11 @@ def delete_user():
 
     do_logout()
 
-    db.session.delete(g.user)
+    # hidden at once; their rows are purged in the background
+    user_id = g.user.id
+    soft_delete.delete_user(g.user)
     db.session.commit()
+    fragment_cache.message_fragments().invalidate_author(user_id)
 
     return redirect("/signup")
 
@@ -283,7 +484,7 @@ def delete_user():
 ##############################################################################
 # Messages routes:
 
-@app.route('/messages/new', methods=["GET", "POST"])
+@bp.route('/messages/new', methods=["GET", "POST"])
 def messages_add():
     """Add a message:
 
@@ -299,6 +500,9 @@ def messages_add():
     if form.validate_on_submit():
         msg = Message(text=form.text.data)
         g.user.messages.append(msg)
+        db.session.flush()
+        # followers get it from a worker
+        timeline.post_message(msg)
         db.session.commit()
 
         return redirect(f"/users/{g.user.id}")
@@ -306,15 +510,57 @@ def messages_add():
     return render_template('messages/new.html', form=form)
 
 
-@app.route('/messages/<int:message_id>', methods=["GET"])
+def message_validators(message_id):
+    """Validators for a message page: the message and its author."""
+
+    row = (db.session
+           .query(Message.timestamp, User.id, User.updated_at)
+           .join(User, User.id == Message.user_id)
+           .filter(Message.id == message_id)
+           .first())
+
+    if row is None:
+        return None
+
+    posted, author_id, author_stamp = row
+
+    return ((message_id, posted, author_id, author_stamp),
+            max(posted, author_stamp))
+
+
+@bp.route('/messages/<int:message_id>', methods=["GET"])
+@read_only
+@conditional(message_validators)
 def messages_show(message_id):
     """Show a message."""
 
-    msg = Message.query.get(message_id)
+    msg = (Message
+           .query
+           .options(joinedload(Message.user))
+           .get_or_404(message_id))
+
     return render_template('messages/show.html', message=msg)
 
 
-@app.route('/messages/<int:message_id>/delete', methods=["POST"])
+@bp.route('/trending')
+@read_only
+def trending_messages():
+    """Most liked messages in the last hour, day or week (?window=)."""
+
+    window = request.args.get('window', trending.DEFAULT_WINDOW)
+    if window not in trending.WINDOWS:
+        abort(404)
+
+    ranked = trending.trending(window)
+    likes = (g.user.liked_message_ids(msg.id for msg, _ in ranked)
+             if g.user else set())
+
+    return render_template('messages/trending.html', ranked=ranked,
+                           likes=likes, window=window,
+                           windows=trending.WINDOWS)
+
+
+@bp.route('/messages/<int:message_id>/delete', methods=["POST"])
 def messages_destroy(message_id):
     """Delete a message."""
 
@@ -322,26 +568,85 @@ def messages_destroy(message_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    msg = Message.query.get(message_id)
-    db.session.delete(msg)
+    msg = Message.query.get_or_404(message_id)
+    if msg.user_id != g.user.id:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    timeline.remove_message(msg.id)
+    soft_delete.delete_message(msg)
     db.session.commit()
+    fragment_cache.message_fragments().invalidate_message(message_id)
 
     return redirect(f"/users/{g.user.id}")
 
-@app.route('/users/<int:user_id>/likes', methods=["GET"])
+@bp.route('/users/<int:user_id>/likes', methods=["GET"])
 def show_likes(user_id):
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
     user = User.query.get_or_404(user_id)
-    return render_template('users/likes.html', user=user, likes=user.likes)
 
-@app.route('/messages/<int:message_id>/like', methods=['POST'])
+    follow_states = {}
+
+    # fetch the liked messages with their authors in one query, rather
+    # than lazy-loading each author as the template reaches it; newest
+    # messages first, along the likes primary key
+    likes = stream_request(
+        (Message
+         .query
+         .options(joinedload(Message.user))
+         .join(Likes, Likes.message_id == Message.id)
+         .filter(Likes.user_id == user_id)),
+        keys=(Likes.message_id,),
+        row_key=lambda msg: (msg.id,),
+        on_chunk=lambda chunk: follow_states.update(
+            follow_states_for({msg.user_id for msg in chunk})))
+
+    return stream_template('users/likes.html', user=user, likes=likes,
+                           follow_states=follow_states)
+
+def wants_json():
+    """Did the client (e.g. the like button's fetch) ask for JSON?"""
+
+    best = request.accept_mimetypes.best_match(['application/json',
+                                                'text/html'])
+    return (best == 'application/json' and
+            request.accept_mimetypes[best] >
+            request.accept_mimetypes['text/html'])
+
+
+def remove_like(like):
+    """Delete `like` and take it out of the counts. Doesn't commit.
+
+    One DELETE on the primary key rather than a session delete: of two
+    unlikes racing, only the one whose statement removed the row
+    adjusts the counts.
+    """
+
+    likes = Likes.__table__
+    result = db.session.execute(
+        likes.delete()
+        .where(likes.c.user_id == like.user_id)
+        .where(likes.c.message_id == like.message_id))
+
+    if result.rowcount == 1:
+        counters.forget_like(like)
+        trending.forget_like(like)
+
+
+@bp.route('/messages/<int:message_id>/like', methods=['POST'])
 def add_like(message_id):
-    """Toggle a liked message for the currently-logged-in user."""
+    """Toggle a liked message for the currently-logged-in user.
+
+    Answers JSON ({"message_id": ..., "liked": ...}) when asked for it,
+    otherwise redirects home.
+    """
 
     if not g.user:
+        if wants_json():
+            return jsonify(error="Access unauthorized."), 401
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
@@ -349,26 +654,33 @@ def add_like(message_id):
     if liked_message.user_id == g.user.id:
         return abort(403)
 
-    user_likes = g.user.likes
+    # one primary key probe, then one insert or one delete
+    like = Likes.query.get((g.user.id, message_id))
 
-    if liked_message in user_likes:
-        g.user.likes = [like for like in user_likes if like != liked_message]
+    if like:
+        remove_like(like)
     else:
-        g.user.likes.append(liked_message)
+        db.session.add(Likes(user_id=g.user.id, message_id=message_id))
 
-    db.session.commit()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # a concurrent request liked it first; the like stands
+        db.session.rollback()
 
-    return redirect("/")
+    liked = like is None
 
+    if wants_json():
+        return jsonify(message_id=message_id, liked=liked)
 
-    # add msg.id to likes
+    return redirect("/")
 
 
 ##############################################################################
 # Homepage and error pages
 
 
-# @app.route('/')
+# @bp.route('/')
 # def homepage():
 #     """Show homepage:
 
@@ -388,45 +700,45 @@ def add_like(message_id):
 #     else:
 #         return render_template('home-anon.html') my attempt here, solution code follows
 
-@app.route('/')
+@bp.route('/')
+@read_only
+@cache_control('private, no-store')
 def homepage():
     """Show homepage:
 
     - anon users: no messages
-    - logged in: 100 most recent messages of followed_users
+    - logged in: most recent messages of followed_users, 100 per page,
+      read from the user's precomputed timeline
     """
-    liked_msg_ids = [msg.id for msg in g.user.likes]
-    likes = Likes.query.all()
     if g.user:
-        following_ids = [f.id for f in g.user.following] + [g.user.id]
+        liked_msg_ids = set()
 
-        messages = (Message
-                    .query
-                    .filter(Message.user_id.in_(following_ids))
-                    .order_by(Message.timestamp.desc())
-                    .limit(100)
-                    .all())
+        # streamed: the aside goes out before the first row is read
+        messages = stream_request(
+            timeline.timeline_query(g.user.id),
+            keys=(TimelineEntry.timestamp, TimelineEntry.message_id),
+            row_key=lambda msg: (msg.timestamp, msg.id),
+            on_chunk=lambda chunk: liked_msg_ids.update(
+                g.user.liked_message_ids(msg.id for msg in chunk)))
 
-        return render_template('home.html', messages=messages, likes = liked_msg_ids)
+        # from the in-memory follow graph: no joins over follows here
+        suggestions = follow_graph.suggestions(
+            g.user.id, current_app.config['FOLLOW_SUGGESTIONS'])
+
+        return stream_template('home.html', messages=messages, likes = liked_msg_ids,
+                               suggestions=suggestions)
 
     else:
         return render_template('home-anon.html')
 
 
 
-##############################################################################
-# Turn off all caching in Flask
-#   (useful for dev; in production, this kind of stuff is typically
-#   handled elsewhere)
-#
-# https://stackoverflow.com/questions/34066804/disabling-caching-in-flask
-
-@app.after_request
-def add_header(req):
-    """Add non-caching headers on every request."""
-
-    req.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    req.headers["Pragma"] = "no-cache"
-    req.headers["Expires"] = "0"
-    req.headers['Cache-Control'] = 'public, max-age=0'
-    return req
+@bp.app_errorhandler(passwords.HashingBusy)
+def hashing_busy(error):
+    """Too many logins/signups hashing at once: shed load, don't queue."""
+
+    return ("Lots of people are signing in right now. "
+            "Please try again in a moment.", 503, {'Retry-After': '2'})
+
+
+app = create_app()
@@ -0,0 +1,61 @@
+"""Cold-start benchmark: import time and first-request latency.
+
+Each run is a fresh interpreter, like a worker the autoscaler just started:
+
+    python benchmarks/startup.py [--runs 10] [--profile production]
+
+Reports the median and worst of `import app` (which builds the app) and of
+the first GET to --path. Run `flask compile-templates` first to measure a
+production worker with a warm bytecode cache.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# runs in the child interpreter; prints its timings as JSON
+CHILD = '''
+import json, sys, time
+start = time.perf_counter()
+from app import app
+imported = time.perf_counter()
+response = app.test_client().get(sys.argv[1])
+response.get_data()  # streamed pages render as they're read
+done = time.perf_counter()
+assert response.status_code < 400, response.status_code
+print(json.dumps({"import": imported - start, "first_request": done - imported}))
+'''
+
+
+def run_once(profile, path):
+    env = dict(os.environ, FLASK_ENV=profile)
+    output = subprocess.run([sys.executable, '-c', CHILD, path],
+                            cwd=ROOT, env=env, check=True,
+                            stdout=subprocess.PIPE).stdout
+    return json.loads(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--profile', default='production')
+    parser.add_argument('--path', default='/login',
+                        help="Page to request (default needs no database).")
+    args = parser.parse_args()
+
+    runs = [run_once(args.profile, args.path) for _ in range(args.runs)]
+
+    print(f"{args.profile}, {args.runs} runs, first request GET {args.path}")
+    for phase in ('import', 'first_request'):
+        times = [run[phase] * 1000 for run in runs]
+        print(f"  {phase:14} median {statistics.median(times):7.1f} ms"
+              f"   max {max(times):7.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,304 @@
+"""Microbenchmarks for Warbler's hot paths.
+
+For each --sizes entry (a number of users), generates a seeded dataset with
+generator/create_csvs.py, loads it into the benchmark database with the bulk
+loader, and times:
+
+- GET / (homepage), GET /users/<id> (users_show), GET /users/<id>/likes
+  (show_likes), GET /users with and without ?q= (list_users), as a
+  logged-in user with a busy timeline;
+- POST /messages/<id>/like (add_like) and POST /users/follow/<id>
+  (add_follow), each undone between runs, untimed;
+- User.authenticate and User.is_following;
+- rendering home.html for a full page, with a cold and a warm fragment
+  cache.
+
+The benchmark database is dropped and reloaded, so it must not be one you
+care about:
+
+    DATABASE_URL=postgresql:///warbler-bench python benchmarks/suite.py \\
+        --sizes 1000,100000
+
+Results go to benchmarks/results/<commit>.json (median, p95 and min in
+milliseconds, and SQL statements per request for the routes, the number to
+watch as sizes grow). Compare two runs with:
+
+    python benchmarks/suite.py --compare before.json after.json
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+
+# messages per user in the generated datasets
+MESSAGES_PER_USER = 10
+
+# bcrypt is slow by design; a few runs are plenty
+AUTHENTICATE_RUNS = 5
+
+# changes smaller than this are noise in --compare
+THRESHOLD = 0.10
+
+
+def git(*args):
+    return subprocess.run(['git', *args], cwd=ROOT, stdout=subprocess.PIPE,
+                          universal_newlines=True).stdout.strip()
+
+
+def summarize(times):
+    times = sorted(seconds * 1000 for seconds in times)
+    return {
+        'median_ms': round(statistics.median(times), 3),
+        # nearest rank: the smallest time at least 95% of runs don't exceed
+        'p95_ms': round(times[math.ceil(0.95 * len(times)) - 1], 3),
+        'min_ms': round(times[0], 3),
+        'runs': len(times),
+    }
+
+
+def measure(run, repeat, reset=None):
+    """Time `repeat` calls of `run` after one warm-up call.
+
+    `reset` (untimed) runs after each call, to undo what `run` changed.
+    """
+
+    times = []
+
+    for attempt in range(repeat + 1):
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+
+        if reset:
+            reset()
+        if attempt:
+            times.append(elapsed)
+
+    return summarize(times)
+
+
+def dataset(users, seed):
+    """Directory of generated CSVs for `users` users (made once, then kept)."""
+
+    directory = os.path.join(tempfile.gettempdir(),
+                             f'warbler-bench-{users}-{seed}')
+
+    if not os.path.exists(os.path.join(directory, 'likes.csv')):
+        os.makedirs(directory, exist_ok=True)
+        subprocess.run([sys.executable, 'generator/create_csvs.py',
+                        '--users', str(users),
+                        '--messages', str(users * MESSAGES_PER_USER),
+                        '--seed', str(seed), '--out', directory],
+                       cwd=ROOT, check=True, stdout=subprocess.DEVNULL)
+
+    return directory
+
+
+def run_size(app, users, seed, repeat):
+    """Load a dataset of `users` users and time every benchmark on it."""
+
+    from flask import g, render_template
+
+    from app import CURR_USER_KEY
+    from models import db, Follows, Message, User
+    from pagination import Page
+    from query_counter import QueryCounter
+    import fragment_cache
+    import loader
+    import timeline
+
+    with app.app_context():
+        loader.load(db.engine, dataset(users, seed))
+
+        # the busiest reader and the most followed author
+        viewer = User.query.order_by(User.following_count.desc()).first()
+        star = User.query.order_by(User.followers_count.desc()).first()
+        viewer_id, star_id = viewer.id, star.id
+        username = viewer.username
+
+        message_id = (db.session.query(Message.id)
+                      .filter(Message.user_id != viewer_id)
+                      .order_by(Message.id).limit(1).scalar())
+        stranger_id = (db.session.query(User.id)
+                       .filter(User.id != viewer_id)
+                       .filter(~User.id.in_(
+                           db.session.query(Follows.user_being_followed_id)
+                           .filter(Follows.user_following_id == viewer_id)))
+                       .order_by(User.id).limit(1).scalar())
+        term = username[:3]
+        engine = db.engine
+        db.session.remove()
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session[CURR_USER_KEY] = viewer_id
+
+    def request(method, url):
+        def run():
+            with QueryCounter(engine) as counter:
+                response = client.open(url, method=method)
+                # streamed pages do their work as the body is read
+                response.get_data()
+            assert response.status_code < 400, (url, response.status_code)
+            run.queries = counter.count
+        return run
+
+    def route(method, url, reset=None):
+        run = request(method, url)
+        result = measure(run, repeat, reset and request(*reset))
+        result['queries'] = run.queries
+        return result
+
+    results = {
+        'homepage': route('GET', '/'),
+        'users_show': route('GET', f'/users/{star_id}'),
+        'show_likes': route('GET', f'/users/{viewer_id}/likes'),
+        'list_users': route('GET', '/users'),
+        'list_users_q': route('GET', f'/users?q={term}'),
+        'add_like': route('POST', f'/messages/{message_id}/like',
+                          reset=('POST', f'/messages/{message_id}/like')),
+        'add_follow': route('POST', f'/users/follow/{stranger_id}',
+                            reset=('POST',
+                                   f'/users/stop-following/{stranger_id}')),
+    }
+
+    with app.app_context():
+        def authenticate():
+            assert User.authenticate(username, 'password')
+
+        results['authenticate'] = measure(authenticate, AUTHENTICATE_RUNS,
+                                          reset=db.session.remove)
+
+        viewer, star = User.query.get(viewer_id), User.query.get(star_id)
+        results['is_following'] = measure(lambda: viewer.is_following(star),
+                                          repeat)
+
+        messages = (timeline.timeline_query(viewer_id)
+                    .limit(100).all())
+        page = Page(messages, None, None)
+
+        with app.test_request_context('/'):
+            g.user = viewer
+
+            def render():
+                render_template('home.html', messages=page, likes=set())
+
+            results['render_home_cold'] = measure(
+                render, repeat,
+                reset=lambda: fragment_cache.message_fragments().clear())
+            results['render_home_warm'] = measure(render, repeat)
+
+        db.session.remove()
+
+    return results
+
+
+def run(options):
+    os.environ.setdefault('FLASK_ENV', 'production')
+    os.environ.setdefault('DATABASE_URL', 'postgresql:///warbler-bench')
+    sys.path.insert(0, ROOT)
+
+    from app import app
+
+    app.config['WTF_CSRF_ENABLED'] = False
+
+    commit = git('rev-parse', '--short', 'HEAD')
+    report = {
+        'commit': commit,
+        'dirty': bool(git('status', '--porcelain', '--untracked-files=no')),
+        'date': datetime.utcnow().isoformat(),
+        'python': platform.python_version(),
+        'database': app.config['SQLALCHEMY_DATABASE_URI'].split(':')[0],
+        'repeat': options.repeat,
+        'sizes': {},
+    }
+
+    for users in options.sizes:
+        print(f"{users} users...", file=sys.stderr)
+        report['sizes'][str(users)] = run_size(app, users, options.seed,
+                                               options.repeat)
+
+    out = options.out or os.path.join(RESULTS_DIR, f'{commit}.json')
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+
+    with open(out, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+    for users, results in report['sizes'].items():
+        print(f"\n{users} users")
+        for name, result in sorted(results.items()):
+            queries = (f"   {result['queries']:4} queries"
+                       if 'queries' in result else '')
+            print(f"  {name:18} median {result['median_ms']:9.2f} ms"
+                  f"   p95 {result['p95_ms']:9.2f} ms{queries}")
+
+    print(f"\nWrote {out}.")
+
+
+def compare(before_file, after_file):
+    """Print median changes between two result files.
+
+    Returns True if anything got slower by more than THRESHOLD.
+    """
+
+    with open(before_file) as f:
+        before = json.load(f)
+    with open(after_file) as f:
+        after = json.load(f)
+
+    print(f"{before['commit']} -> {after['commit']}")
+    regressed = False
+
+    for users in sorted(set(before['sizes']) & set(after['sizes']), key=int):
+        print(f"\n{users} users")
+        old, new = before['sizes'][users], after['sizes'][users]
+
+        for name in sorted(set(old) & set(new)):
+            was, now = old[name]['median_ms'], new[name]['median_ms']
+            change = (now - was) / was if was else 0
+            flag = ''
+            if change > THRESHOLD:
+                flag = '  slower'
+                regressed = True
+            elif change < -THRESHOLD:
+                flag = '  faster'
+
+            print(f"  {name:18} {was:9.2f} -> {now:9.2f} ms "
+                  f"({change:+.0%}){flag}")
+
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='1000',
+                        type=lambda value: [int(n) for n in value.split(',')],
+                        help="Comma-separated user counts (default 1000).")
+    parser.add_argument('--repeat', type=int, default=30)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help="Results file (default "
+                                      "benchmarks/results/<commit>.json).")
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'),
+                        help="Compare two results files instead of running.")
+    options = parser.parse_args()
+
+    if options.compare:
+        # a non-zero exit lets CI fail on a regression
+        raise SystemExit(1 if compare(*options.compare) else 0)
+
+    run(options)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+"""Maintenance commands, run with `flask <command>`."""
+
+import click
+
+from models import db
+import counters
+import jobs
+import loader
+import migrations
+import soft_delete
+import timeline
+import trending
+
+
+def compile_templates(app):
+    """Load every template, compiling it (into the bytecode cache, if any).
+
+    Returns the number of templates loaded.
+    """
+
+    names = app.jinja_env.list_templates(extensions=['html'])
+
+    for name in names:
+        app.jinja_env.get_template(name)
+
+    return len(names)
+
+
+def register_commands(app):
+    """Attach Warbler's maintenance commands to `app.cli`."""
+
+    @app.cli.command('rebuild-timelines')
+    def rebuild_timelines():
+        """Recompute every user's home timeline."""
+
+        count = timeline.rebuild_all_timelines()
+        db.session.commit()
+        click.echo(f"Rebuilt {count} timelines.")
+
+    @app.cli.command('trim-timelines')
+    def trim_timelines():
+        """Cut every home timeline back to its maximum length."""
+
+        timeline.trim_timelines()
+        db.session.commit()
+        click.echo("Trimmed timelines.")
+
+    @app.cli.command('rebuild-trending')
+    def rebuild_trending():
+        """Recount the trending like buckets from the likes table."""
+
+        count = trending.rebuild()
+        db.session.commit()
+        click.echo(f"Rebuilt {count} like buckets.")
+
+    @app.cli.command('repair-counters')
+    @click.option('--batch-size', default=10000,
+                  help="Users recomputed per transaction.")
+    def repair_counters(batch_size):
+        """Recompute every user's denormalized counts."""
+
+        count = counters.recompute_counters(batch_size)
+        click.echo(f"Recomputed counters for {count} users.")
+
+    @app.cli.command('purge-deleted')
+    @click.option('--batch-size', default=None, type=int,
+                  help="Rows deleted per transaction.")
+    def purge_deleted(batch_size):
+        """Delete soft-deleted users and messages for good."""
+
+        purged_messages, purged_users = soft_delete.purge(
+            batch_size or app.config['PURGE_BATCH_SIZE'])
+        click.echo(f"Purged {purged_messages} messages "
+                   f"and {purged_users} users.")
+
+    @app.cli.command('worker')
+    @click.option('--queue', 'queues', multiple=True,
+                  help="Queue to work (repeatable; default: all).")
+    @click.option('--threads', default=1,
+                  help="Jobs run at once by this process.")
+    def worker(queues, threads):
+        """Run queued jobs until interrupted."""
+
+        click.echo(f"Working {', '.join(queues or app.config['JOB_QUEUES'])} "
+                   f"with {threads} thread(s).")
+        jobs.run_workers(app, queues or None, threads)
+
+    @app.cli.command('load-data')
+    @click.option('--dir', 'directory', default='generator',
+                  help="Directory holding users.csv, messages.csv, ...")
+    @click.option('--append', is_flag=True,
+                  help="Add to the existing data instead of replacing it.")
+    @click.option('--batch-size', default=5000,
+                  help="Rows per insert where COPY isn't available.")
+    def load_data(directory, append, batch_size):
+        """Bulk load CSV fixtures (drops every table unless --append)."""
+
+        for stat in loader.load(db.engine, directory, append, batch_size):
+            click.echo(loader.format_stat(stat))
+
+    @app.cli.command('compile-templates')
+    def compile_templates_command():
+        """Precompile templates into TEMPLATE_CACHE_DIR (run at deploy)."""
+
+        if not app.config['TEMPLATE_CACHE_DIR']:
+            click.echo("TEMPLATE_CACHE_DIR isn't set for this profile.",
+                       err=True)
+            raise SystemExit(1)
+
+        count = compile_templates(app)
+        click.echo(f"Compiled {count} templates into "
+                   f"{app.config['TEMPLATE_CACHE_DIR']}.")
+
+    @app.cli.group('db')
+    def db_group():
+        """Schema migrations."""
+
+    @db_group.command('upgrade')
+    @click.option('--to', 'target', default=None,
+                  help="Stop after this revision (default: latest).")
+    def db_upgrade(target):
+        """Apply pending migrations."""
+
+        for revision in migrations.upgrade(db.engine, target):
+            click.echo(f"Applied {revision}.")
+
+    @db_group.command('downgrade')
+    @click.option('--to', 'target', required=True,
+                  help=f"Revert everything after this revision "
+                       f"('{migrations.BASE}' for all).")
+    def db_downgrade(target):
+        """Revert applied migrations."""
+
+        for revision in migrations.downgrade(db.engine, target):
+            click.echo(f"Reverted {revision}.")
+
+    @db_group.command('status')
+    def db_status():
+        """List migrations and whether each is applied."""
+
+        done = migrations.applied_revisions(db.engine)
+        for module in migrations.load_revisions():
+            state = 'applied' if module.revision in done else 'pending'
+            click.echo(f"{module.revision} {state:8} "
+                       f"{module.__doc__.strip().splitlines()[0]}")
+
+    @db_group.command('check')
+    def db_check():
+        """Fail if a model's hot query has no supporting index."""
+
+        missing = migrations.unindexed_hot_queries(
+            db.engine, db.Model.__subclasses__())
+
+        for table, key in missing:
+            click.echo(f"No index on {table} ({', '.join(key)})", err=True)
+
+        if missing:
+            raise SystemExit(1)
+
+        click.echo("Every hot query has an index.")
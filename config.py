@@ -0,0 +1,119 @@
+"""Configuration profiles for `create_app`.
+
+Pick one with `create_app('production')` (or a class below), or leave it to
+FLASK_ENV: 'development' gets DevelopmentConfig, anything else production.
+"""
+
+import os
+
+
+class Config:
+    """Settings shared by every profile."""
+
+    # Get DB_URI from environ variable (useful for production/testing) or,
+    # if not set there, use development local db.
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL',
+                                             'postgres:///warbler')
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # connection pool, per engine (see database.py)
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+    DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 30))
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+    DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', '1') != '0'
+    DB_STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 0))
+
+    # read-only views use this database when set; a client reads the
+    # primary for a few seconds after each write it makes
+    REPLICA_DATABASE_URI = os.environ.get('REPLICA_DATABASE_URL')
+    REPLICA_STICKY_SECONDS = int(os.environ.get('REPLICA_STICKY_SECONDS', 5))
+    SQLALCHEMY_ECHO = False
+    SECRET_KEY = os.environ.get('SECRET_KEY', "it's a secret")
+
+    # bcrypt work factor for new hashes, and the pool that computes them
+    BCRYPT_LOG_ROUNDS = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+    HASH_POOL_WORKERS = int(os.environ.get('HASH_POOL_WORKERS', 2))
+    HASH_POOL_QUEUE = int(os.environ.get('HASH_POOL_QUEUE', 16))
+
+    # rendered message <li>s kept per worker
+    FRAGMENT_CACHE_SIZE = int(os.environ.get('FRAGMENT_CACHE_SIZE', 5000))
+
+    # share of requests whose latency and SQL cost go to /metrics
+    METRICS_SAMPLE_RATE = float(os.environ.get('METRICS_SAMPLE_RATE', 0.1))
+
+    # log statements slower than this (0: off), with their plans
+    SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 0))
+    SLOW_QUERY_LOG = os.environ.get('SLOW_QUERY_LOG')
+    SLOW_QUERY_EXPLAIN_ANALYZE = bool(
+        os.environ.get('SLOW_QUERY_EXPLAIN_ANALYZE'))
+
+    # deleted users and messages are hidden at once and purged later by a
+    # job, this many rows per transaction
+    PURGE_BATCH_SIZE = int(os.environ.get('PURGE_BATCH_SIZE', 1000))
+
+    # job queues (see jobs.py) and how many of each may run at once
+    JOB_QUEUES = {'timelines': 4, 'maintenance': 1, 'default': 2}
+    JOB_POLL_SECONDS = float(os.environ.get('JOB_POLL_SECONDS', 1))
+    JOB_TIMEOUT = int(os.environ.get('JOB_TIMEOUT', 600))
+    JOB_RETRY_DELAY = int(os.environ.get('JOB_RETRY_DELAY', 5))
+    JOB_KEEP_SECONDS = int(os.environ.get('JOB_KEEP_SECONDS', 86400))
+    # run jobs inline as they're queued, with no worker
+    JOBS_EAGER = bool(os.environ.get('JOBS_EAGER'))
+
+    # the in-memory follow graph (see follow_graph.py) is reloaded this
+    # often; "who to follow" shows this many people
+    FOLLOW_GRAPH_MAX_AGE = int(os.environ.get('FOLLOW_GRAPH_MAX_AGE', 300))
+    FOLLOW_SUGGESTIONS = int(os.environ.get('FOLLOW_SUGGESTIONS', 5))
+
+    # trending rankings (see trending.py): how many messages each holds,
+    # and how many seconds a process reuses one before recounting
+    TRENDING_SIZE = int(os.environ.get('TRENDING_SIZE', 50))
+    TRENDING_TTL = int(os.environ.get('TRENDING_TTL', 60))
+
+    # directory for compiled Jinja bytecode (None: compile in memory only)
+    TEMPLATE_CACHE_DIR = None
+
+    # load every template and configure the mappers in create_app, rather
+    # than on whichever request happens to need them first
+    WARM_START = False
+
+    # Flask-DebugToolbar is only imported when this is on
+    DEBUG_TB_ENABLED = False
+
+
+class DevelopmentConfig(Config):
+    DEBUG_TB_ENABLED = True
+    DEBUG_TB_INTERCEPT_REDIRECTS = True
+    JOBS_EAGER = os.environ.get('JOBS_EAGER', '1') != '0'
+
+
+class ProductionConfig(Config):
+    # `flask compile-templates` fills this at deploy time; workers then
+    # load bytecode instead of parsing template source
+    TEMPLATE_CACHE_DIR = os.environ.get(
+        'TEMPLATE_CACHE_DIR',
+        os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                     'instance', 'jinja-cache'))
+    WARM_START = True
+    SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 250))
+    DB_STATEMENT_TIMEOUT_MS = int(
+        os.environ.get('DB_STATEMENT_TIMEOUT_MS', 30000))
+
+
+profiles = {
+    'development': DevelopmentConfig,
+    'production': ProductionConfig,
+}
+
+
+def get_config(config=None):
+    """Resolve a profile name, a config class, or None (use FLASK_ENV)."""
+
+    if config is None:
+        config = os.environ.get('FLASK_ENV', 'production')
+
+    if isinstance(config, str):
+        return profiles.get(config, ProductionConfig)
+
+    return config
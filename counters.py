@@ -0,0 +1,175 @@
+"""Denormalized per-user counts.
+
+`users` carries messages_count, followers_count, following_count and
+likes_count so profile and home pages don't load whole relationship
+collections just to count them. The mapper events below keep them in step
+inside the same transaction as the write that changes them: adding or
+deleting a Message, Follows or Likes row through the session.
+
+Every bump also moves the user's `updated_at` change stamp forward.
+
+Writes that bypass those mappers (bulk inserts, collection appends on
+User.following / User.likes, database cascades) need `forget_user` /
+`forget_message` / `forget_like` or a repair with `flask repair-counters`. Soft deletes
+call those when they hide a row, so the purge's bulk deletes later change
+no counts.
+"""
+
+from datetime import datetime
+
+from sqlalchemy import and_, event, func, select
+
+from models import db, Follows, Likes, Message, User
+
+users = User.__table__
+
+
+def _bump(connection, user_ids, column, delta):
+    """Add `delta` to `column` for `user_ids` (a list or a subquery)."""
+
+    count = users.c[column]
+    connection.execute(
+        users.update()
+        .where(users.c.id.in_(user_ids))
+        .values({column: count + delta, 'updated_at': datetime.utcnow()}))
+
+
+@event.listens_for(Message, 'after_insert')
+def message_added(mapper, connection, message):
+    _bump(connection, [message.user_id], 'messages_count', 1)
+
+
+@event.listens_for(Message, 'before_delete')
+def message_deleted(mapper, connection, message):
+    _forget_message(connection, message)
+
+
+def _forget_message(connection, message):
+    _bump(connection, [message.user_id], 'messages_count', -1)
+
+    # the database cascade takes this message's likes with it
+    likers = select([Likes.user_id]).where(Likes.message_id == message.id)
+    _bump(connection, likers, 'likes_count', -1)
+
+
+@event.listens_for(Follows, 'after_insert')
+def follow_added(mapper, connection, follow):
+    _bump(connection, [follow.user_being_followed_id], 'followers_count', 1)
+    _bump(connection, [follow.user_following_id], 'following_count', 1)
+
+
+@event.listens_for(Follows, 'after_delete')
+def follow_deleted(mapper, connection, follow):
+    _bump(connection, [follow.user_being_followed_id], 'followers_count', -1)
+    _bump(connection, [follow.user_following_id], 'following_count', -1)
+
+
+@event.listens_for(Likes, 'after_insert')
+def like_added(mapper, connection, like):
+    _bump(connection, [like.user_id], 'likes_count', 1)
+
+
+@event.listens_for(Likes, 'after_delete')
+def like_deleted(mapper, connection, like):
+    _bump(connection, [like.user_id], 'likes_count', -1)
+
+
+def forget_message(message):
+    """Take `message` out of its author's and likers' counts before it's
+    soft-deleted, as deleting it through the session would."""
+
+    _forget_message(db.session, message)
+
+
+def forget_like(like):
+    """Take `like` out of its user's count after a Core delete of it."""
+
+    _bump(db.session, [like.user_id], 'likes_count', -1)
+
+
+def forget_user(user_id):
+    """Take `user_id` out of everyone else's counts before deleting them.
+
+    Their follows and the likes on their messages go with them, and neither
+    passes through the mapper events above.
+    """
+
+    followed = (select([Follows.user_being_followed_id])
+                .where(Follows.user_following_id == user_id))
+    _bump(db.session, followed, 'followers_count', -1)
+
+    followers = (select([Follows.user_following_id])
+                 .where(Follows.user_being_followed_id == user_id))
+    _bump(db.session, followers, 'following_count', -1)
+
+    # a liker may have liked several of their messages; ones already
+    # soft-deleted were taken out of the counts then
+    their_likes = (select([func.count()])
+                   .select_from(Likes.__table__.join(Message.__table__))
+                   .where(Message.user_id == user_id)
+                   .where(Message.deleted_at.is_(None))
+                   .where(Likes.user_id == users.c.id)
+                   .as_scalar())
+    likers = (select([Likes.user_id])
+              .select_from(Likes.__table__.join(Message.__table__))
+              .where(Message.user_id == user_id)
+              .where(Message.deleted_at.is_(None)))
+    db.session.execute(
+        users.update()
+        .where(users.c.id.in_(likers))
+        .values(likes_count=users.c.likes_count - their_likes,
+                updated_at=datetime.utcnow()))
+
+
+def recompute_counters(batch_size=10000):
+    """Recompute every user's counters from the source tables.
+
+    Works through users in id ranges of `batch_size`, committing after each,
+    so a repair on a big database doesn't hold one huge transaction.
+    Returns the number of users updated.
+    """
+
+    follows = Follows.__table__
+    likes = Likes.__table__
+    messages = Message.__table__
+    # the user at the other end of a follow
+    others = users.alias('others')
+
+    def count(table, owner, *alive):
+        """Rows of `table` whose `owner` column is the user being updated,
+        and that `alive` doesn't find soft-deleted (forget_user and
+        forget_message took those out already)."""
+
+        return (select([func.count()])
+                .select_from(table)
+                .where(and_(owner == users.c.id, *alive))
+                .as_scalar())
+
+    values = {
+        'messages_count': count(messages, messages.c.user_id,
+                                messages.c.deleted_at.is_(None)),
+        'followers_count': count(
+            follows.join(others,
+                         others.c.id == follows.c.user_following_id),
+            follows.c.user_being_followed_id, others.c.deleted_at.is_(None)),
+        'following_count': count(
+            follows.join(others,
+                         others.c.id == follows.c.user_being_followed_id),
+            follows.c.user_following_id, others.c.deleted_at.is_(None)),
+        # a deleted user's messages are all soft-deleted too
+        'likes_count': count(likes.join(messages), likes.c.user_id,
+                             messages.c.deleted_at.is_(None)),
+    }
+
+    last_id = db.session.query(func.max(User.id)).scalar() or 0
+    updated = 0
+
+    for low in range(0, last_id + 1, batch_size):
+        result = db.session.execute(
+            users.update()
+            .where(users.c.id.between(low, low + batch_size - 1))
+            .values(values))
+        db.session.commit()
+        updated += result.rowcount
+
+    return updated
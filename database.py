@@ -0,0 +1,147 @@
+"""Connection pool settings and read-replica routing.
+
+`RoutingSQLAlchemy` is Flask-SQLAlchemy with two additions:
+
+- every engine (the primary and any replica) gets the DB_POOL_* settings,
+  pre-ping (so a connection the server dropped is replaced instead of
+  failing a request) and, on Postgres, a statement_timeout;
+
+- with REPLICA_DATABASE_URI set, requests to views marked `@read_only` run
+  their queries against the replica. A client that has just sent a POST
+  (or any other write) sticks to the primary for REPLICA_STICKY_SECONDS,
+  so they see their own change even while the replica lags behind.
+
+Flushes always go to the primary, so a read-only view that writes by
+mistake still writes to the right place.
+
+`call_after_commit` defers work until the session's transaction commits;
+the session is usable again by then.
+"""
+
+import time
+from functools import wraps
+
+from flask import current_app, g, has_app_context, request, session
+from flask_sqlalchemy import SignallingSession, SQLAlchemy, get_state
+from sqlalchemy import event, orm
+
+REPLICA_BIND = 'replica'
+
+# session key: until when (epoch seconds) this client reads the primary
+STICKY_KEY = 'primary_until'
+
+# session.info key: callbacks waiting for the transaction to commit
+AFTER_COMMIT_KEY = 'after_commit'
+
+# methods that don't change anything, so don't make a client sticky
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class RoutingSession(SignallingSession):
+    """Session sending a read-only request's queries to the replica."""
+
+    def get_bind(self, mapper=None, clause=None):
+        if not self._flushing and _use_replica():
+            return get_state(self.app).db.get_engine(self.app,
+                                                     bind=REPLICA_BIND)
+
+        return super().get_bind(mapper, clause)
+
+    def commit(self):
+        super().commit()
+
+        for callback in self.info.pop(AFTER_COMMIT_KEY, ()):
+            callback()
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _drop_after_commit(session):
+    session.info.pop(AFTER_COMMIT_KEY, None)
+
+
+def call_after_commit(session, callback):
+    """Call `callback()` once `session` commits; never, if it rolls back."""
+
+    session.info.setdefault(AFTER_COMMIT_KEY, []).append(callback)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy with pool tuning and a replica-aware session."""
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        result = super().apply_driver_hacks(app, sa_url, options)
+        config = app.config
+
+        options['pool_pre_ping'] = config['DB_POOL_PRE_PING']
+
+        # SQLite files get a NullPool, which takes no sizing
+        if sa_url.drivername != 'sqlite':
+            options.setdefault('pool_size', config['DB_POOL_SIZE'])
+            options.setdefault('max_overflow', config['DB_MAX_OVERFLOW'])
+            options.setdefault('pool_timeout', config['DB_POOL_TIMEOUT'])
+            options.setdefault('pool_recycle', config['DB_POOL_RECYCLE'])
+
+        timeout = config['DB_STATEMENT_TIMEOUT_MS']
+        if timeout and sa_url.drivername.startswith('postgres'):
+            connect_args = options.setdefault('connect_args', {})
+            connect_args['options'] = f'-c statement_timeout={int(timeout)}'
+
+        return result
+
+
+def _use_replica():
+    return has_app_context() and g.get('use_replica', False)
+
+
+def read_only(view):
+    """Mark a view as safe to serve from the replica."""
+
+    view.read_only = True
+    return view
+
+
+def route_request():
+    """before_request: pick the replica for read-only views."""
+
+    view = current_app.view_functions.get(request.endpoint)
+
+    g.use_replica = (
+        getattr(view, 'read_only', False)
+        and request.method in SAFE_METHODS
+        and session.get(STICKY_KEY, 0) < time.time())
+
+
+def stick_to_primary(response):
+    """after_request: after a write, read the primary for a while."""
+
+    if request.method not in SAFE_METHODS:
+        session[STICKY_KEY] = (time.time()
+                               + current_app.config['REPLICA_STICKY_SECONDS'])
+
+    return response
+
+
+def init_app(app):
+    """Set pool defaults and, with a replica configured, route reads."""
+
+    app.config.setdefault('DB_POOL_SIZE', 5)
+    app.config.setdefault('DB_MAX_OVERFLOW', 10)
+    app.config.setdefault('DB_POOL_TIMEOUT', 30)
+    app.config.setdefault('DB_POOL_RECYCLE', 1800)
+    app.config.setdefault('DB_POOL_PRE_PING', True)
+    app.config.setdefault('DB_STATEMENT_TIMEOUT_MS', 0)
+    app.config.setdefault('REPLICA_DATABASE_URI', None)
+    app.config.setdefault('REPLICA_STICKY_SECONDS', 5)
+
+    if not app.config['REPLICA_DATABASE_URI']:
+        return
+
+    binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+    binds[REPLICA_BIND] = app.config['REPLICA_DATABASE_URI']
+    app.config['SQLALCHEMY_BINDS'] = binds
+
+    app.before_request(route_request)
+    app.after_request(stick_to_primary)
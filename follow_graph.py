@@ -0,0 +1,330 @@
+"""The whole follow graph in memory, for suggestions and mutual followers.
+
+A snapshot holds the follows table twice, in compressed sparse row form:
+for "who does u follow", `out_targets[out_offsets[u]:out_offsets[u + 1]]`
+is u's followed ids, sorted; `in_offsets` / `in_targets` answer "who
+follows u" the same way. Both are flat `array`s indexed by user id: about
+8 bytes per follow plus 16 per user id, so tens of millions of follows fit
+in a few hundred MB, and a lookup is a slice.
+
+Each app has its own graph, in `app.extensions`. Follows committed by this
+process since the snapshot are kept in a small
+overlay and applied on top of it, so a user sees their own follows at once;
+with a replica, they stay there until a load begun REPLICA_STICKY_SECONDS
+after them, so one the replica hadn't caught up with isn't lost.
+Every FOLLOW_GRAPH_MAX_AGE seconds a background thread reloads the snapshot
+(from the replica, if there is one), which picks up everything else:
+other processes' follows, purges, bulk loads. Requests never wait for a
+load; until the first one finishes, the panels built on it are empty.
+
+    suggestions(user_id)            friends of friends, by mutual count
+    known_followers(viewer, user)   user's followers the viewer follows
+"""
+
+import heapq
+import logging
+import threading
+import time
+from array import array
+from collections import Counter, namedtuple
+from datetime import datetime
+
+from flask import current_app, g
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import Session, object_session
+
+from database import REPLICA_BIND
+from models import db, Follows, User
+
+logger = logging.getLogger('warbler.follow_graph')
+
+# followees whose own follows we count for a suggestion, and how many of
+# each one's follows; keeps a suggestion to milliseconds for anyone
+SCAN_FOLLOWEES = 500
+SCAN_PER_FOLLOWEE = 1000
+
+follows = Follows.__table__
+
+Suggestion = namedtuple('Suggestion', ['user', 'mutual_count'])
+KnownFollowers = namedtuple('KnownFollowers', ['users', 'count'])
+
+
+def _compress(rows, size):
+    """(offsets, targets) from (source, target) rows sorted by source."""
+
+    offsets = array('q', bytes(8 * (size + 1)))
+    targets = array('i')
+
+    for source, target in rows:
+        targets.append(target)
+        offsets[source + 1] += 1
+
+    for user_id in range(size):
+        offsets[user_id + 1] += offsets[user_id]
+
+    return offsets, targets
+
+
+class Snapshot:
+    """The follow graph as it was when loaded."""
+
+    def __init__(self, out_offsets, out_targets, in_offsets, in_targets):
+        self.out_offsets = out_offsets
+        self.out_targets = out_targets
+        self.in_offsets = in_offsets
+        self.in_targets = in_targets
+
+    @classmethod
+    def load(cls, engine):
+        """Read the follows table, streaming, along its two indexes."""
+
+        with engine.connect() as conn:
+            size = (conn.execute(select([func.max(User.id)])).scalar() or 0) + 1
+
+            def edges(source, target):
+                result = (conn
+                          .execution_options(stream_results=True)
+                          .execute(select([source, target])
+                                   .order_by(source, target)))
+                for row in result:
+                    # users created since we read the max id
+                    if row[0] < size:
+                        yield row
+
+            out = _compress(edges(follows.c.user_following_id,
+                                  follows.c.user_being_followed_id), size)
+            into = _compress(edges(follows.c.user_being_followed_id,
+                                   follows.c.user_following_id), size)
+
+        return cls(*out, *into)
+
+    @classmethod
+    def empty(cls):
+        return cls(array('q', [0]), array('i'), array('q', [0]), array('i'))
+
+    def following(self, user_id):
+        if user_id + 1 >= len(self.out_offsets):
+            return self.out_targets[0:0]
+        return self.out_targets[self.out_offsets[user_id]:
+                                self.out_offsets[user_id + 1]]
+
+    def followers(self, user_id):
+        if user_id + 1 >= len(self.in_offsets):
+            return self.in_targets[0:0]
+        return self.in_targets[self.in_offsets[user_id]:
+                               self.in_offsets[user_id + 1]]
+
+    def __len__(self):
+        return len(self.out_targets)
+
+
+class FollowGraph:
+    """The latest snapshot plus this process's follows since."""
+
+    def __init__(self, engine=None, max_age=300, lag=0):
+        self.engine = engine
+        self.max_age = max_age
+        # how far behind the primary the loaded-from database may be
+        self.lag = lag
+        self.snapshot = Snapshot.empty()
+        self.loaded_at = None
+        # wall-clock time of the same, for pages' validators
+        self.loaded_on = None
+        # (follower, followed): (present, when recorded)
+        self._overlay = {}
+        self._lock = threading.Lock()
+        self._loading = False
+
+    def refresh(self):
+        """Load a new snapshot now (in this thread)."""
+
+        started = time.monotonic()
+        started_on = datetime.utcnow()
+        snapshot = Snapshot.load(self.engine)
+
+        with self._lock:
+            self.snapshot = snapshot
+            self.loaded_at = started
+            self.loaded_on = started_on
+            # changes committed `lag` before the load began are in it now;
+            # a lagging replica may not have the later ones yet
+            self._overlay = {edge: change
+                             for edge, change in self._overlay.items()
+                             if change[1] >= started - self.lag}
+
+    def refresh_if_stale(self):
+        """Start a background reload if the snapshot is old (or missing)."""
+
+        with self._lock:
+            fresh = (self.loaded_at is not None and
+                     time.monotonic() - self.loaded_at < self.max_age)
+            if fresh or self._loading or self.engine is None:
+                return
+            self._loading = True
+
+        threading.Thread(target=self._load_in_background,
+                         name='follow-graph', daemon=True).start()
+
+    def _load_in_background(self):
+        try:
+            self.refresh()
+        except Exception:
+            logger.exception("follow graph load failed")
+        finally:
+            self._loading = False
+
+    def record(self, follower_id, followed_id, present):
+        """Note a committed follow (present=True) or unfollow."""
+
+        with self._lock:
+            self._overlay[follower_id, followed_id] = (present,
+                                                       time.monotonic())
+
+    def _changes(self, user_id, column):
+        """{other user: present} from the overlay, for one side of `user_id`."""
+
+        with self._lock:
+            return {edge[1 - column]: present
+                    for edge, (present, _) in self._overlay.items()
+                    if edge[column] == user_id}
+
+    def following(self, user_id):
+        """Set of ids `user_id` follows."""
+
+        ids = set(self.snapshot.following(user_id))
+        for other, present in self._changes(user_id, 0).items():
+            (ids.add if present else ids.discard)(other)
+        return ids
+
+    def followers(self, user_id):
+        """Set of ids following `user_id`."""
+
+        ids = set(self.snapshot.followers(user_id))
+        for other, present in self._changes(user_id, 1).items():
+            (ids.add if present else ids.discard)(other)
+        return ids
+
+    def suggestions(self, user_id, limit=5):
+        """[(user id, mutual count)]: people followed by the people
+        `user_id` follows, most shared first, not already followed."""
+
+        following = self.following(user_id)
+        counts = Counter()
+
+        for followee in sorted(following)[:SCAN_FOLLOWEES]:
+            # a slice of the array; Counter counts it in C
+            counts.update(self.snapshot.following(followee)
+                          [:SCAN_PER_FOLLOWEE])
+            for other, present in self._changes(followee, 0).items():
+                if present:
+                    counts[other] += 1
+
+        for skip in following | {user_id}:
+            counts.pop(skip, None)
+
+        return heapq.nlargest(limit, counts.items(),
+                              key=lambda item: (item[1], -item[0]))
+
+    def known_followers(self, viewer_id, user_id):
+        """Sorted ids of `user_id`'s followers whom `viewer_id` follows."""
+
+        return sorted(self.following(viewer_id)
+                      .intersection(self.followers(user_id)))
+
+
+@event.listens_for(Follows, 'after_insert')
+def _follow_added(mapper, connection, follow):
+    _pending(follow).append((follow.user_following_id,
+                             follow.user_being_followed_id, True))
+
+
+@event.listens_for(Follows, 'after_delete')
+def _follow_removed(mapper, connection, follow):
+    _pending(follow).append((follow.user_following_id,
+                             follow.user_being_followed_id, False))
+
+
+def _pending(follow):
+    return object_session(follow).info.setdefault('follow_changes', [])
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_pending(session):
+    changes = session.info.pop('follow_changes', ())
+
+    # Flask-SQLAlchemy sessions know their app
+    app = getattr(session, 'app', None)
+    graph = app.extensions.get('follow_graph') if app else None
+
+    if graph is not None:
+        for change in changes:
+            graph.record(*change)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _drop_pending(session):
+    session.info.pop('follow_changes', None)
+
+
+def follow_graph():
+    """The current app's FollowGraph."""
+
+    return current_app.extensions['follow_graph']
+
+
+def suggestions(user_id, limit=5):
+    """[Suggestion(user, mutual_count)] for `user_id`'s home page."""
+
+    graph = follow_graph()
+    graph.refresh_if_stale()
+    ranked = graph.suggestions(user_id, limit)
+    users = _users_by_id([candidate for candidate, _ in ranked])
+
+    # deleted (or purged) since the snapshot: just left out
+    return [Suggestion(users[candidate], count)
+            for candidate, count in ranked if candidate in users]
+
+
+def known_followers(user, shown=3):
+    """KnownFollowers(first `shown` users, count) of `user`'s followers
+    the logged-in user follows; for the badge on profiles."""
+
+    if not g.user or g.user.id == user.id:
+        return KnownFollowers([], 0)
+
+    graph = follow_graph()
+    graph.refresh_if_stale()
+    ids = graph.known_followers(g.user.id, user.id)
+    users = _users_by_id(ids[:shown])
+
+    return KnownFollowers([users[i] for i in ids[:shown] if i in users],
+                          len(ids))
+
+
+def _users_by_id(user_ids):
+    """{id: User} by primary key, in one query."""
+
+    if not user_ids:
+        return {}
+
+    return {user.id: user
+            for user in User.query.filter(User.id.in_(user_ids))}
+
+
+def init_app(app):
+    """Load the graph from `app`'s database (its replica, if it has one)."""
+
+    app.config.setdefault('FOLLOW_GRAPH_MAX_AGE', 300)
+    app.config.setdefault('FOLLOW_SUGGESTIONS', 5)
+
+    if app.config.get('REPLICA_DATABASE_URI'):
+        # as far behind as database.py lets a reader's own writes be
+        bind, lag = REPLICA_BIND, app.config['REPLICA_STICKY_SECONDS']
+    else:
+        bind, lag = None, 0
+
+    app.extensions['follow_graph'] = FollowGraph(
+        db.get_engine(app, bind=bind), app.config['FOLLOW_GRAPH_MAX_AGE'],
+        lag)
+
+    app.jinja_env.globals['known_followers'] = known_followers
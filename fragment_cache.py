@@ -0,0 +1,121 @@
+"""Cache of rendered message list items.
+
+Every viewer of the home feed or a profile gets the same `<li>` markup for
+a message, give or take two bits: whether they've liked it and whether it's
+their own (no like button). `message_item` renders messages/item.html once
+per (message, author name/avatar, liked, own) and serves repeats from a
+bounded LRU.
+
+The author's username and avatar are part of the key, so a profile edit can
+never serve a stale item, even in a worker process that didn't see the
+edit; `invalidate_message` / `invalidate_author` just free the entries.
+
+Each app has its own cache, `message_fragments()` in a request.
+"""
+
+import threading
+from collections import OrderedDict
+
+from flask import current_app, g
+from markupsafe import Markup
+
+ITEM_TEMPLATE = 'messages/item.html'
+
+
+class FragmentCache:
+    """Thread-safe LRU of rendered fragments, indexed by message and author."""
+
+    def __init__(self, maxsize=5000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._by_message = {}
+        self._by_author = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                self._entries.move_to_end(key)
+            except KeyError:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            return self._entries[key]
+
+    def set(self, key, message_id, author_id, html):
+        with self._lock:
+            self._entries[key] = html
+            self._entries.move_to_end(key)
+            self._by_message.setdefault(message_id, set()).add(key)
+            self._by_author.setdefault(author_id, set()).add(key)
+
+            while len(self._entries) > self.maxsize:
+                oldest, _ = self._entries.popitem(last=False)
+                self._forget(oldest)
+
+    def invalidate_message(self, message_id):
+        with self._lock:
+            for key in self._by_message.pop(message_id, ()):
+                self._entries.pop(key, None)
+                self._forget(key)
+
+    def invalidate_author(self, author_id):
+        with self._lock:
+            for key in self._by_author.pop(author_id, ()):
+                self._entries.pop(key, None)
+                self._forget(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_message.clear()
+            self._by_author.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _forget(self, key):
+        message_id, author_id = key[0], key[1]
+        for index, owner in ((self._by_message, message_id),
+                             (self._by_author, author_id)):
+            keys = index.get(owner)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del index[owner]
+
+
+def init_app(app):
+    """Size the cache from FRAGMENT_CACHE_SIZE and expose `message_item`."""
+
+    app.extensions['fragment_cache'] = FragmentCache(
+        app.config.get('FRAGMENT_CACHE_SIZE', 5000))
+    app.jinja_env.globals['message_item'] = message_item
+
+
+def message_fragments():
+    """The current app's FragmentCache."""
+
+    return current_app.extensions['fragment_cache']
+
+
+def message_item(msg, liked):
+    """Rendered list item for `msg` (with its `user` loaded) for this viewer."""
+
+    own = g.user is not None and g.user.id == msg.user_id
+    author = msg.user
+    key = (msg.id, author.id, author.username, author.image_url,
+           bool(liked), own)
+
+    cache = message_fragments()
+    html = cache.get(key)
+
+    if html is None:
+        template = current_app.jinja_env.get_template(ITEM_TEMPLATE)
+        html = Markup(template.render(msg=msg, liked=liked, own=own))
+        cache.set(key, msg.id, author.id, html)
+
+    return html
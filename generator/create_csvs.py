@@ -2,29 +2,62 @@
 
 Students won't need to run this for the exercise; they will just use the CSV
 files that this generates. You should only need to run this if you wanted to
-tweak the CSV formats or generate fewer/more rows.
+tweak the CSV formats or generate fewer/more rows, e.g. a production-sized
+dataset to load with `flask load-data`:
+
+    python generator/create_csvs.py --users 2000000 --workers 8
+
+Output is the same for the same --seed, whatever the number of workers: rows
+are made in fixed-size chunks, each with its own seeded random generator,
+and written in order as they come back. Nothing needs the network, and
+memory stays flat however many rows you ask for.
+
+The shapes aim at what a real social site looks like:
+
+- who gets followed, who posts and which messages get liked all follow
+  power laws (a few accounts get most of the attention);
+- posting times cluster in bursts rather than being spread evenly.
+
+Users and messages are numbered by row from 1, which is how follows.csv and
+likes.csv refer to them.
 """
 
+import argparse
 import csv
-from random import choice, randint, sample
-from itertools import permutations
-import requests
+import io
+import os
+from datetime import datetime
+from multiprocessing import Pool
+from random import Random
+
 from faker import Faker
-from helpers import get_random_datetime
+from helpers import get_bursts, get_random_datetime, spread, zipf_rank
 
 MAX_WARBLER_LENGTH = 140
 
 USERS_CSV_HEADERS = ['email', 'username', 'image_url', 'password', 'bio', 'header_image_url', 'location']
 MESSAGES_CSV_HEADERS = ['text', 'timestamp', 'user_id']
 FOLLOWS_CSV_HEADERS = ['user_being_followed_id', 'user_following_id']
+LIKES_CSV_HEADERS = ['user_id', 'message_id']
 
 NUM_USERS = 300
 NUM_MESSAGES = 1000
-NUM_FOLLWERS = 5000
+FOLLOWS_PER_USER = 16
+LIKES_PER_USER = 10
 
-fake = Faker()
+# rows per unit of work; part of what --seed reproduces, so don't vary it
+CHUNK_SIZE = 5000
 
-# Generate random profile image URLs to use for users
+# how skewed attention is (1/rank**exponent)
+FOLLOWED_EXPONENT = 1.1
+POSTING_EXPONENT = 0.9
+LIKED_EXPONENT = 1.1
+
+# posting spikes over the two years of messages
+NUM_BURSTS = 40
+
+# everyone's password is "password"
+PASSWORD = '$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe'
 
 image_urls = [
     f"https://randomuser.me/api/portraits/{kind}/{i}.jpg"
@@ -32,46 +65,141 @@ image_urls = [
     for i in range(count)
 ]
 
-# Generate random header image URLs to use for users
-
 header_image_urls = [
-    requests.get(f"http://www.splashbase.co/api/v1/images/{i}").json()['url']
-    for i in range(1, 46)
+    "/static/images/warbler-hero.jpg",
+    "/static/images/signed-out-home.jpg",
 ]
 
-with open('generator/users.csv', 'w') as users_csv:
-    users_writer = csv.DictWriter(users_csv, fieldnames=USERS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for i in range(NUM_USERS):
-        users_writer.writerow(dict(
-            email=fake.email(),
-            username=fake.user_name(),
-            image_url=choice(image_urls),
-            password='$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe',
-            bio=fake.sentence(),
-            header_image_url=choice(header_image_urls),
-            location=fake.city()
-        ))
-
-with open('generator/messages.csv', 'w') as messages_csv:
-    messages_writer = csv.DictWriter(messages_csv, fieldnames=MESSAGES_CSV_HEADERS)
-    messages_writer.writeheader()
-
-    for i in range(NUM_MESSAGES):
-        messages_writer.writerow(dict(
-            text=fake.paragraph()[:MAX_WARBLER_LENGTH],
-            timestamp=get_random_datetime(),
-            user_id=randint(1, NUM_USERS)
-        ))
-
-# Generate follows.csv from random pairings of users
-
-with open('generator/follows.csv', 'w') as follows_csv:
-    all_pairs = list(permutations(range(1, NUM_USERS + 1), 2))
-
-    users_writer = csv.DictWriter(follows_csv, fieldnames=FOLLOWS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for followed_user, follower in sample(all_pairs, NUM_FOLLWERS):
-        users_writer.writerow(dict(user_being_followed_id=followed_user, user_following_id=follower))
+
+def users_chunk(rng, fake, start, stop, options):
+    for n in range(start, stop):
+        # the row number keeps names unique at any size
+        username = f"{fake.user_name()}{n}"
+        yield [
+            f"{username}@{fake.free_email_domain()}",
+            username,
+            rng.choice(image_urls),
+            PASSWORD,
+            fake.sentence(),
+            rng.choice(header_image_urls),
+            fake.city(),
+        ]
+
+
+def message_author(message_id, options):
+    """User id of a message's author.
+
+    Drawn from the message's own seeded generator, so likes_chunk can tell
+    who wrote a message without the messages having been made.
+    """
+
+    rng = Random(f"{options.seed}-author-{message_id}")
+    return spread(zipf_rank(options.users, POSTING_EXPONENT, rng),
+                  options.users, salt=1)
+
+
+def messages_chunk(rng, fake, start, stop, options):
+    for n in range(start, stop):
+        yield [
+            fake.paragraph()[:MAX_WARBLER_LENGTH],
+            get_random_datetime(now=options.end, rng=rng,
+                                bursts=options.bursts),
+            message_author(n + 1, options),
+        ]
+
+
+def _picks(rng, mean, n, exponent, salt, exclude=None):
+    """A set of about `mean` (exponentially distributed) popular ids.
+
+    `exclude(id)` says which ids may not be picked.
+    """
+
+    wanted = min(int(rng.expovariate(1 / mean)), n - 1) if mean else 0
+    picked = set()
+
+    for _ in range(wanted * 2):
+        if len(picked) == wanted:
+            break
+        pick = spread(zipf_rank(n, exponent, rng), n, salt)
+        if exclude is None or not exclude(pick):
+            picked.add(pick)
+
+    return sorted(picked)
+
+
+def follows_chunk(rng, fake, start, stop, options):
+    for follower in range(start + 1, stop + 1):
+        for followed in _picks(rng, options.follows_per_user, options.users,
+                               FOLLOWED_EXPONENT, salt=0,
+                               exclude=lambda pick: pick == follower):
+            yield [followed, follower]
+
+
+def likes_chunk(rng, fake, start, stop, options):
+    for user in range(start + 1, stop + 1):
+        # nobody likes their own messages
+        for message in _picks(
+                rng, options.likes_per_user, options.messages,
+                LIKED_EXPONENT, salt=2,
+                exclude=lambda pick: message_author(pick, options) == user):
+            yield [user, message]
+
+
+# file, headers, what makes a chunk of rows, and the option counting them
+TABLES = [
+    ('users.csv', USERS_CSV_HEADERS, users_chunk, 'users'),
+    ('messages.csv', MESSAGES_CSV_HEADERS, messages_chunk, 'messages'),
+    ('follows.csv', FOLLOWS_CSV_HEADERS, follows_chunk, 'users'),
+    ('likes.csv', LIKES_CSV_HEADERS, likes_chunk, 'users'),
+]
+
+
+def make_chunk(task):
+    """CSV text for rows [start, stop) of one table."""
+
+    make_rows, start, stop, options = task
+    rng = Random(f"{options.seed}-{make_rows.__name__}-{start}")
+    fake = Faker()
+    fake.seed_instance(rng.getrandbits(32))
+
+    out = io.StringIO()
+    csv.writer(out).writerows(make_rows(rng, fake, start, stop, options))
+    return out.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate Warbler CSVs.")
+    parser.add_argument('--users', type=int, default=NUM_USERS)
+    parser.add_argument('--messages', type=int, default=NUM_MESSAGES)
+    parser.add_argument('--follows-per-user', type=float,
+                        default=FOLLOWS_PER_USER)
+    parser.add_argument('--likes-per-user', type=float,
+                        default=LIKES_PER_USER)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--out', default='generator')
+    parser.add_argument('--end', type=datetime.fromisoformat,
+                        default=datetime(2020, 1, 1),
+                        help="Latest message time (default 2020-01-01).")
+    options = parser.parse_args()
+
+    options.bursts = get_bursts(NUM_BURSTS, now=options.end,
+                                rng=Random(f"{options.seed}-bursts"))
+
+    with Pool(options.workers) as pool:
+        for filename, headers, make_rows, count in TABLES:
+            total = getattr(options, count)
+            tasks = [(make_rows, start, min(start + CHUNK_SIZE, total), options)
+                     for start in range(0, total, CHUNK_SIZE)]
+
+            with open(os.path.join(options.out, filename), 'w',
+                      newline='') as out:
+                csv.writer(out).writerow(headers)
+                for chunk in pool.imap(make_chunk, tasks):
+                    out.write(chunk)
+
+            print(f"Wrote {filename}.")
+
+
+if __name__ == '__main__':
+    main()
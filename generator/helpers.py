@@ -1,14 +1,75 @@
 """Support functions for CSV generation."""
 
-from datetime import datetime
-from random import uniform
+import random
+from datetime import datetime, timedelta
+from functools import lru_cache
+from math import floor, gcd
 
+# share of posts that land in a burst rather than at a quiet moment
+BURST_SHARE = 0.7
 
-def get_random_datetime(year_gap=2):
-    """Get a random datetime within the last few years."""
 
-    now = datetime.now()
+def get_random_datetime(year_gap=2, now=None, rng=random, bursts=()):
+    """Get a random datetime within the last few years.
+
+    With `bursts` (datetimes, e.g. from `get_bursts`) most times cluster a
+    few hours around one of them, the way real posting spikes around events;
+    the rest are spread evenly. Pass `now` and a seeded `rng` for
+    reproducible output.
+    """
+
+    now = now or datetime.now()
     then = now.replace(year=now.year - year_gap)
-    random_timestamp = uniform(then.timestamp(), now.timestamp())
+
+    if bursts and rng.random() < BURST_SHARE:
+        moment = (rng.choice(bursts)
+                  + timedelta(hours=rng.gauss(0, 3))).timestamp()
+        random_timestamp = min(max(moment, then.timestamp()), now.timestamp())
+    else:
+        random_timestamp = rng.uniform(then.timestamp(), now.timestamp())
 
     return datetime.fromtimestamp(random_timestamp)
+
+
+def get_bursts(count, year_gap=2, now=None, rng=random):
+    """`count` burst centres for `get_random_datetime`."""
+
+    return [get_random_datetime(year_gap, now, rng) for _ in range(count)]
+
+
+def zipf_rank(n, exponent, rng=random):
+    """A rank in 1..n, drawn with probability proportional to 1/rank**exponent.
+
+    Uses the inverse CDF of the continuous approximation, so it's O(1) in
+    time and memory however big `n` is.
+    """
+
+    u = rng.random()
+
+    if exponent == 1:
+        return min(n, int(floor(n ** u)))
+
+    a = 1 - exponent
+    return min(n, int(floor(((n ** a - 1) * u + 1) ** (1 / a))))
+
+
+def spread(rank, n, salt):
+    """Map a popularity rank in 1..n onto an id in 1..n.
+
+    Otherwise the most popular users would simply be the first ids. This is
+    a fixed permutation (multiplication by a number coprime to n), so it
+    needs no table.
+    """
+
+    step = _coprime_step(n, salt)
+    return (rank * step + salt) % n + 1
+
+
+@lru_cache()
+def _coprime_step(n, salt):
+    step = (2654435761 + salt) % n or 1
+
+    while gcd(step, n) != 1:
+        step += 1
+
+    return step
@@ -0,0 +1,114 @@
+"""Conditional GET support (ETag / Last-Modified) and per-route caching.
+
+A view wrapped in `@conditional(validators)` first calls
+`validators(**view_args)`: a cheap function returning the parts its page
+depends on (ids, change stamps) plus a last-modified time. If the client's
+If-None-Match / If-Modified-Since still matches, we answer 304 without
+running the view or rendering its template.
+
+Pages differ per viewer, so responses are `private, no-cache` (a browser may
+keep them but must revalidate) and vary on the session cookie. Routes can
+set their own policy with `@cache_control(...)`; anything that sets none
+gets the old no-store headers in `apply_default_cache_headers`.
+"""
+
+from functools import wraps
+from hashlib import sha1
+
+from flask import Response, g, make_response, request, session
+
+# for views that don't choose a policy
+DEFAULT_CACHE_CONTROL = 'no-cache, no-store, must-revalidate'
+
+
+def viewer_stamp():
+    """The logged-in user's part of a page's validators.
+
+    Their username/avatar is in the nav bar, and their follows and likes
+    change buttons on the page; all of those bump `updated_at`.
+    """
+
+    if not g.user:
+        return None, None
+
+    return (g.user.id, g.user.updated_at), g.user.updated_at
+
+
+def make_etag(parts):
+    return sha1(repr(parts).encode('utf-8')).hexdigest()
+
+
+def _not_modified(etag, last_modified):
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+
+    if request.if_modified_since and last_modified:
+        # HTTP dates only carry whole seconds
+        return (last_modified.replace(microsecond=0) <=
+                request.if_modified_since.replace(tzinfo=None))
+
+    return False
+
+
+def conditional(validators):
+    """Decorate a GET view with ETag / Last-Modified handling.
+
+    `validators(**view_args)` returns (parts, last_modified), or None when
+    the page shouldn't be validated (e.g. it's about to 404 or redirect).
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            # pending flash messages make this render unlike any other
+            result = None if '_flashes' in session else validators(**kwargs)
+
+            if result is None:
+                return view(**kwargs)
+
+            parts, last_modified = result
+            viewer, viewer_modified = viewer_stamp()
+            etag = make_etag((request.full_path, parts, viewer))
+            last_modified = max(filter(None, [last_modified, viewer_modified]),
+                                default=None)
+
+            if _not_modified(etag, last_modified):
+                response = Response(status=304)
+            else:
+                response = make_response(view(**kwargs))
+
+            response.set_etag(etag)
+            response.last_modified = last_modified
+            response.headers['Cache-Control'] = 'private, no-cache'
+            response.vary.add('Cookie')
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def cache_control(value):
+    """Give a view an explicit Cache-Control header."""
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            response = make_response(view(*args, **kwargs))
+            response.headers['Cache-Control'] = value
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def apply_default_cache_headers(response):
+    """after_request hook: no-store for anything without its own policy."""
+
+    if 'Cache-Control' not in response.headers:
+        response.headers['Cache-Control'] = DEFAULT_CACHE_CONTROL
+        response.headers['Pragma'] = 'no-cache'
+        response.headers['Expires'] = '0'
+
+    return response
@@ -0,0 +1,467 @@
+"""Deferred work on a job queue kept in the database.
+
+Routes hand slow side effects (fan-out to followers, timeline backfills,
+purges) to a queue and return; `flask worker` processes run them:
+
+    @task('timelines')
+    def fan_out_to_followers(message_id): ...
+
+    enqueue(fan_out_to_followers, msg.id, key=f'fan-out:{msg.id}')
+
+`enqueue` inserts the job in the caller's transaction, so it exists exactly
+when the write that asked for it commits. Then:
+
+- key: an idempotency key; enqueueing a key that's already there (queued,
+  running, failed, or done in the last JOB_KEEP_SECONDS) does nothing
+- retries: a job that raises runs again, up to its task's max_attempts,
+  backing off exponentially from JOB_RETRY_DELAY; after that it stays
+  'failed' with its traceback for someone to look at
+- limits: JOB_QUEUES caps how many jobs of each queue run at once, across
+  every worker
+- a task's writes commit together with its job being marked done, and the
+  job of a worker that died is requeued after JOB_TIMEOUT seconds. So a
+  task may occasionally run twice, but its work commits only once.
+  Tasks that commit along the way must tolerate rerunning.
+- periodic: `@task(queue, every=3600)` is queued once an hour by the
+  workers serving its queue (the hour is in its idempotency key, so
+  however many of them ask, one job runs)
+- /metrics shows each queue's depth and how long its oldest due job has
+  been waiting
+
+On Postgres a claim is SELECT ... FOR UPDATE SKIP LOCKED under a per-queue
+advisory lock, which keeps the limits exact with many workers. SQLite takes
+one writer at a time anyway.
+
+With JOBS_EAGER on (development, tests), no worker is needed: a queued
+task runs inline, right after the transaction that queued it commits (and
+not at all if it rolls back), then commits its own work.
+"""
+
+import json
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import func, select, text
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+
+from database import call_after_commit
+from models import db, Job
+import metrics
+
+logger = logging.getLogger('warbler.jobs')
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# longest retry backoff, in seconds
+MAX_RETRY_DELAY = 3600
+
+# how often a worker requeues stale jobs and prunes old ones, in seconds
+HOUSEKEEPING_INTERVAL = 60
+
+jobs = Job.__table__
+
+# task name: Task
+tasks = {}
+
+
+class Task:
+    """A function registered to run as a job."""
+
+    def __init__(self, fn, queue, max_attempts, every=None):
+        self.fn = fn
+        self.queue = queue
+        self.max_attempts = max_attempts
+        self.every = every
+        self.name = f'{fn.__module__}.{fn.__name__}'
+
+
+def task(queue='default', max_attempts=5, every=None):
+    """Register the decorated function as a task on `queue`.
+
+    The function itself is returned unchanged, so it can still be called
+    directly; its arguments must survive a round trip through JSON. With
+    `every` (seconds), workers also queue it, without arguments, that often.
+    """
+
+    def decorator(fn):
+        spec = Task(fn, queue, max_attempts, every)
+        tasks[spec.name] = spec
+        fn.task = spec
+        return fn
+
+    return decorator
+
+
+def _insert_ignoring_duplicates():
+    """INSERT into jobs that skips a row whose key is already taken."""
+
+    dialect = db.session.get_bind(mapper=Job.__mapper__).dialect.name
+
+    if dialect == 'postgresql':
+        return (postgresql_insert(jobs)
+                .on_conflict_do_nothing(index_elements=['idempotency_key']))
+    if dialect == 'sqlite':
+        return jobs.insert().prefix_with('OR IGNORE')
+    return jobs.insert()
+
+
+def enqueue(fn, *args, key=None, delay=0):
+    """Queue `fn(*args)`; `fn` must be a @task. Doesn't commit."""
+
+    spec = fn.task
+
+    if current_app.config['JOBS_EAGER']:
+        # once the caller commits, as a worker would see it
+        call_after_commit(db.session(), lambda: _run_eager(fn, args))
+        return
+
+    now = datetime.utcnow()
+    db.session.execute(_insert_ignoring_duplicates(), {
+        'queue': spec.queue,
+        'task': spec.name,
+        'args': json.dumps(args),
+        'idempotency_key': key,
+        'state': QUEUED,
+        'attempts': 0,
+        'max_attempts': spec.max_attempts,
+        'run_at': now + timedelta(seconds=delay),
+        'created_at': now,
+    })
+
+
+def _run_eager(fn, args):
+    try:
+        fn(*args)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+class ClaimedJob:
+    """A job this worker has marked running."""
+
+    def __init__(self, id, task, args, attempts, max_attempts):
+        self.id = id
+        self.task = task
+        self.args = args
+        self.attempts = attempts
+        self.max_attempts = max_attempts
+
+
+def _is_postgres():
+    return db.session.get_bind(mapper=Job.__mapper__).dialect.name == \
+        'postgresql'
+
+
+def claim(queue, limit, worker):
+    """Mark the next due job on `queue` running for `worker` and return it.
+
+    None when nothing is due, or `limit` jobs of the queue are running.
+    Commits.
+    """
+
+    now = datetime.utcnow()
+
+    if _is_postgres():
+        # claims on one queue take turns, so two workers can't both see
+        # room under the limit; released at commit
+        db.session.execute(text('SELECT pg_advisory_xact_lock(hashtext(:q))'),
+                           {'q': f'jobs:{queue}'})
+
+    if limit:
+        running = db.session.execute(
+            select([func.count()])
+            .where(jobs.c.queue == queue)
+            .where(jobs.c.state == RUNNING)).scalar()
+        if running >= limit:
+            db.session.commit()
+            return None
+
+    row = db.session.execute(
+        select([jobs.c.id, jobs.c.task, jobs.c.args, jobs.c.attempts,
+                jobs.c.max_attempts])
+        .where(jobs.c.queue == queue)
+        .where(jobs.c.state == QUEUED)
+        .where(jobs.c.run_at <= now)
+        .order_by(jobs.c.run_at, jobs.c.id)
+        .limit(1)
+        .with_for_update(skip_locked=True)).first()
+
+    if row is None:
+        db.session.commit()
+        return None
+
+    db.session.execute(
+        jobs.update()
+        .where(jobs.c.id == row.id)
+        .values(state=RUNNING, locked_by=worker, locked_at=now,
+                attempts=row.attempts + 1))
+    db.session.commit()
+
+    return ClaimedJob(row.id, row.task, json.loads(row.args),
+                      row.attempts + 1, row.max_attempts)
+
+
+def perform(job, worker):
+    """Run a claimed job, then mark it done or schedule its retry.
+
+    Returns True if it succeeded.
+    """
+
+    mine = (jobs.c.id == job.id) & (jobs.c.locked_by == worker)
+
+    try:
+        spec = tasks.get(job.task)
+        if spec is None:
+            raise LookupError(f"no task named {job.task!r}")
+
+        spec.fn(*job.args)
+
+        result = db.session.execute(
+            jobs.update().where(mine)
+            .values(state=DONE, finished_at=datetime.utcnow(),
+                    locked_by=None, locked_at=None))
+        if result.rowcount == 0:
+            # requeued as stale while we ran; the rerun does the work
+            db.session.rollback()
+            return False
+
+        db.session.commit()
+        return True
+
+    except Exception:
+        db.session.rollback()
+        logger.exception("job %s (%s) failed, attempt %s of %s",
+                         job.id, job.task, job.attempts, job.max_attempts)
+
+        now = datetime.utcnow()
+        if job.attempts >= job.max_attempts:
+            values = {'state': FAILED, 'finished_at': now}
+        else:
+            values = {'state': QUEUED, 'run_at': now + retry_delay(job)}
+
+        db.session.execute(
+            jobs.update().where(mine)
+            .values(locked_by=None, locked_at=None,
+                    last_error=traceback.format_exc(), **values))
+        db.session.commit()
+        return False
+
+
+def retry_delay(job):
+    """Exponential backoff after the job's `attempts`th failure."""
+
+    seconds = current_app.config['JOB_RETRY_DELAY'] * 2 ** (job.attempts - 1)
+    return timedelta(seconds=min(seconds, MAX_RETRY_DELAY))
+
+
+def requeue_stale(timeout):
+    """Put running jobs whose worker went quiet `timeout` seconds ago back
+    on their queue (or fail them, if that was their last attempt)."""
+
+    stale = ((jobs.c.state == RUNNING)
+             & (jobs.c.locked_at < datetime.utcnow()
+                - timedelta(seconds=timeout)))
+
+    db.session.execute(
+        jobs.update()
+        .where(stale & (jobs.c.attempts >= jobs.c.max_attempts))
+        .values(state=FAILED, finished_at=datetime.utcnow(),
+                locked_by=None, locked_at=None,
+                last_error="timed out"))
+    requeued = db.session.execute(
+        jobs.update()
+        .where(stale)
+        .values(state=QUEUED, locked_by=None, locked_at=None,
+                last_error="timed out")).rowcount
+    db.session.commit()
+    return requeued
+
+
+def prune(queues, keep):
+    """Delete done jobs that finished more than `keep` seconds ago."""
+
+    cutoff = datetime.utcnow() - timedelta(seconds=keep)
+    pruned = 0
+
+    # one queue at a time, along ix_jobs_queue_state_run_at
+    for queue in queues:
+        pruned += db.session.execute(
+            jobs.delete()
+            .where(jobs.c.queue == queue)
+            .where(jobs.c.state == DONE)
+            .where(jobs.c.run_at < cutoff)
+            .where(jobs.c.finished_at < cutoff)).rowcount
+        db.session.commit()
+
+    return pruned
+
+
+def schedule_periodic(queues):
+    """Queue the periodic tasks on `queues` for the current period."""
+
+    now = time.time()
+
+    for spec in tasks.values():
+        if spec.every and spec.queue in queues:
+            # one key per period: the first worker to ask queues it
+            enqueue(spec.fn, key=f'{spec.name}@{int(now // spec.every)}')
+
+    db.session.commit()
+
+
+class Worker:
+    """Runs jobs from `queues` (default: all of JOB_QUEUES), one at a time."""
+
+    def __init__(self, app, queues=None, name=None):
+        self.app = app
+        self.limits = app.config['JOB_QUEUES']
+        self.queues = list(queues or self.limits)
+        self.name = name or (f'{socket.gethostname()}:{os.getpid()}:'
+                             f'{threading.get_ident()}')
+        self._stopping = threading.Event()
+        self._next = 0
+
+    def work_one(self):
+        """Claim and run one job. False if no queue had one for us."""
+
+        with self.app.app_context():
+            try:
+                # start at a different queue each time, so a busy one
+                # can't starve the rest
+                order = self.queues[self._next:] + self.queues[:self._next]
+                self._next = (self._next + 1) % len(self.queues)
+
+                for queue in order:
+                    job = claim(queue, self.limits.get(queue), self.name)
+                    if job is not None:
+                        perform(job, self.name)
+                        return True
+
+                return False
+            finally:
+                db.session.remove()
+
+    def housekeeping(self):
+        with self.app.app_context():
+            try:
+                requeue_stale(self.app.config['JOB_TIMEOUT'])
+                prune(self.queues, self.app.config['JOB_KEEP_SECONDS'])
+                schedule_periodic(self.queues)
+            finally:
+                db.session.remove()
+
+    def run(self):
+        """Work until `stop` is called, polling when the queues are empty."""
+
+        poll = self.app.config['JOB_POLL_SECONDS']
+        last_housekeeping = None
+
+        while not self._stopping.is_set():
+            if (last_housekeeping is None or time.monotonic()
+                    - last_housekeeping > HOUSEKEEPING_INTERVAL):
+                self.housekeeping()
+                last_housekeeping = time.monotonic()
+
+            try:
+                busy = self.work_one()
+            except Exception:
+                # e.g. the database went away; try again after a pause
+                logger.exception("worker %s: claim failed", self.name)
+                busy = False
+
+            if not busy:
+                self._stopping.wait(poll)
+
+    def stop(self):
+        self._stopping.set()
+
+
+def work_off(app, queues=None):
+    """Run jobs until none are due; returns how many ran (for tests and
+    one-off catch-ups)."""
+
+    worker = Worker(app, queues)
+    count = 0
+    while worker.work_one():
+        count += 1
+    return count
+
+
+def run_workers(app, queues=None, threads=1):
+    """Run `threads` workers until SIGINT / SIGTERM, then let each finish
+    its current job."""
+
+    workers = [Worker(app, queues) for _ in range(threads)]
+    runners = [threading.Thread(target=worker.run, name=f'worker-{n}')
+               for n, worker in enumerate(workers)]
+
+    def stop(signum, frame):
+        for worker in workers:
+            worker.stop()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for runner in runners:
+        runner.start()
+    for runner in runners:
+        runner.join()
+
+
+def queue_depth_lines():
+    """Prometheus gauges for /metrics: jobs per queue and state, and the
+    age of each queue's oldest due job."""
+
+    now = datetime.utcnow()
+    queues = current_app.config['JOB_QUEUES']
+    depth = {(queue, state): 0 for queue in queues
+             for state in (QUEUED, RUNNING, FAILED)}
+    oldest = dict.fromkeys(queues, 0)
+
+    rows = db.session.execute(
+        select([jobs.c.queue, jobs.c.state, func.count(),
+                func.min(jobs.c.run_at)])
+        .where(jobs.c.state.in_([QUEUED, RUNNING, FAILED]))
+        .group_by(jobs.c.queue, jobs.c.state))
+
+    for queue, state, count, first_run_at in rows:
+        depth[queue, state] = count
+        if state == QUEUED and first_run_at is not None:
+            oldest[queue] = max(0, (now - first_run_at).total_seconds())
+
+    lines = ['# HELP warbler_job_queue_depth Jobs by queue and state.',
+             '# TYPE warbler_job_queue_depth gauge']
+    lines.extend(f'warbler_job_queue_depth{{queue="{queue}",state="{state}"}}'
+                 f' {count}' for (queue, state), count in sorted(depth.items()))
+    lines.extend([
+        '# HELP warbler_job_queue_oldest_seconds '
+        'How long the oldest due job has waited.',
+        '# TYPE warbler_job_queue_oldest_seconds gauge'])
+    lines.extend(f'warbler_job_queue_oldest_seconds{{queue="{queue}"}} '
+                 f'{seconds:.1f}' for queue, seconds in sorted(oldest.items()))
+    return lines
+
+
+def init_app(app):
+    """Job queue settings, and its gauges on /metrics."""
+
+    app.config.setdefault('JOB_QUEUES', {'default': 2})
+    app.config.setdefault('JOB_POLL_SECONDS', 1)
+    app.config.setdefault('JOB_TIMEOUT', 600)
+    app.config.setdefault('JOB_RETRY_DELAY', 5)
+    app.config.setdefault('JOB_KEEP_SECONDS', 86400)
+    app.config.setdefault('JOBS_EAGER', False)
+
+    metrics.registry.add_collector(queue_depth_lines)
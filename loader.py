@@ -0,0 +1,288 @@
+"""Bulk loading of CSV fixtures: users, messages, follows and likes.
+
+The CSVs (see generator/) number users and messages by row, starting at 1,
+and follows/likes refer to them by those numbers. We stream each file
+straight into the database with Postgres COPY: rows are transformed as COPY
+reads them, so neither the file nor per-row dicts are ever held in memory.
+Other databases get chunked executemany inserts instead.
+
+A fresh load (the default) drops and recreates every table and builds the
+secondary indexes only after the data is in, which is much cheaper than
+maintaining them row by row. `append=True` keeps the existing data and
+indexes and shifts the file's ids past the highest ids already present.
+
+Either way, sequences are moved past the loaded ids, and home timelines and
+counters are rebuilt for the loaded users.
+"""
+
+import csv
+import io
+import time
+from collections import namedtuple
+from itertools import islice
+from os import path
+
+from dateutil.parser import isoparse
+from sqlalchemy import DateTime, Integer, func, select, text
+
+from models import db, Follows, Likes, Message, TimelineEntry, User
+import counters
+import migrations
+import timeline
+
+# file, model, and which columns hold row numbers from which other file;
+# in load order (a file only refers to the ones before it)
+FILES = [
+    ('users.csv', User, {}),
+    ('messages.csv', Message, {'user_id': User}),
+    ('follows.csv', Follows, {'user_being_followed_id': User,
+                              'user_following_id': User}),
+    ('likes.csv', Likes, {'user_id': User, 'message_id': Message}),
+]
+
+# rows encoded per refill of the COPY stream
+ROWS_PER_READ = 1000
+
+# columns left NULL, not given their model default, when a file leaves
+# them out: a like's time is unknown, and "now" would make them all trend
+NULL_WHEN_MISSING = {Likes: {'created_at'}}
+
+LoadStat = namedtuple('LoadStat', ['table', 'rows', 'seconds'])
+
+
+def format_stat(stat):
+    if stat.rows is None:
+        return f"{stat.table}: {stat.seconds:.2f}s"
+
+    rate = stat.rows / stat.seconds if stat.seconds else 0
+    return (f"{stat.table}: {stat.rows} rows in {stat.seconds:.2f}s "
+            f"({rate:,.0f} rows/s)")
+
+
+class CSVStream:
+    """Read-only file object that encodes `rows` as CSV on demand.
+
+    COPY pulls from it a few kilobytes at a time, so only the rows for the
+    current read are ever in memory.
+    """
+
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self._buffer = ''
+
+    def _fill(self, size):
+        while size < 0 or len(self._buffer) < size:
+            out = io.StringIO()
+            writer = csv.writer(out)
+            writer.writerows(islice(self._rows, ROWS_PER_READ))
+
+            if not out.tell():
+                return
+
+            self._buffer += out.getvalue()
+
+    def read(self, size=-1):
+        self._fill(size)
+
+        if size < 0:
+            size = len(self._buffer)
+
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def readline(self, size=-1):
+        self._fill(-1 if size < 0 else size)
+        end = self._buffer.find('\n') + 1 or len(self._buffer)
+        return self.read(min(end, size) if size >= 0 else end)
+
+
+class Source:
+    """One CSV file's rows, renumbered and ready for its table.
+
+    `offsets` maps a model to the amount its row numbers are shifted by.
+    """
+
+    def __init__(self, csv_file, model, refs, offsets):
+        self.table = model.__table__
+        self.reader = csv.reader(csv_file)
+        header = next(self.reader)
+
+        # users and messages get explicit ids so the other files' row
+        # numbers point at them
+        numbered = 'id' in self.table.c and 'id' not in header
+        self.id_offset = offsets[model] if numbered else None
+
+        self.ref_offsets = [(position, offsets[refs[name]])
+                            for position, name in enumerate(header)
+                            if name in refs]
+
+        # columns the file leaves out get their model defaults
+        unknown = NULL_WHEN_MISSING.get(model, set())
+        self.defaults = {name: (None if name in unknown
+                                else _default_value(column))
+                         for name, column in self.table.c.items()
+                         if name not in header and name != 'id'
+                         and column.default is not None}
+
+        self.columns = (['id'] if numbered else []) + header + list(
+            self.defaults)
+        self.count = 0
+
+    def rows(self):
+        """Lists of column values; an empty field is NULL."""
+
+        defaults = list(self.defaults.values())
+
+        for number, row in enumerate(self.reader, start=1):
+            values = [value or None for value in row]
+
+            for position, offset in self.ref_offsets:
+                values[position] = int(values[position]) + offset
+
+            if self.id_offset is not None:
+                values.insert(0, self.id_offset + number)
+
+            self.count += 1
+            yield values + defaults
+
+
+def _default_value(column):
+    default = column.default.arg
+    # callable defaults (like datetime.utcnow) are wrapped to take a context
+    return default(None) if column.default.is_callable else default
+
+
+def _parser(column):
+    """Turn a CSV string into what `column`'s DB-API parameter expects."""
+
+    if isinstance(column.type, DateTime):
+        return isoparse
+    if isinstance(column.type, Integer):
+        return int
+    return lambda value: value
+
+
+def copy_rows(engine, source):
+    """COPY `source` into its table on Postgres."""
+
+    stream = CSVStream(source.rows())
+    conn = engine.raw_connection()
+
+    try:
+        cursor = conn.cursor()
+        cursor.copy_expert(
+            f"COPY {source.table.name} ({', '.join(source.columns)}) "
+            f"FROM STDIN WITH (FORMAT csv)", stream)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def insert_rows(engine, source, batch_size):
+    """Insert `source` in executemany batches of `batch_size` rows."""
+
+    parsers = [_parser(source.table.c[name]) for name in source.columns]
+    rows = source.rows()
+
+    with engine.begin() as conn:
+        while True:
+            batch = [{name: parse(value) if isinstance(value, str) else value
+                      for name, parse, value
+                      in zip(source.columns, parsers, row)}
+                     for row in islice(rows, batch_size)]
+            if not batch:
+                return
+
+            conn.execute(source.table.insert(), batch)
+
+
+def _secondary_indexes():
+    """The models' declared indexes (not keys or unique constraints)."""
+
+    models = [model for _, model, _ in FILES] + [TimelineEntry]
+    return [index for model in models for index in model.__table__.indexes]
+
+
+def _reset_sequences(engine):
+    """Move the id sequences past ids we inserted explicitly."""
+
+    if engine.dialect.name != 'postgresql':
+        return
+
+    for model in (User, Message):
+        table = model.__tablename__
+        engine.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+            f"coalesce(max(id), 1), max(id) IS NOT NULL) FROM {table}"))
+
+
+def load(engine, directory, append=False, batch_size=5000):
+    """Load the CSVs in `directory` (likes.csv is optional).
+
+    Returns a LoadStat per file loaded, then ones for building indexes and
+    for rebuilding timelines and counters.
+    """
+
+    is_postgres = engine.dialect.name == 'postgresql'
+    db.session.remove()
+
+    if append:
+        offsets = {model: engine.execute(
+                       select([func.coalesce(func.max(model.id), 0)])).scalar()
+                   for model in (User, Message)}
+    else:
+        offsets = {User: 0, Message: 0}
+
+        engine.execute(text(
+            f'DROP TABLE IF EXISTS {migrations.MIGRATIONS_TABLE}'))
+        db.drop_all()
+        db.create_all()
+
+        for index in _secondary_indexes():
+            engine.execute(text(f'DROP INDEX IF EXISTS {index.name}'))
+
+    stats = []
+
+    for name, model, refs in FILES:
+        filename = path.join(directory, name)
+        if not path.exists(filename):
+            continue
+
+        start = time.perf_counter()
+
+        with open(filename, newline='') as csv_file:
+            source = Source(csv_file, model, refs, offsets)
+            if is_postgres:
+                copy_rows(engine, source)
+            else:
+                insert_rows(engine, source, batch_size)
+
+        stats.append(LoadStat(source.table.name, source.count,
+                              time.perf_counter() - start))
+
+    start = time.perf_counter()
+
+    if not append:
+        for index in _secondary_indexes():
+            index.create(bind=engine)
+        # record every revision, and build the indexes only they define
+        migrations.upgrade(engine)
+
+    _reset_sequences(engine)
+
+    if is_postgres:
+        engine.execute(text('ANALYZE'))
+
+    stats.append(LoadStat('indexes', None, time.perf_counter() - start))
+    start = time.perf_counter()
+
+    new_users = db.session.query(User.id).filter(User.id > offsets[User])
+    for (user_id,) in new_users.all():
+        timeline.rebuild_timeline(user_id)
+    db.session.commit()
+
+    counters.recompute_counters(batch_size)
+
+    stats.append(LoadStat('timelines and counters', new_users.count(),
+                          time.perf_counter() - start))
+    return stats
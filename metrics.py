@@ -0,0 +1,224 @@
+"""Per-endpoint request metrics, exposed in Prometheus text format.
+
+For a sample of requests (METRICS_SAMPLE_RATE, 0 to 1) we record, per
+endpoint:
+
+- warbler_request_seconds: wall-clock time of the whole request
+- warbler_request_queries: SQL statements it sent
+- warbler_request_db_seconds: time spent waiting on those statements
+- warbler_request_render_seconds: time spent in render_template
+
+as histograms, served at /metrics. Queries per request is the one to watch
+as data grows: a route whose count climbs with the size of a page or a
+user's history has an N+1 in it.
+
+Unsampled requests cost one random() call; with the rate at 0 nothing is
+recorded at all. Each worker process keeps its own numbers, so scrape every
+worker (or run one per container).
+"""
+
+import logging
+import random
+import threading
+import time
+from bisect import bisect_left
+
+from flask import Response, current_app, g, has_request_context, request
+from flask import before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger('warbler.metrics')
+
+SECONDS_BUCKETS = [.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10]
+QUERY_BUCKETS = [1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144, 233]
+
+# name: (help, buckets)
+HISTOGRAMS = {
+    'warbler_request_seconds': ("Request latency.", SECONDS_BUCKETS),
+    'warbler_request_queries': ("SQL statements per request.", QUERY_BUCKETS),
+    'warbler_request_db_seconds': ("Time waiting on SQL per request.",
+                                   SECONDS_BUCKETS),
+    'warbler_request_render_seconds': ("Template rendering per request.",
+                                       SECONDS_BUCKETS),
+}
+
+
+class Histogram:
+    """Counts of observations at or below each bucket bound."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)   # the last is +Inf
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name, labels):
+        cumulative = 0
+        bounds = [str(bound) for bound in self.buckets] + ['+Inf']
+
+        for bound, count in zip(bounds, self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+
+        yield f'{name}_sum{{{labels}}} {self.sum}'
+        yield f'{name}_count{{{labels}}} {self.count}'
+
+
+class Registry:
+    """Histograms by (metric name, endpoint)."""
+
+    def __init__(self):
+        self._histograms = {}
+        self._lock = threading.Lock()
+        # functions returning extra exposition lines (e.g. gauges read
+        # from the database), called on every scrape
+        self.collectors = []
+
+    def add_collector(self, collector):
+        if collector not in self.collectors:
+            self.collectors.append(collector)
+
+    def observe(self, name, endpoint, value):
+        with self._lock:
+            histogram = self._histograms.get((name, endpoint))
+            if histogram is None:
+                histogram = self._histograms[name, endpoint] = Histogram(
+                    HISTOGRAMS[name][1])
+            histogram.observe(value)
+
+    def get(self, name, endpoint):
+        return self._histograms.get((name, endpoint))
+
+    def clear(self):
+        with self._lock:
+            self._histograms.clear()
+
+    def render(self):
+        """The Prometheus text exposition of every histogram."""
+
+        lines = []
+
+        with self._lock:
+            for name, (help_text, _) in HISTOGRAMS.items():
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} histogram')
+
+                for (metric, endpoint), histogram in sorted(
+                        self._histograms.items()):
+                    if metric == name:
+                        lines.extend(histogram.lines(
+                            name, f'endpoint="{endpoint}"'))
+
+        for collector in self.collectors:
+            # the histograms are worth serving even with the database down
+            try:
+                lines.extend(collector())
+            except Exception:
+                logger.exception("metrics collector %s failed",
+                                 collector.__name__)
+
+        return '\n'.join(lines) + '\n'
+
+
+class RequestStats:
+    """What one sampled request has cost so far."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.db_seconds = 0
+        self.render_seconds = 0
+        self.render_start = None
+
+
+registry = Registry()
+
+
+def _current_stats():
+    if has_request_context():
+        return g.get('_request_stats')
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    if _current_stats() is not None:
+        context._metrics_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    stats = _current_stats()
+    start = getattr(context, '_metrics_start', None)
+    if stats is not None and start is not None:
+        stats.queries += 1
+        stats.db_seconds += time.perf_counter() - start
+
+
+def _before_render(sender, template, context, **extra):
+    stats = _current_stats()
+    if stats is not None:
+        stats.render_start = time.perf_counter()
+
+
+def _after_render(sender, template, context, **extra):
+    stats = _current_stats()
+    if stats is not None and stats.render_start is not None:
+        stats.render_seconds += time.perf_counter() - stats.render_start
+        stats.render_start = None
+
+
+def start_request():
+    """before_request: maybe sample this request."""
+
+    rate = current_app.config['METRICS_SAMPLE_RATE']
+    if rate and random.random() < rate:
+        g._request_stats = RequestStats()
+
+
+def finish_request(exc=None):
+    """teardown_request: record a sampled request's costs."""
+
+    stats = g.pop('_request_stats', None)
+    if stats is None or request.endpoint == 'metrics':
+        return
+
+    endpoint = request.endpoint or 'unmatched'
+    registry.observe('warbler_request_seconds', endpoint,
+                     time.perf_counter() - stats.start)
+    registry.observe('warbler_request_queries', endpoint, stats.queries)
+    registry.observe('warbler_request_db_seconds', endpoint, stats.db_seconds)
+    registry.observe('warbler_request_render_seconds', endpoint,
+                     stats.render_seconds)
+
+
+def metrics_view():
+    """GET /metrics: this worker's histograms."""
+
+    return Response(registry.render(),
+                    mimetype='text/plain; version=0.0.4')
+
+
+def init_app(app):
+    """Install the request hooks and the /metrics endpoint on `app`."""
+
+    app.config.setdefault('METRICS_SAMPLE_RATE', 0)
+
+    # class-level listeners cover every engine the app uses; they
+    # are process-wide, so only add them once
+    if not event.contains(Engine, 'before_cursor_execute',
+                          _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_after_render, app)
+
+    app.before_request(start_request)
+    app.teardown_request(finish_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
@@ -0,0 +1,212 @@
+"""Versioned schema migrations.
+
+`db.create_all()` only creates tables that are missing; it can't add an
+index or a column to a database that's already live. Each module in
+`migrations/versions/` is one revision:
+
+    revision = '0002'
+
+    def upgrade(op): ...
+    def downgrade(op): ...
+
+and the revisions applied to a database are recorded in `schema_migrations`.
+Operations are idempotent (IF [NOT] EXISTS), so a revision that died half
+way can simply be run again, and running them against a database made by
+`db.create_all()` is harmless.
+
+Run them with `flask db upgrade` / `flask db downgrade --to <revision>`.
+"""
+
+import importlib
+import pkgutil
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+
+from migrations import versions
+
+MIGRATIONS_TABLE = 'schema_migrations'
+
+# downgrade target meaning "before the first revision"
+BASE = '0000'
+
+
+class Operations:
+    """Schema operations handed to each revision's upgrade/downgrade.
+
+    On Postgres, indexes are built and dropped CONCURRENTLY so a live table
+    keeps taking writes; that can't happen inside a transaction, so those
+    statements run on an autocommit connection.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.is_postgres = engine.dialect.name == 'postgresql'
+
+    def execute(self, sql, **params):
+        """Run one statement in its own transaction."""
+
+        with self.engine.begin() as conn:
+            return conn.execute(text(sql), **params)
+
+    def autocommit(self, sql, **params):
+        """Run one statement outside any transaction."""
+
+        with self.engine.connect() as conn:
+            conn = conn.execution_options(isolation_level='AUTOCOMMIT')
+            return conn.execute(text(sql), **params)
+
+    def has_column(self, table, column):
+        columns = inspect(self.engine).get_columns(table)
+        return any(c['name'] == column for c in columns)
+
+    def add_column(self, table, column, ddl):
+        """ALTER TABLE `table` ADD COLUMN `column` `ddl`, unless it exists."""
+
+        if not self.has_column(table, column):
+            self.execute(f'ALTER TABLE {table} ADD COLUMN {column} {ddl}')
+
+    def drop_column(self, table, column):
+        if self.has_column(table, column):
+            self.execute(f'ALTER TABLE {table} DROP COLUMN {column}')
+
+    def create_index(self, name, table, columns, unique=False, using=None,
+                     where=None):
+        """Create an index; `columns` may carry opclasses, e.g.
+        'username gin_trgm_ops'. `using` only applies on Postgres; `where`
+        makes it a partial index."""
+
+        unique = 'UNIQUE ' if unique else ''
+        columns = ', '.join(columns)
+        where = f' WHERE {where}' if where else ''
+
+        if self.is_postgres:
+            # a failed concurrent build leaves an INVALID index behind that
+            # IF NOT EXISTS would happily skip
+            self._drop_invalid_index(name)
+            using = f' USING {using}' if using else ''
+            self.autocommit(
+                f'CREATE {unique}INDEX CONCURRENTLY IF NOT EXISTS {name} '
+                f'ON {table}{using} ({columns}){where}')
+        else:
+            self.execute(
+                f'CREATE {unique}INDEX IF NOT EXISTS {name} '
+                f'ON {table} ({columns}){where}')
+
+    def drop_index(self, name):
+        if self.is_postgres:
+            self.autocommit(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+        else:
+            self.execute(f'DROP INDEX IF EXISTS {name}')
+
+    def _drop_invalid_index(self, name):
+        invalid = self.execute(
+            'SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid '
+            'WHERE c.relname = :name AND NOT i.indisvalid',
+            name=name).first()
+
+        if invalid:
+            self.drop_index(name)
+
+
+def load_revisions():
+    """All revision modules, oldest first."""
+
+    revisions = [importlib.import_module(f'migrations.versions.{info.name}')
+                 for info in pkgutil.iter_modules(versions.__path__)]
+
+    return sorted(revisions, key=lambda module: module.revision)
+
+
+def applied_revisions(engine):
+    """Set of revision ids already applied to `engine`'s database."""
+
+    with engine.begin() as conn:
+        conn.execute(text(
+            f'CREATE TABLE IF NOT EXISTS {MIGRATIONS_TABLE} ('
+            'revision VARCHAR(32) PRIMARY KEY, '
+            'applied_at TIMESTAMP NOT NULL)'))
+        rows = conn.execute(text(f'SELECT revision FROM {MIGRATIONS_TABLE}'))
+        return {revision for (revision,) in rows}
+
+
+def upgrade(engine, target=None):
+    """Apply every pending revision up to `target` (default: all).
+
+    Returns the revision ids that were applied.
+    """
+
+    done = applied_revisions(engine)
+    op = Operations(engine)
+    ran = []
+
+    for module in load_revisions():
+        if module.revision in done:
+            continue
+        if target is not None and module.revision > target:
+            break
+
+        module.upgrade(op)
+        op.execute(
+            f'INSERT INTO {MIGRATIONS_TABLE} (revision, applied_at) '
+            'VALUES (:revision, :now)',
+            revision=module.revision, now=datetime.utcnow())
+        ran.append(module.revision)
+
+    return ran
+
+
+def downgrade(engine, target=BASE):
+    """Revert applied revisions newer than `target`, newest first.
+
+    Returns the revision ids that were reverted.
+    """
+
+    done = applied_revisions(engine)
+    op = Operations(engine)
+    ran = []
+
+    for module in reversed(load_revisions()):
+        if module.revision <= target:
+            break
+        if module.revision not in done:
+            continue
+
+        module.downgrade(op)
+        op.execute(f'DELETE FROM {MIGRATIONS_TABLE} WHERE revision = :revision',
+                   revision=module.revision)
+        ran.append(module.revision)
+
+    return ran
+
+
+def unindexed_hot_queries(engine, models):
+    """Check each model's `hot_query_keys` against the live indexes.
+
+    A key is a tuple of columns one of our hot queries filters/sorts by; it
+    is covered when some index (or the primary key / a unique constraint)
+    starts with exactly those columns. Returns a list of
+    (table, key) pairs that nothing covers.
+    """
+
+    inspector = inspect(engine)
+    missing = []
+
+    for model in models:
+        keys = getattr(model, 'hot_query_keys', ())
+        if not keys:
+            continue
+
+        table = model.__tablename__
+        prefixes = [tuple(index['column_names'])
+                    for index in inspector.get_indexes(table)]
+        prefixes.append(tuple(
+            inspector.get_pk_constraint(table)['constrained_columns']))
+        prefixes.extend(tuple(unique['column_names'])
+                        for unique in inspector.get_unique_constraints(table))
+
+        for key in keys:
+            if not any(prefix[:len(key)] == tuple(key) for prefix in prefixes):
+                missing.append((table, tuple(key)))
+
+    return missing
@@ -0,0 +1,24 @@
+"""Per-user home timelines (fan-out on write)."""
+
+revision = '0001'
+
+
+def upgrade(op):
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS timeline_entries (
+            user_id INTEGER NOT NULL
+                REFERENCES users (id) ON DELETE CASCADE,
+            message_id INTEGER NOT NULL
+                REFERENCES messages (id) ON DELETE CASCADE,
+            timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            PRIMARY KEY (user_id, message_id)
+        )
+    """)
+    op.create_index('ix_timeline_entries_user_id_timestamp',
+                    'timeline_entries', ['user_id', 'timestamp'])
+    op.create_index('ix_timeline_entries_message_id',
+                    'timeline_entries', ['message_id'])
+
+
+def downgrade(op):
+    op.execute('DROP TABLE IF EXISTS timeline_entries')
@@ -0,0 +1,22 @@
+"""Indexes for the profile feed, follower lists and likes lookups."""
+
+revision = '0002'
+
+
+def upgrade(op):
+    # users_show: WHERE user_id = ? ORDER BY timestamp DESC
+    op.create_index('ix_messages_user_id_timestamp',
+                    'messages', ['user_id', 'timestamp'])
+    # the primary key leads with user_being_followed_id, so "who does this
+    # user follow" needs its own index
+    op.create_index('ix_follows_user_following_id',
+                    'follows', ['user_following_id'])
+    # "has this user liked this message" / a user's likes page
+    op.create_index('ix_likes_user_id_message_id',
+                    'likes', ['user_id', 'message_id'])
+
+
+def downgrade(op):
+    op.drop_index('ix_likes_user_id_message_id')
+    op.drop_index('ix_follows_user_following_id')
+    op.drop_index('ix_messages_user_id_timestamp')
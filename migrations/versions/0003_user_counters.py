@@ -0,0 +1,28 @@
+"""Denormalized message/follower/following/like counts on users."""
+
+revision = '0003'
+
+COUNTERS = {
+    'messages_count': 'SELECT count(*) FROM messages '
+                      'WHERE messages.user_id = users.id',
+    'followers_count': 'SELECT count(*) FROM follows '
+                       'WHERE follows.user_being_followed_id = users.id',
+    'following_count': 'SELECT count(*) FROM follows '
+                       'WHERE follows.user_following_id = users.id',
+    'likes_count': 'SELECT count(*) FROM likes '
+                   'WHERE likes.user_id = users.id',
+}
+
+
+def upgrade(op):
+    for column in COUNTERS:
+        op.add_column('users', column, 'INTEGER NOT NULL DEFAULT 0')
+
+    assignments = ', '.join(f'{column} = ({query})'
+                            for column, query in COUNTERS.items())
+    op.execute(f'UPDATE users SET {assignments}')
+
+
+def downgrade(op):
+    for column in reversed(list(COUNTERS)):
+        op.drop_column('users', column)
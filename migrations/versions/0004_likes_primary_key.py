@@ -0,0 +1,104 @@
+"""Key likes on (user_id, message_id) instead of a surrogate id."""
+
+revision = '0004'
+
+
+def upgrade(op):
+    if op.has_column('likes', 'id'):
+        # keep the oldest of any duplicate likes before enforcing uniqueness
+        op.execute("""
+            DELETE FROM likes
+            WHERE id NOT IN (SELECT min(id) FROM likes
+                             GROUP BY user_id, message_id)
+        """)
+
+        if op.is_postgres:
+            # build the new key's index without blocking writes, then swap
+            # it in
+            op.create_index('likes_user_id_message_id_key', 'likes',
+                            ['user_id', 'message_id'], unique=True)
+
+            # SET NOT NULL alone scans the whole table under an ACCESS
+            # EXCLUSIVE lock. Prove it with CHECKs first: added NOT VALID
+            # (no scan), then validated under a lock that lets writes
+            # through; Postgres 12+ then skips the scan
+            op.execute("""
+                ALTER TABLE likes
+                    DROP CONSTRAINT IF EXISTS likes_user_id_not_null,
+                    DROP CONSTRAINT IF EXISTS likes_message_id_not_null,
+                    ADD CONSTRAINT likes_user_id_not_null
+                        CHECK (user_id IS NOT NULL) NOT VALID,
+                    ADD CONSTRAINT likes_message_id_not_null
+                        CHECK (message_id IS NOT NULL) NOT VALID
+            """)
+            for check in ('likes_user_id_not_null',
+                          'likes_message_id_not_null'):
+                op.execute(f'ALTER TABLE likes VALIDATE CONSTRAINT {check}')
+
+            # catalog changes only, so the exclusive lock is brief
+            op.execute("""
+                ALTER TABLE likes
+                    DROP CONSTRAINT likes_pkey,
+                    DROP COLUMN id,
+                    ALTER COLUMN user_id SET NOT NULL,
+                    ALTER COLUMN message_id SET NOT NULL
+            """)
+            # not in the statement above: its drops would run before the
+            # SET NOT NULLs could use them
+            op.execute("""
+                ALTER TABLE likes
+                    DROP CONSTRAINT likes_user_id_not_null,
+                    DROP CONSTRAINT likes_message_id_not_null
+            """)
+            op.execute("""
+                ALTER TABLE likes
+                    ADD CONSTRAINT likes_pkey PRIMARY KEY
+                        USING INDEX likes_user_id_message_id_key
+            """)
+        else:
+            _rebuild(op, """
+                user_id INTEGER NOT NULL
+                    REFERENCES users (id) ON DELETE CASCADE,
+                message_id INTEGER NOT NULL
+                    REFERENCES messages (id) ON DELETE CASCADE,
+                PRIMARY KEY (user_id, message_id)
+            """, 'user_id, message_id')
+
+        op.execute("""
+            UPDATE users SET likes_count = (SELECT count(*) FROM likes
+                                            WHERE likes.user_id = users.id)
+        """)
+
+    # the primary key now covers (user_id, message_id)
+    op.drop_index('ix_likes_user_id_message_id')
+    op.create_index('ix_likes_message_id', 'likes', ['message_id'])
+
+
+def downgrade(op):
+    op.drop_index('ix_likes_message_id')
+
+    if not op.has_column('likes', 'id'):
+        if op.is_postgres:
+            op.execute("""
+                ALTER TABLE likes
+                    DROP CONSTRAINT likes_pkey,
+                    ADD COLUMN id SERIAL PRIMARY KEY
+            """)
+        else:
+            _rebuild(op, """
+                id INTEGER PRIMARY KEY,
+                user_id INTEGER REFERENCES users (id) ON DELETE CASCADE,
+                message_id INTEGER REFERENCES messages (id) ON DELETE CASCADE
+            """, 'user_id, message_id')
+
+    op.create_index('ix_likes_user_id_message_id', 'likes',
+                    ['user_id', 'message_id'])
+
+
+def _rebuild(op, columns, copied):
+    """Recreate likes with new `columns` (SQLite can't alter a primary key)."""
+
+    op.execute(f'CREATE TABLE likes_new ({columns})')
+    op.execute(f'INSERT INTO likes_new ({copied}) SELECT {copied} FROM likes')
+    op.execute('DROP TABLE likes')
+    op.execute('ALTER TABLE likes_new RENAME TO likes')
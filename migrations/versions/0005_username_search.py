@@ -0,0 +1,22 @@
+"""Indexes for case-insensitive username search."""
+
+revision = '0005'
+
+
+def upgrade(op):
+    if op.is_postgres:
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        # LIKE '%term%'
+        op.create_index('ix_users_username_trgm', 'users',
+                        ['lower(username) gin_trgm_ops'], using='gin')
+        # LIKE 'term%' and exact matches, whatever the collation
+        op.create_index('ix_users_username_prefix', 'users',
+                        ['lower(username) text_pattern_ops'])
+    else:
+        op.create_index('ix_users_username_prefix', 'users',
+                        ['lower(username)'])
+
+
+def downgrade(op):
+    op.drop_index('ix_users_username_prefix')
+    op.drop_index('ix_users_username_trgm')
@@ -0,0 +1,17 @@
+"""Index follows by (follower, followed) for paging the following list."""
+
+revision = '0006'
+
+
+def upgrade(op):
+    # the following page walks a user's follows in followed-id order;
+    # this supersedes the single-column index from 0002
+    op.create_index('ix_follows_user_following_id_followed_id', 'follows',
+                    ['user_following_id', 'user_being_followed_id'])
+    op.drop_index('ix_follows_user_following_id')
+
+
+def downgrade(op):
+    op.create_index('ix_follows_user_following_id', 'follows',
+                    ['user_following_id'])
+    op.drop_index('ix_follows_user_following_id_followed_id')
@@ -0,0 +1,16 @@
+"""Per-user change stamp for HTTP validators."""
+
+revision = '0007'
+
+
+def upgrade(op):
+    if op.is_postgres:
+        now = "(now() AT TIME ZONE 'utc')"
+    else:
+        now = 'CURRENT_TIMESTAMP'
+
+    op.add_column('users', 'updated_at', f'TIMESTAMP NOT NULL DEFAULT {now}')
+
+
+def downgrade(op):
+    op.drop_column('users', 'updated_at')
@@ -0,0 +1,22 @@
+"""Soft-delete stamps on users and messages, indexed for the purge."""
+
+revision = '0008'
+
+
+def upgrade(op):
+    # nullable with no default: no table rewrite on Postgres
+    op.add_column('users', 'deleted_at', 'TIMESTAMP')
+    op.add_column('messages', 'deleted_at', 'TIMESTAMP')
+
+    # partial, so they only hold the rows waiting to be purged
+    op.create_index('ix_users_deleted_at', 'users', ['deleted_at'],
+                    where='deleted_at IS NOT NULL')
+    op.create_index('ix_messages_deleted_at', 'messages', ['deleted_at'],
+                    where='deleted_at IS NOT NULL')
+
+
+def downgrade(op):
+    op.drop_index('ix_messages_deleted_at')
+    op.drop_index('ix_users_deleted_at')
+    op.drop_column('messages', 'deleted_at')
+    op.drop_column('users', 'deleted_at')
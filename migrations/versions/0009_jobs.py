@@ -0,0 +1,33 @@
+"""Job queue table for deferred work."""
+
+revision = '0009'
+
+
+def upgrade(op):
+    key = 'SERIAL PRIMARY KEY' if op.is_postgres else 'INTEGER PRIMARY KEY'
+
+    op.execute(f"""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id {key},
+            queue TEXT NOT NULL,
+            task TEXT NOT NULL,
+            args TEXT NOT NULL,
+            idempotency_key TEXT UNIQUE,
+            state TEXT NOT NULL,
+            attempts INTEGER NOT NULL,
+            max_attempts INTEGER NOT NULL,
+            run_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            locked_by TEXT,
+            locked_at TIMESTAMP WITHOUT TIME ZONE,
+            last_error TEXT,
+            created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            finished_at TIMESTAMP WITHOUT TIME ZONE
+        )
+    """)
+    # workers look for the next due job of a queue along this
+    op.create_index('ix_jobs_queue_state_run_at', 'jobs',
+                    ['queue', 'state', 'run_at'])
+
+
+def downgrade(op):
+    op.execute('DROP TABLE IF EXISTS jobs')
@@ -0,0 +1,26 @@
+"""Like timestamps, and per-message like counts in time buckets."""
+
+revision = '0010'
+
+
+def upgrade(op):
+    # existing likes keep a NULL: their time is unknown, and guessing
+    # "now" would make every old message trend
+    op.add_column('likes', 'created_at', 'TIMESTAMP')
+
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS like_buckets (
+            message_id INTEGER NOT NULL
+                REFERENCES messages (id) ON DELETE CASCADE,
+            bucket TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            likes INTEGER NOT NULL,
+            PRIMARY KEY (message_id, bucket)
+        )
+    """)
+    # a window's counts are one range of this
+    op.create_index('ix_like_buckets_bucket', 'like_buckets', ['bucket'])
+
+
+def downgrade(op):
+    op.execute('DROP TABLE IF EXISTS like_buckets')
+    op.drop_column('likes', 'created_at')
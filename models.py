@@ -1,13 +1,16 @@
 """SQLAlchemy models for Warbler."""
 
+from collections import namedtuple
 from datetime import datetime
 
-from flask_bcrypt import Bcrypt
-from flask_sqlalchemy import SQLAlchemy
+from database import RoutingSQLAlchemy
+import passwords
+from passwords import bcrypt
 
 
-bcrypt = Bcrypt()
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
+
+FollowState = namedtuple('FollowState', ['following', 'followed_by'])
 
 
 class Follows(db.Model):
@@ -27,27 +30,56 @@ class Follows(db.Model):
         primary_key=True,
     )
 
+    __table_args__ = (
+        db.Index('ix_follows_user_following_id_followed_id',
+                 'user_following_id', 'user_being_followed_id'),
+    )
+
+    # columns our hot queries look rows up by; `flask db check` fails
+    # unless an index starts with each of these
+    hot_query_keys = [
+        ('user_being_followed_id', 'user_following_id'),
+        ('user_following_id', 'user_being_followed_id'),
+    ]
+
 
 class Likes(db.Model):
-    """Mapping user likes to warbles."""
+    """Mapping user likes to warbles.
 
-    __tablename__ = 'likes'
+    The (user_id, message_id) primary key means a user can like a message
+    at most once, and makes "has this user liked it" one index probe.
+    """
 
-    id = db.Column(
-        db.Integer,
-        primary_key=True
-    )
+    __tablename__ = 'likes'
 
     user_id = db.Column(
         db.Integer,
-        db.ForeignKey('users.id', ondelete='cascade')
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
     )
 
     message_id = db.Column(
         db.Integer,
-        db.ForeignKey('messages.id', ondelete='cascade')
+        db.ForeignKey('messages.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    # when it was liked, for trending.py; NULL for likes from before this
+    # was recorded
+    created_at = db.Column(
+        db.DateTime,
+        default=datetime.utcnow,
+    )
+
+    __table_args__ = (
+        db.Index('ix_likes_message_id', 'message_id'),
     )
 
+    hot_query_keys = [
+        ('user_id', 'message_id'),
+        ('message_id',),
+    ]
+
 
 class User(db.Model):
     """User in the system."""
@@ -94,6 +126,49 @@ class User(db.Model):
         nullable=False,
     )
 
+    # bumped whenever anything shown on this user's pages changes (their
+    # profile, counts, follows or likes); used for HTTP validators
+    updated_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    # denormalized counts, kept current by counters.py
+    messages_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    followers_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    following_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    likes_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    # set when the account is deleted; the row is hidden from every ORM
+    # query from then on and purged later (see soft_delete.py)
+    deleted_at = db.Column(
+        db.DateTime,
+    )
+
     messages = db.relationship('Message')
 
     followers = db.relationship(
@@ -115,31 +190,93 @@ class User(db.Model):
         secondary="likes"
     )
 
+    __table_args__ = (
+        # only the few deleted rows, for the purge to find
+        db.Index('ix_users_deleted_at', 'deleted_at',
+                 postgresql_where=db.text('deleted_at IS NOT NULL'),
+                 sqlite_where=db.text('deleted_at IS NOT NULL')),
+    )
+
+    hot_query_keys = [
+        ('username',),
+        ('deleted_at',),
+    ]
+
     def __repr__(self):
         return f"<User #{self.id}: {self.username}, {self.email}>"
 
     def is_followed_by(self, other_user):
-        """Is this user followed by `other_user`?"""
+        """Is this user followed by `other_user`?
+
+        Looks up the follows primary key rather than loading `followers`.
+        """
 
-        found_user_list = [
-            user for user in self.followers if user == other_user]
-        return len(found_user_list) == 1
+        return Follows.query.get((self.id, other_user.id)) is not None
 
     def is_following(self, other_user):
-        """Is this user following `other_use`?"""
+        """Is this user following `other_user`?
+
+        Looks up the follows primary key rather than loading `following`.
+        """
+
+        return Follows.query.get((other_user.id, self.id)) is not None
+
+    def liked_message_ids(self, message_ids):
+        """The subset of `message_ids` this user has liked, as a set."""
+
+        message_ids = list(message_ids)
+
+        if not message_ids:
+            return set()
+
+        rows = (db.session
+                .query(Likes.message_id)
+                .filter(Likes.user_id == self.id,
+                        Likes.message_id.in_(message_ids)))
 
-        found_user_list = [
-            user for user in self.following if user == other_user]
-        return len(found_user_list) == 1
+        return {message_id for (message_id,) in rows}
+
+    def follow_states(self, user_ids):
+        """Follow state between this user and each of `user_ids`.
+
+        Returns {user_id: FollowState(following, followed_by)} for every id,
+        from a single query, for pages that show a Follow button per user.
+        """
+
+        user_ids = list(user_ids)
+        states = {user_id: FollowState(False, False) for user_id in user_ids}
+
+        if not user_ids:
+            return states
+
+        rows = (db.session
+                .query(Follows.user_being_followed_id,
+                       Follows.user_following_id)
+                .filter(db.or_(
+                    db.and_(Follows.user_following_id == self.id,
+                            Follows.user_being_followed_id.in_(user_ids)),
+                    db.and_(Follows.user_being_followed_id == self.id,
+                            Follows.user_following_id.in_(user_ids))))
+                .all())
+
+        for followed_id, follower_id in rows:
+            if follower_id == self.id:
+                states[followed_id] = states[followed_id]._replace(
+                    following=True)
+            if followed_id == self.id:
+                states[follower_id] = states[follower_id]._replace(
+                    followed_by=True)
+
+        return states
 
     @classmethod
     def signup(cls, username, email, password, image_url):
         """Sign up user.
 
-        Hashes password and adds user to system.
+        Hashes password (on the hashing pool) and adds user to system.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = passwords.hash_password(password)
 
         user = User(
             username=username,
@@ -160,13 +297,19 @@ class User(db.Model):
         and, if it finds such a user, returns that user object.
 
         If can't find matching user (or if password is wrong), returns False.
+
+        If the stored hash was made with a different work factor than the
+        configured one, it's replaced with a fresh hash; the caller's next
+        commit saves it.
         """
 
         user = cls.query.filter_by(username=username).first()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = passwords.check_password(user.password, password)
             if is_auth:
+                if passwords.needs_rehash(user.password):
+                    user.password = passwords.hash_password(password)
                 return user
 
         return False
@@ -190,7 +333,7 @@ class Message(db.Model):
     timestamp = db.Column(
         db.DateTime,
         nullable=False,
-        default=datetime.utcnow(),
+        default=datetime.utcnow,
     )
 
     user_id = db.Column(
@@ -199,8 +342,184 @@ class Message(db.Model):
         nullable=False,
     )
 
+    # set when the message (or its author) is deleted; see soft_delete.py
+    deleted_at = db.Column(
+        db.DateTime,
+    )
+
     user = db.relationship('User')
 
+    __table_args__ = (
+        db.Index('ix_messages_user_id_timestamp', 'user_id', 'timestamp'),
+        db.Index('ix_messages_deleted_at', 'deleted_at',
+                 postgresql_where=db.text('deleted_at IS NOT NULL'),
+                 sqlite_where=db.text('deleted_at IS NOT NULL')),
+    )
+
+    hot_query_keys = [
+        ('user_id', 'timestamp'),
+        ('deleted_at',),
+    ]
+
+
+class TimelineEntry(db.Model):
+    """A message fanned out to one reader's home timeline."""
+
+    __tablename__ = 'timeline_entries'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    # copied from the message so the home page can read one index range
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+    __table_args__ = (
+        db.Index('ix_timeline_entries_user_id_timestamp',
+                 'user_id', 'timestamp'),
+        db.Index('ix_timeline_entries_message_id', 'message_id'),
+    )
+
+    hot_query_keys = [
+        ('user_id', 'timestamp'),
+        ('message_id',),
+    ]
+
+
+class Job(db.Model):
+    """A piece of deferred work on a queue (see jobs.py)."""
+
+    __tablename__ = 'jobs'
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
+
+    queue = db.Column(
+        db.Text,
+        nullable=False,
+    )
+
+    # registered task name and its JSON-encoded positional arguments
+    task = db.Column(
+        db.Text,
+        nullable=False,
+    )
+
+    args = db.Column(
+        db.Text,
+        nullable=False,
+        default='[]',
+    )
+
+    # enqueueing a key that's already here does nothing
+    idempotency_key = db.Column(
+        db.Text,
+        unique=True,
+    )
+
+    # queued, running, done or failed
+    state = db.Column(
+        db.Text,
+        nullable=False,
+        default='queued',
+    )
+
+    attempts = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+    )
+
+    max_attempts = db.Column(
+        db.Integer,
+        nullable=False,
+        default=5,
+    )
+
+    # not picked up before this (a retry backs off by pushing it forward)
+    run_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    locked_by = db.Column(
+        db.Text,
+    )
+
+    locked_at = db.Column(
+        db.DateTime,
+    )
+
+    last_error = db.Column(
+        db.Text,
+    )
+
+    created_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    finished_at = db.Column(
+        db.DateTime,
+    )
+
+    __table_args__ = (
+        db.Index('ix_jobs_queue_state_run_at', 'queue', 'state', 'run_at'),
+    )
+
+    hot_query_keys = [
+        ('queue', 'state', 'run_at'),
+        ('idempotency_key',),
+    ]
+
+
+class LikeBucket(db.Model):
+    """Likes a message got in one short span of time (see trending.py)."""
+
+    __tablename__ = 'like_buckets'
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    # start of the span
+    bucket = db.Column(
+        db.DateTime,
+        primary_key=True,
+    )
+
+    likes = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+    )
+
+    __table_args__ = (
+        db.Index('ix_like_buckets_bucket', 'bucket'),
+    )
+
+    hot_query_keys = [
+        ('message_id', 'bucket'),
+        ('bucket',),
+    ]
+
 
 def connect_db(app):
     """Connect this database to provided Flask app.
@@ -208,5 +527,8 @@ def connect_db(app):
     You should call this in your Flask app.
     """
 
-    db.app = app
+    # the app used outside any app context: the first one, not whichever
+    # create_app built last
+    if db.app is None:
+        db.app = app
     db.init_app(app)
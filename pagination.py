@@ -0,0 +1,307 @@
+"""Keyset (cursor) pagination.
+
+Pages are addressed by the sort key of the row at their edge instead of an
+OFFSET, so page 1,000 costs the same index range scan as page 1. Keys are a
+tuple of columns ending in something unique (usually the primary key) so
+rows sharing a timestamp are never skipped or repeated.
+
+Cursors travel in the querystring as `?before=` / `?after=`; "before" means
+"sorts lower than", so with a newest-first list it points at older rows.
+
+`stream` / `stream_request` give the same pages as a StreamedPage, which
+reads its rows from a server-side cursor as a streamed template reaches
+them (see streaming.py).
+"""
+
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+
+from flask import abort, request, url_for
+from sqlalchemy import tuple_
+
+PER_PAGE = 100
+
+# rows per round trip when a page is streamed from a server-side cursor
+STREAM_CHUNK = 50
+
+DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+class InvalidCursor(ValueError):
+    """A cursor from the querystring could not be decoded."""
+
+
+def encode_cursor(values):
+    """Turn a sort key tuple into an opaque, URL-safe string."""
+
+    parts = []
+    for value in values:
+        if isinstance(value, datetime):
+            parts.append(['d', value.strftime(DATETIME_FORMAT)])
+        else:
+            parts.append(value)
+
+    raw = json.dumps(parts, separators=(',', ':')).encode('utf-8')
+    return urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def _key_type(key):
+    """Python type of a sort key column's values, or None if unknown."""
+
+    try:
+        return key.type.python_type
+    except NotImplementedError:
+        return None
+
+
+def decode_cursor(cursor, keys=None):
+    """Inverse of `encode_cursor`; raises InvalidCursor on garbage.
+
+    Given the `keys` being paginated on, a cursor must also hold one value
+    of the right type per key, so a tampered one can't reach the query.
+    """
+
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        parts = json.loads(urlsafe_b64decode(padded.encode('ascii')))
+
+        values = []
+        for part in parts:
+            if isinstance(part, list):
+                values.append(datetime.strptime(part[1], DATETIME_FORMAT))
+            else:
+                values.append(part)
+
+    except (ValueError, TypeError, IndexError) as exc:
+        raise InvalidCursor(cursor) from exc
+
+    if keys is not None:
+        if len(values) != len(keys):
+            raise InvalidCursor(cursor)
+
+        for value, key in zip(values, keys):
+            expected = _key_type(key)
+            # JSON has no bool/int split of its own to trust
+            if isinstance(value, bool) or (
+                    expected is not None and not isinstance(value, expected)):
+                raise InvalidCursor(cursor)
+
+    return tuple(values)
+
+
+class Page:
+    """One page of rows plus the querystring args for its neighbours.
+
+    `next_args` / `prev_args` are None when there is nothing in that
+    direction; otherwise they're dicts like {'before': '<cursor>'}.
+    """
+
+    def __init__(self, items, next_args=None, prev_args=None):
+        self.items = items
+        self.next_args = next_args
+        self.prev_args = prev_args
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def _window(query, keys, before, after, descending):
+    """`query` filtered to one side of the cursor and ordered to walk away
+    from it, plus whether that walk runs against the display order."""
+
+    key = tuple_(*keys)
+    # walking "towards" the cursor (prev page) means reading the index
+    # backwards and flipping the rows afterwards
+    backwards = after is not None if descending else before is not None
+
+    if before is not None:
+        query = query.filter(key < tuple_(*before))
+    elif after is not None:
+        query = query.filter(key > tuple_(*after))
+
+    if descending != backwards:
+        query = query.order_by(None).order_by(*[k.desc() for k in keys])
+    else:
+        query = query.order_by(None).order_by(*[k.asc() for k in keys])
+
+    return query, backwards
+
+
+def _neighbour_args(first_key, last_key, has_more, from_cursor, backwards,
+                    descending):
+    """(next_args, prev_args) for a page running from `first_key` to
+    `last_key` in display order."""
+
+    # whichever way we walked, a cursor means there's a page behind us
+    has_next = from_cursor if backwards else has_more
+    has_prev = has_more if backwards else from_cursor
+
+    forward, reverse = ('before', 'after') if descending else ('after', 'before')
+
+    next_args = {forward: encode_cursor(last_key)} if has_next else None
+    prev_args = {reverse: encode_cursor(first_key)} if has_prev else None
+
+    return next_args, prev_args
+
+
+def paginate(query, keys, row_key, before=None, after=None,
+             per_page=PER_PAGE, descending=True):
+    """Return a Page of `query` ordered by `keys`.
+
+    - keys: columns to sort by; the last one must be unique
+    - row_key: function giving a result row's values for `keys`
+    - before / after: decoded cursors; at most one is used
+    - descending: sort order of the displayed page
+    """
+
+    query, backwards = _window(query, keys, before, after, descending)
+
+    rows = query.limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+
+    if backwards:
+        rows.reverse()
+
+    if not rows:
+        return Page(rows)
+
+    next_args, prev_args = _neighbour_args(
+        row_key(rows[0]), row_key(rows[-1]), has_more,
+        before is not None or after is not None, backwards, descending)
+
+    return Page(rows, next_args=next_args, prev_args=prev_args)
+
+
+class StreamedPage:
+    """A page read from a server-side cursor while it is being iterated.
+
+    Rows arrive `chunk_size` at a time; `on_chunk(rows)` sees each batch
+    before its rows are handed out, so per-row lookups (likes, follow
+    states) can run a batch at a time too. Only one batch is held at once.
+
+    `next_args` / `prev_args` are known once the rows have run out, so
+    render the pager after the loop. A streamed page can be read only once.
+    """
+
+    def __init__(self, query, row_key, per_page, from_cursor, descending,
+                 on_chunk=None, chunk_size=STREAM_CHUNK):
+        self.query = query
+        self.row_key = row_key
+        self.per_page = per_page
+        self.from_cursor = from_cursor
+        self.descending = descending
+        self.on_chunk = on_chunk
+        self.chunk_size = chunk_size
+        self.next_args = None
+        self.prev_args = None
+        self.count = 0
+        self._read = False
+
+    def __iter__(self):
+        if self._read:
+            raise RuntimeError("a streamed page can only be read once")
+        self._read = True
+
+        rows = iter(self.query
+                    .limit(self.per_page + 1)
+                    .yield_per(self.chunk_size))
+        first_key = last_key = None
+        has_more = False
+
+        while True:
+            chunk = []
+            for row in rows:
+                if self.count + len(chunk) == self.per_page:
+                    has_more = True
+                    break
+                chunk.append(row)
+                if len(chunk) == self.chunk_size:
+                    break
+
+            if not chunk:
+                break
+
+            if first_key is None:
+                first_key = self.row_key(chunk[0])
+            last_key = self.row_key(chunk[-1])
+            self.count += len(chunk)
+
+            if self.on_chunk is not None:
+                self.on_chunk(chunk)
+            yield from chunk
+
+        if self.count:
+            self.next_args, self.prev_args = _neighbour_args(
+                first_key, last_key, has_more, self.from_cursor,
+                False, self.descending)
+
+
+def stream(query, keys, row_key, before=None, after=None, per_page=PER_PAGE,
+           descending=True, on_chunk=None, chunk_size=STREAM_CHUNK):
+    """Like `paginate`, but a StreamedPage that fetches as it's iterated.
+
+    A page walked towards its cursor (a "prev" link) has to be read in full
+    to be flipped, so it comes back as an ordinary Page, after one
+    `on_chunk` call with all its rows.
+    """
+
+    windowed, backwards = _window(query, keys, before, after, descending)
+
+    if backwards:
+        page = paginate(query, keys, row_key, before=before, after=after,
+                        per_page=per_page, descending=descending)
+        if on_chunk is not None and page.items:
+            on_chunk(page.items)
+        return page
+
+    return StreamedPage(windowed, row_key, per_page,
+                        before is not None or after is not None, descending,
+                        on_chunk=on_chunk, chunk_size=chunk_size)
+
+
+def request_cursors(keys):
+    """This request's decoded (before, after) cursors over `keys`; 400 when
+    malformed."""
+
+    try:
+        before = request.args.get('before')
+        after = request.args.get('after')
+        before = decode_cursor(before, keys) if before else None
+        after = decode_cursor(after, keys) if after else None
+    except InvalidCursor:
+        abort(400)
+
+    return before, after
+
+
+def paginate_request(query, keys, row_key, **kwargs):
+    """`paginate` using the ?before= / ?after= cursors of this request.
+
+    A malformed cursor is a client error, so it aborts with a 400.
+    """
+
+    before, after = request_cursors(keys)
+    return paginate(query, keys, row_key, before=before, after=after, **kwargs)
+
+
+def stream_request(query, keys, row_key, **kwargs):
+    """`stream` using the ?before= / ?after= cursors of this request."""
+
+    before, after = request_cursors(keys)
+    return stream(query, keys, row_key, before=before, after=after, **kwargs)
+
+
+def page_url(cursor_args):
+    """URL of the current page with its cursor swapped for `cursor_args`."""
+
+    args = {k: v for k, v in request.args.items()
+            if k not in ('before', 'after')}
+    args.update(request.view_args or {})
+    args.update(cursor_args)
+
+    return url_for(request.endpoint, **args)
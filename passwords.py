@@ -0,0 +1,128 @@
+"""Password hashing on a bounded worker pool.
+
+bcrypt is deliberately slow: each hash or check burns a few hundred
+milliseconds of CPU. Running it inline lets a burst of logins tie up every
+request worker, so hashes run on a small dedicated pool instead. At most
+HASH_POOL_WORKERS hashes run at once and at most HASH_POOL_QUEUE wait
+behind them; beyond that we raise HashingBusy (a 503) rather than pile up.
+
+The pool is threads: bcrypt's C code releases the GIL, so hashes run in
+parallel with each other and with ordinary request handling.
+
+Each app gets its own pool and work factor (in `app.extensions`); code
+running outside any app context hashes with the defaults.
+
+BCRYPT_LOG_ROUNDS sets the work factor for new hashes. A successful login
+whose stored hash used a different factor gets rehashed (see
+`User.authenticate`), so the cost can be tuned either way without locking
+anyone out.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app, has_app_context
+from flask_bcrypt import Bcrypt
+
+bcrypt = Bcrypt()
+
+DEFAULT_ROUNDS = 12
+
+
+class HashingBusy(Exception):
+    """Too many password hashes are already running or queued."""
+
+
+class HashPool:
+    """A fixed number of hashing threads with a cap on waiting work."""
+
+    def __init__(self, workers=2, max_queue=16):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._slots = threading.BoundedSemaphore(workers + max_queue)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        # started lazily so forked app servers don't inherit dead threads
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix='bcrypt')
+            return self._executor
+
+    def run(self, fn, *args):
+        """Run `fn(*args)` on the pool and wait for its result."""
+
+        if not self._slots.acquire(blocking=False):
+            raise HashingBusy()
+
+        try:
+            return self._get_executor().submit(fn, *args).result()
+        finally:
+            self._slots.release()
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+
+class Hashing:
+    """One app's work factor and hashing pool."""
+
+    def __init__(self, rounds=DEFAULT_ROUNDS, workers=2, max_queue=16):
+        self.rounds = rounds
+        self.pool = HashPool(workers=workers, max_queue=max_queue)
+
+
+# for hashing outside an app context (scripts, test setup)
+default_hashing = Hashing()
+
+
+def init_app(app):
+    """Configure hashing from `app.config`."""
+
+    app.config.setdefault('BCRYPT_LOG_ROUNDS', DEFAULT_ROUNDS)
+    app.config.setdefault('HASH_POOL_WORKERS', 2)
+    app.config.setdefault('HASH_POOL_QUEUE', 16)
+
+    bcrypt.init_app(app)
+    app.extensions['passwords'] = Hashing(
+        rounds=app.config['BCRYPT_LOG_ROUNDS'],
+        workers=app.config['HASH_POOL_WORKERS'],
+        max_queue=app.config['HASH_POOL_QUEUE'])
+
+
+def hashing():
+    """The current app's Hashing, or the defaults outside an app."""
+
+    if has_app_context():
+        return current_app.extensions['passwords']
+    return default_hashing
+
+
+def hash_password(password):
+    """bcrypt hash of `password` at the configured work factor."""
+
+    settings = hashing()
+    hashed = settings.pool.run(bcrypt.generate_password_hash, password,
+                               settings.rounds)
+    return hashed.decode('UTF-8')
+
+
+def check_password(hashed, password):
+    """Does `password` match the bcrypt `hashed`?"""
+
+    return hashing().pool.run(bcrypt.check_password_hash, hashed, password)
+
+
+def needs_rehash(hashed):
+    """Was `hashed` made with a work factor other than the configured one?"""
+
+    # bcrypt hashes look like $2b$<rounds>$<salt+hash>
+    try:
+        return int(hashed.split('$')[2]) != hashing().rounds
+    except (IndexError, ValueError):
+        return True
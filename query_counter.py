@@ -0,0 +1,57 @@
+"""Count the SQL statements a block of code sends to the database.
+
+Used by the view tests to catch N+1 regressions:
+
+    class MyTestCase(QueryCountMixin, TestCase):
+        def test_feed(self):
+            with self.assertMaxQueries(8):
+                self.client.get("/")
+"""
+
+import threading
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from models import db
+
+
+class QueryCounter:
+    """Context manager recording every statement executed on `engine`
+    by this thread (not, say, a background load started meanwhile)."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+        self.thread = threading.get_ident()
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._record)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(self.engine, 'before_cursor_execute', self._record)
+
+    def _record(self, conn, cursor, statement, parameters, context,
+                executemany):
+        if threading.get_ident() == self.thread:
+            self.statements.append(statement)
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+
+class QueryCountMixin:
+    """TestCase mixin adding `assertMaxQueries`."""
+
+    @contextmanager
+    def assertMaxQueries(self, limit):
+        """Fail if the block issues more than `limit` SQL statements."""
+
+        with QueryCounter(db.engine) as counter:
+            yield counter
+
+        if counter.count > limit:
+            self.fail(f"{counter.count} queries issued, expected at most "
+                      f"{limit}:\n" + "\n".join(counter.statements))
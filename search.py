@@ -0,0 +1,75 @@
+"""Username search for /users?q=.
+
+Matches are case-insensitive and ranked exact match, then prefix, then
+substring (shorter usernames first within each), capped at SEARCH_LIMIT;
+`count_users` counts every match, for the "N users" line.
+
+On Postgres, migration 0005 adds the indexes this leans on: a pg_trgm GIN
+index on lower(username), which serves the '%term%' LIKE, and a
+text_pattern_ops btree, which serves 'term%'. Trigrams need at least three
+characters to narrow anything down, so shorter terms only search prefixes.
+The statement itself is portable, so other backends run it unindexed.
+"""
+
+from sqlalchemy import case, func
+
+from models import User
+
+SEARCH_LIMIT = 50
+
+# shortest term worth a substring (trigram) search
+MIN_SUBSTRING_LENGTH = 3
+
+
+def escape_like(term):
+    """Escape LIKE wildcards so a search for '50%' means a literal '%'."""
+
+    return (term
+            .replace('\\', '\\\\')
+            .replace('%', '\\%')
+            .replace('_', '\\_'))
+
+
+def _conditions(term):
+    """(matches, prefix) filters on the lowercased username for `term`."""
+
+    username = func.lower(User.username)
+    escaped = escape_like(term)
+    prefix = username.like(f'{escaped}%', escape='\\')
+
+    if len(term) >= MIN_SUBSTRING_LENGTH:
+        matches = username.like(f'%{escaped}%', escape='\\')
+    else:
+        matches = prefix
+
+    return matches, prefix
+
+
+def search_users(term, limit=SEARCH_LIMIT):
+    """Users whose username contains `term`, best matches first."""
+
+    term = term.strip().lower()
+    if not term:
+        return []
+
+    username = func.lower(User.username)
+    matches, prefix = _conditions(term)
+    rank = case([(username == term, 0), (prefix, 1)], else_=2)
+
+    return (User
+            .query
+            .filter(matches)
+            .order_by(rank, func.length(User.username), User.username)
+            .limit(limit)
+            .all())
+
+
+def count_users(term):
+    """How many users `search_users(term)` would find with no limit."""
+
+    term = term.strip().lower()
+    if not term:
+        return 0
+
+    matches, _ = _conditions(term)
+    return User.query.filter(matches).count()
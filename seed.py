@@ -1,20 +1,13 @@
-"""Seed database with sample data from CSV Files."""
-
-from csv import DictReader
-from app import db
-from models import User, Message, Follows
+"""Seed database with sample data from CSV Files.
 
+Same as `flask load-data`; pass --append to keep the existing data.
+"""
 
-db.drop_all()
-db.create_all()
+import sys
 
-with open('generator/users.csv') as users:
-    db.session.bulk_insert_mappings(User, DictReader(users))
-
-with open('generator/messages.csv') as messages:
-    db.session.bulk_insert_mappings(Message, DictReader(messages))
+from app import db
+import loader
 
-with open('generator/follows.csv') as follows:
-    db.session.bulk_insert_mappings(Follows, DictReader(follows))
 
-db.session.commit()
+for stat in loader.load(db.engine, 'generator', append='--append' in sys.argv):
+    print(loader.format_stat(stat))
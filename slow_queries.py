@@ -0,0 +1,212 @@
+"""Slow-query log with query plans.
+
+SQLALCHEMY_ECHO logs every statement or none. This logs only statements
+that take longer than SLOW_QUERY_MS, with their parameters, the route that
+sent them and the database's plan for them, to a rotating file
+(SLOW_QUERY_LOG, default instance/slow_queries.log):
+
+    2020-01-01 12:00:00 812.4 ms GET /users?q=ann (warbler.list_users)
+    SELECT users.id ... WHERE lower(users.username) LIKE %(term)s ...
+    params: {'term': '%ann%', ...}
+    plan:
+      Seq Scan on users  (cost=0.00..2184.00 rows=33 width=...)
+      ...
+
+Plans come from EXPLAIN on the same connection and transaction (EXPLAIN
+QUERY PLAN on SQLite), so they see what the query saw. Only SELECTs are
+explained, and each distinct statement at most once per
+SLOW_QUERY_EXPLAIN_INTERVAL seconds, so a storm of one slow query doesn't
+double the load. SLOW_QUERY_EXPLAIN_ANALYZE runs EXPLAIN ANALYZE instead,
+which executes the query a second time for real row counts and timings;
+SELECTs that lock rows (FOR UPDATE / FOR SHARE) or call a function with
+side effects (setval, advisory locks, ...) still get a plain EXPLAIN.
+
+Bound parameters named like "password" are written as <redacted>.
+"""
+
+import logging
+import os
+import re
+import threading
+import time
+from logging.handlers import RotatingFileHandler
+
+from flask import has_request_context, request
+from sqlalchemy import event
+
+from models import db
+
+logger = logging.getLogger('warbler.slow_queries')
+
+# longest parameter repr we write out
+MAX_PARAMETER_LENGTH = 200
+
+# SELECTs that EXPLAIN ANALYZE mustn't run again: row locks, and functions
+# that change state or take locks
+_UNSAFE_TO_RERUN = re.compile(
+    r'\bFOR\s+(NO\s+KEY\s+UPDATE|UPDATE|KEY\s+SHARE|SHARE)\b'
+    r'|\b(setval|nextval|pg_(try_)?advisory\w*|pg_notify|set_config)\s*\(',
+    re.IGNORECASE)
+
+
+class SlowQueryLog:
+    """Engine listener logging statements slower than `threshold_ms`."""
+
+    def __init__(self, threshold_ms, analyze=False, explain_interval=300):
+        self.threshold = threshold_ms / 1000
+        self.analyze = analyze
+        self.explain_interval = explain_interval
+        # statement: when last explained, oldest first
+        self._explained = {}
+        self._lock = threading.Lock()
+
+    def watch(self, engine):
+        event.listen(engine, 'before_cursor_execute', self._before)
+        event.listen(engine, 'after_cursor_execute', self._after)
+
+    def _before(self, conn, cursor, statement, parameters, context,
+                executemany):
+        context._slow_query_start = time.perf_counter()
+
+    def _after(self, conn, cursor, statement, parameters, context,
+               executemany):
+        start = getattr(context, '_slow_query_start', None)
+        if start is None:
+            return
+
+        elapsed = time.perf_counter() - start
+        if elapsed < self.threshold:
+            return
+
+        lines = [f"{elapsed * 1000:.1f} ms {_route()}",
+                 statement.strip(),
+                 f"params: {_format_parameters(parameters)}"]
+
+        if not executemany and self._should_explain(statement):
+            lines.append("plan:")
+            lines.extend(f"  {line}" for line in
+                         self._explain(conn, statement, parameters))
+
+        logger.warning('\n'.join(lines))
+
+    def _should_explain(self, statement):
+        if not statement.lstrip().upper().startswith('SELECT'):
+            return False
+
+        now = time.monotonic()
+        with self._lock:
+            # forget statements explained over an interval ago, so ad hoc
+            # SQL (say, a growing IN list) can't pile up here forever
+            while self._explained:
+                oldest, explained_at = next(iter(self._explained.items()))
+                if now - explained_at < self.explain_interval:
+                    break
+                del self._explained[oldest]
+
+            if statement in self._explained:
+                return False
+            self._explained[statement] = now
+            return True
+
+    def _explain_prefix(self, dialect, statement):
+        """What to put before `statement` to get its plan, or None."""
+
+        if dialect == 'postgresql':
+            analyze = self.analyze and not _UNSAFE_TO_RERUN.search(statement)
+            return 'EXPLAIN ANALYZE ' if analyze else 'EXPLAIN '
+        if dialect == 'sqlite':
+            return 'EXPLAIN QUERY PLAN '
+        return None
+
+    def _explain(self, conn, statement, parameters):
+        """The plan's lines, or why we couldn't get one."""
+
+        dialect = conn.dialect.name
+        explain = self._explain_prefix(dialect, statement)
+
+        if explain is None:
+            return [f"(no EXPLAIN support for {dialect})"]
+
+        # a failed EXPLAIN mustn't abort the request's transaction
+        savepoint = dialect == 'postgresql' and conn.in_transaction()
+        cursor = conn.connection.cursor()
+
+        try:
+            if savepoint:
+                cursor.execute('SAVEPOINT slow_query_explain')
+            cursor.execute(explain + statement, parameters)
+            rows = cursor.fetchall()
+            if savepoint:
+                cursor.execute('RELEASE SAVEPOINT slow_query_explain')
+        except Exception as error:
+            if savepoint:
+                cursor.execute('ROLLBACK TO SAVEPOINT slow_query_explain')
+            return [f"(EXPLAIN failed: {error})"]
+        finally:
+            cursor.close()
+
+        # Postgres: one text column; SQLite: (id, parent, notused, detail)
+        return [str(row[0] if dialect == 'postgresql' else row[-1])
+                for row in rows]
+
+
+def _route():
+    if not has_request_context():
+        return "(outside a request)"
+
+    return f"{request.method} {request.full_path.rstrip('?')} " \
+           f"({request.endpoint})"
+
+
+def _format_parameters(parameters):
+    if isinstance(parameters, dict):
+        return '{' + ', '.join(
+            f"{name!r}: "
+            f"{'<redacted>' if 'password' in name else _truncate(value)}"
+            for name, value in parameters.items()) + '}'
+
+    return _truncate(parameters)
+
+
+def _truncate(value):
+    """repr(value), cut short if it's long."""
+
+    text = repr(value)
+    if len(text) > MAX_PARAMETER_LENGTH:
+        return text[:MAX_PARAMETER_LENGTH] + '...'
+    return text
+
+
+def init_app(app):
+    """Log `app`'s slow queries, if SLOW_QUERY_MS is set."""
+
+    app.config.setdefault('SLOW_QUERY_MS', 0)
+    app.config.setdefault('SLOW_QUERY_LOG', None)
+    app.config.setdefault('SLOW_QUERY_EXPLAIN_ANALYZE', False)
+    app.config.setdefault('SLOW_QUERY_EXPLAIN_INTERVAL', 300)
+
+    if not app.config['SLOW_QUERY_MS']:
+        return None
+
+    path = (app.config['SLOW_QUERY_LOG']
+            or os.path.join(app.instance_path, 'slow_queries.log'))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    if not any(getattr(handler, 'baseFilename', None) == os.path.abspath(path)
+               for handler in logger.handlers):
+        handler = RotatingFileHandler(path, maxBytes=10 * 1024 * 1024,
+                                      backupCount=5)
+        handler.setFormatter(logging.Formatter('%(asctime)s %(message)s\n'))
+        logger.addHandler(handler)
+
+    logger.setLevel(logging.WARNING)
+    logger.propagate = False
+
+    slow_log = SlowQueryLog(app.config['SLOW_QUERY_MS'],
+                            app.config['SLOW_QUERY_EXPLAIN_ANALYZE'],
+                            app.config['SLOW_QUERY_EXPLAIN_INTERVAL'])
+    slow_log.watch(db.get_engine(app))
+    for bind in app.config.get('SQLALCHEMY_BINDS') or ():
+        slow_log.watch(db.get_engine(app, bind=bind))
+    app.extensions['slow_queries'] = slow_log
+    return slow_log
@@ -0,0 +1,157 @@
+"""Soft delete for users and messages, purged in the background.
+
+Deleting a user through the session loads and deletes every message,
+follow and like they have, one by one, inside the request: seconds of work
+and locks for a busy account. Instead, `delete_user` / `delete_message`
+stamp `deleted_at` with a couple of set-based UPDATEs, and the request is
+done.
+
+From then on every ORM query leaves the row out, as if it were gone
+(`include_deleted` turns that off for one query). Core statements
+(`select()`, `table.update()`, ...) aren't filtered.
+
+`purge` then deletes the hidden rows `batch_size` at a time, committing
+after each batch, so no transaction grows with the size of the account.
+Deleting a message lets the database's ON DELETE CASCADE take its likes
+and timeline entries. A user's follows and likes are cleared in batches
+before their row goes. Each delete queues a purge for a worker (see
+jobs.py); `flask purge-deleted` runs one by hand.
+"""
+
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import event, inspect, select, tuple_
+from sqlalchemy.orm import Query
+
+from models import db, Follows, Likes, Message, User
+import counters
+import jobs
+
+SOFT_DELETED = (User, Message)
+
+PURGE_BATCH_SIZE = 1000
+
+messages = Message.__table__
+users = User.__table__
+
+
+@event.listens_for(Query, 'before_compile', retval=True)
+def _hide_deleted(query):
+    """Add `deleted_at IS NULL` for each soft-deletable entity queried."""
+
+    if query._execution_options.get('include_deleted'):
+        return query
+
+    for description in query.column_descriptions:
+        entity = description['entity']
+        if entity is None or inspect(entity).class_ not in SOFT_DELETED:
+            continue
+
+        # get() and a LIMIT already applied would otherwise refuse a filter
+        query = (query
+                 .enable_assertions(False)
+                 .filter(entity.deleted_at.is_(None)))
+
+    return query
+
+
+def include_deleted(query):
+    """`query` without the soft-delete filter."""
+
+    return query.execution_options(include_deleted=True)
+
+
+def delete_message(message):
+    """Hide `message` now and queue its purge. Doesn't commit."""
+
+    counters.forget_message(message)
+    message.deleted_at = datetime.utcnow()
+    jobs.enqueue(purge_deleted, key=f'purge:message:{message.id}')
+
+
+def delete_user(user):
+    """Hide `user` and all their messages now and queue their purge.
+    Doesn't commit."""
+
+    now = datetime.utcnow()
+
+    counters.forget_user(user.id)
+    user.deleted_at = now
+
+    # one statement along ix_messages_user_id_timestamp, rather than
+    # loading the messages
+    db.session.execute(
+        messages.update()
+        .where(messages.c.user_id == user.id)
+        .where(messages.c.deleted_at.is_(None))
+        .values(deleted_at=now))
+
+    jobs.enqueue(purge_deleted, key=f'purge:user:{user.id}')
+
+
+def _delete_in_batches(table, condition, batch_size):
+    """Delete `table` rows matching `condition`, committing every batch.
+
+    Returns the number of rows deleted.
+    """
+
+    key = list(table.primary_key.columns)
+    batch = select(key).where(condition).limit(batch_size)
+    if len(key) == 1:
+        in_batch = key[0].in_(batch)
+    else:
+        in_batch = tuple_(*key).in_(batch)
+
+    deleted = 0
+
+    while True:
+        result = db.session.execute(table.delete().where(in_batch))
+        db.session.commit()
+        deleted += result.rowcount
+
+        if result.rowcount < batch_size:
+            return deleted
+
+
+def purge(batch_size=PURGE_BATCH_SIZE):
+    """Delete every soft-deleted message and user.
+
+    Returns (messages purged, users purged).
+    """
+
+    # a deleted user's messages are all soft-deleted too
+    purged_messages = _delete_in_batches(
+        messages, messages.c.deleted_at.isnot(None), batch_size)
+
+    user_ids = [user_id for (user_id,) in db.session.execute(
+        select([users.c.id]).where(users.c.deleted_at.isnot(None)))]
+
+    for user_id in user_ids:
+        follows = Follows.__table__
+        likes = Likes.__table__
+        _delete_in_batches(follows, follows.c.user_following_id == user_id,
+                           batch_size)
+        _delete_in_batches(follows,
+                           follows.c.user_being_followed_id == user_id,
+                           batch_size)
+        _delete_in_batches(likes, likes.c.user_id == user_id, batch_size)
+
+        # what's left (their own timeline) goes by cascade
+        db.session.execute(users.delete().where(users.c.id == user_id))
+        db.session.commit()
+
+    return purged_messages, len(user_ids)
+
+
+@jobs.task('maintenance', max_attempts=10)
+def purge_deleted():
+    """`purge`, as a job; it commits as it goes, and reruns harmlessly."""
+
+    purge(current_app.config['PURGE_BATCH_SIZE'])
+
+
+def init_app(app):
+    """Default the purge's batch size."""
+
+    app.config.setdefault('PURGE_BATCH_SIZE', PURGE_BATCH_SIZE)
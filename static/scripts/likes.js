@@ -0,0 +1,22 @@
+// Toggle likes in place instead of posting the form and re-rendering the
+// whole feed. Falls back to the plain form post if anything goes wrong.
+
+$(document).on('submit', 'form.messages-like', function (evt) {
+  evt.preventDefault();
+
+  const $form = $(this);
+  const $button = $form.find('button');
+
+  $.ajax({
+    url: $form.attr('action'),
+    method: 'POST',
+    dataType: 'json',
+    headers: { Accept: 'application/json' }
+  }).done(function (resp) {
+    $button.toggleClass('btn-primary', resp.liked);
+    $button.toggleClass('btn-secondary', !resp.liked);
+  }).fail(function () {
+    // a programmatic submit() doesn't fire this handler again
+    $form.get(0).submit();
+  });
+});
@@ -0,0 +1,48 @@
+"""Streamed template rendering.
+
+`render_template` builds the whole page before the first byte goes out.
+`stream_template` sends it as Jinja produces it: the layout, nav and aside
+leave while the list's rows are still being read, and with a StreamedPage
+(pagination.py) only one batch of rows is held at a time.
+
+The request context (and with it the database session) lives until the
+last byte is sent, so teardown hooks, and the request metrics with them,
+run after the stream rather than before it.
+
+Two things happen before the response is returned, though. The session
+cookie is saved then, so the flashed messages are taken out of it up front
+and handed to base.html as `flashes`; read later, they would never leave
+the session and would show again on every page. And the first piece of
+the page is rendered then, so an error in the layout (or the first rows)
+is still a 500. One further down can only cut the page off.
+"""
+
+from flask import (Response, before_render_template, current_app,
+                   get_flashed_messages, stream_with_context,
+                   template_rendered)
+
+# template output pieces gathered into each write to the client
+STREAM_BUFFER = 16
+
+
+def stream_template(template_name, **context):
+    """Response streaming `template_name` rendered with `context`."""
+
+    app = current_app._get_current_object()
+    context['flashes'] = get_flashed_messages(with_categories=True)
+    app.update_template_context(context)
+    template = app.jinja_env.get_template(template_name)
+
+    before_render_template.send(app, template=template, context=context)
+
+    stream = template.stream(context)
+    stream.enable_buffering(STREAM_BUFFER)
+    first = next(stream, '')
+
+    def generate():
+        yield first
+        yield from stream
+
+        template_rendered.send(app, template=template, context=context)
+
+    return Response(stream_with_context(generate()), mimetype='text/html')
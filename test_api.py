@@ -0,0 +1,109 @@
+"""JSON API tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_api.py
+
+
+from app import app, CURR_USER_KEY
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from models import db, Message, User, Follows, Likes
+from query_counter import QueryCountMixin
+import timeline
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class ApiTestCase(QueryCountMixin, TestCase):
+    """Test the /api endpoints."""
+
+    def setUp(self):
+        User.query.delete()
+        Message.query.delete()
+
+        self.client = app.test_client()
+
+        reader = User.signup("reader", "reader@test.com", "password", None)
+        author = User.signup("author", "author@test.com", "password", None)
+        db.session.commit()
+        self.reader_id, self.author_id = reader.id, author.id
+
+        db.session.add(Follows(user_being_followed_id=self.author_id,
+                               user_following_id=self.reader_id))
+
+        start = datetime(2020, 1, 1)
+        messages = [Message(text=f"warble {n}", user_id=self.author_id,
+                            timestamp=start + timedelta(minutes=n))
+                    for n in range(105)]
+        db.session.add_all(messages)
+        db.session.flush()
+        timeline.rebuild_timeline(self.reader_id)
+        db.session.commit()
+
+        self.message_ids = [msg.id for msg in messages]
+        db.session.add(Likes(user_id=self.reader_id,
+                             message_id=self.message_ids[-1]))
+        db.session.commit()
+
+    def login(self):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.reader_id
+
+    def test_timeline_pages(self):
+        self.login()
+
+        with self.assertMaxQueries(4):
+            resp = self.client.get('/api/timeline')
+
+        data = resp.get_json()
+        self.assertEqual(len(data['messages']), 100)
+        newest = data['messages'][0]
+        self.assertEqual(newest['text'], "warble 104")
+        self.assertEqual(newest['user']['username'], "author")
+        self.assertTrue(newest['liked'])
+        self.assertIsNone(data['prev'])
+
+        data = self.client.get(data['next']).get_json()
+        self.assertEqual([msg['text'] for msg in data['messages']],
+                         [f"warble {n}" for n in range(4, -1, -1)])
+        self.assertIsNone(data['next'])
+
+    def test_timeline_requires_login(self):
+        resp = self.client.get('/api/timeline')
+
+        self.assertEqual(resp.status_code, 401)
+        self.assertIn('error', resp.get_json())
+
+    def test_user_messages(self):
+        resp = self.client.get(f'/api/users/{self.author_id}/messages')
+
+        data = resp.get_json()
+        self.assertEqual(len(data['messages']), 100)
+        self.assertFalse(data['messages'][0]['liked'])  # nobody logged in
+
+        resp = self.client.get('/api/users/0/messages')
+        self.assertEqual(resp.status_code, 404)
+
+    def test_messages_by_id(self):
+        first, second = self.message_ids[:2]
+
+        resp = self.client.get(f'/api/messages?ids={second},0,{first},{second}')
+
+        data = resp.get_json()
+        self.assertEqual([msg['id'] for msg in data['messages']],
+                         [second, first])
+
+        resp = self.client.get('/api/messages?ids=1,x')
+        self.assertEqual(resp.status_code, 400)
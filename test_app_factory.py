@@ -0,0 +1,34 @@
+"""Application factory tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_app_factory.py
+
+
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from app import create_app
+from config import ProductionConfig
+
+
+class AppFactoryTestCase(TestCase):
+    """Test the configuration profiles."""
+
+    def test_production_profile(self):
+        with TemporaryDirectory() as cache_dir:
+            class Config(ProductionConfig):
+                TEMPLATE_CACHE_DIR = cache_dir
+
+            app = create_app(Config)
+
+            self.assertNotIn('debugtoolbar', app.blueprints)
+            # warm start compiled every template into the cache
+            self.assertTrue(os.listdir(cache_dir))
+
+    def test_development_profile(self):
+        app = create_app('development')
+
+        self.assertTrue(app.config['DEBUG_TB_ENABLED'])
+        self.assertIsNone(app.jinja_env.bytecode_cache)
@@ -0,0 +1,124 @@
+"""In-memory follow graph tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_follow_graph.py
+
+
+import os
+from unittest import TestCase
+
+from flask import g
+
+from models import db, User, Follows
+import follow_graph
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+
+
+class FollowGraphTestCase(TestCase):
+    """Test the snapshot, the overlay of new follows, and what they answer."""
+
+    def setUp(self):
+        self.context = app.test_request_context()
+        self.context.push()
+
+        db.drop_all()
+        db.create_all()
+
+        users = [User.signup(name, f"{name}@test.com", "password", None)
+                 for name in ("me", "ann", "bob", "cat", "dan")]
+        db.session.commit()
+        self.me, self.ann, self.bob, self.cat, self.dan = [u.id for u in users]
+
+        # me -> ann, bob; both follow cat; ann also follows dan
+        self.follow(self.me, self.ann)
+        self.follow(self.me, self.bob)
+        self.follow(self.ann, self.cat)
+        self.follow(self.bob, self.cat)
+        self.follow(self.ann, self.dan)
+        db.session.commit()
+
+        self.graph = follow_graph.FollowGraph(db.engine)
+        app.extensions['follow_graph'] = self.graph
+        self.graph.refresh()
+
+    def tearDown(self):
+        db.session.rollback()
+        self.context.pop()
+
+    def follow(self, follower, followed):
+        db.session.add(Follows(user_following_id=follower,
+                               user_being_followed_id=followed))
+
+    def test_snapshot(self):
+        snapshot = self.graph.snapshot
+
+        self.assertEqual(len(snapshot), 5)
+        self.assertEqual(list(snapshot.following(self.me)),
+                         [self.ann, self.bob])
+        self.assertEqual(list(snapshot.followers(self.cat)),
+                         [self.ann, self.bob])
+        self.assertEqual(list(snapshot.following(self.cat)), [])
+        self.assertEqual(list(snapshot.following(10 ** 6)), [])
+
+    def test_suggestions(self):
+        self.assertEqual(self.graph.suggestions(self.me),
+                         [(self.cat, 2), (self.dan, 1)])
+        self.assertEqual(self.graph.suggestions(self.me, limit=1),
+                         [(self.cat, 2)])
+
+    def test_committed_changes_apply_at_once(self):
+        self.follow(self.me, self.cat)
+        db.session.commit()
+
+        self.assertIn(self.cat, self.graph.following(self.me))
+        self.assertEqual(self.graph.suggestions(self.me), [(self.dan, 1)])
+
+        Follows.query.filter_by(user_following_id=self.ann,
+                                user_being_followed_id=self.dan).delete()
+        db.session.delete(Follows.query.get((self.cat, self.bob)))
+        db.session.commit()
+
+        # the bulk delete isn't seen until a reload; the session one is
+        self.assertEqual(self.graph.suggestions(self.me), [(self.dan, 1)])
+        self.assertEqual(self.graph.followers(self.cat), {self.ann, self.me})
+
+        self.graph.refresh()
+        self.assertEqual(self.graph.suggestions(self.me), [])
+
+    def test_lagging_replica(self):
+        # committed just before the load, but not yet on the replica it
+        # read from
+        self.graph.lag = 60
+        self.graph.record(self.me, self.dan, True)
+        self.graph.refresh()
+
+        self.assertIn(self.dan, self.graph.following(self.me))
+
+        self.graph.lag = 0
+        self.graph.refresh()
+        self.assertNotIn(self.dan, self.graph.following(self.me))
+
+    def test_rolled_back_changes_ignored(self):
+        self.follow(self.me, self.cat)
+        db.session.flush()
+        db.session.rollback()
+
+        self.assertNotIn(self.cat, self.graph.following(self.me))
+
+    def test_known_followers(self):
+        g.user = User.query.get(self.me)
+        cat = User.query.get(self.cat)
+
+        known = follow_graph.known_followers(cat)
+        self.assertEqual(known.count, 2)
+        self.assertEqual([u.username for u in known.users], ["ann", "bob"])
+
+        self.assertEqual(follow_graph.known_followers(g.user).count, 0)
+
+        suggested = follow_graph.suggestions(self.me)
+        self.assertEqual([(s.user.username, s.mutual_count)
+                          for s in suggested], [("cat", 2), ("dan", 1)])
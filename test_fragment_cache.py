@@ -0,0 +1,42 @@
+"""Message fragment cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_fragment_cache.py
+
+
+from unittest import TestCase
+
+from fragment_cache import FragmentCache
+
+
+class FragmentCacheTestCase(TestCase):
+    """Test LRU eviction and invalidation."""
+
+    def setUp(self):
+        self.cache = FragmentCache(maxsize=2)
+
+    def test_lru_eviction(self):
+        self.cache.set((1, 10, True), 1, 10, "one")
+        self.cache.set((2, 10, True), 2, 10, "two")
+        self.assertEqual(self.cache.get((1, 10, True)), "one")  # 1 is now fresh
+
+        self.cache.set((3, 20, True), 3, 20, "three")  # evicts 2, not 1
+        self.assertIsNone(self.cache.get((2, 10, True)))
+        self.assertEqual(self.cache.get((1, 10, True)), "one")
+        self.assertEqual(len(self.cache), 2)
+
+    def test_invalidate_message(self):
+        self.cache.set((1, 10, True), 1, 10, "liked")
+        self.cache.set((1, 10, False), 1, 10, "not liked")
+
+        self.cache.invalidate_message(1)  # every variant of message 1 goes
+        self.assertEqual(len(self.cache), 0)
+
+    def test_invalidate_author(self):
+        self.cache.set((1, 10, True), 1, 10, "by 10")
+        self.cache.set((2, 20, True), 2, 20, "by 20")
+
+        self.cache.invalidate_author(10)
+        self.assertIsNone(self.cache.get((1, 10, True)))
+        self.assertEqual(self.cache.get((2, 20, True)), "by 20")  # untouched
@@ -0,0 +1,213 @@
+"""Job queue tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_jobs.py
+
+
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+from unittest.mock import patch
+
+from models import db, Job, Message, User, Follows, TimelineEntry
+import jobs
+import timeline
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+
+app.config['JOBS_EAGER'] = False
+
+# what the tasks below did, in order
+done = []
+
+
+@jobs.task('default')
+def record(value):
+    done.append(value)
+
+
+@jobs.task('default', max_attempts=2)
+def explode():
+    raise RuntimeError("boom")
+
+
+@jobs.task('default', every=3600)
+def tick():
+    done.append('tick')
+
+
+class JobQueueTestCase(TestCase):
+    """Test queueing, running and retrying jobs."""
+
+    def setUp(self):
+        self.context = app.app_context()  # enqueue reads the app's config
+        self.context.push()
+
+        db.drop_all()
+        db.create_all()
+        done.clear()
+
+    def tearDown(self):
+        db.session.rollback()
+        self.context.pop()
+
+    def test_enqueue_and_work(self):
+        jobs.enqueue(record, 1)
+        jobs.enqueue(record, 2)
+        self.assertEqual(done, [])  # nothing runs in the request
+        db.session.commit()
+
+        self.assertEqual(jobs.work_off(app), 2)
+
+        self.assertEqual(done, [1, 2])  # in the order queued
+        self.assertEqual({job.state for job in Job.query}, {jobs.DONE})
+
+    def test_idempotency_key(self):
+        jobs.enqueue(record, 1, key='once')
+        jobs.enqueue(record, 2, key='once')  # ignored
+        db.session.commit()
+
+        jobs.work_off(app)
+        jobs.enqueue(record, 3, key='once')  # still ignored once done
+        db.session.commit()
+        jobs.work_off(app)
+
+        self.assertEqual(done, [1])
+
+    def test_retry_then_fail(self):
+        jobs.enqueue(explode)
+        db.session.commit()
+
+        jobs.work_off(app)
+        job = Job.query.one()
+        self.assertEqual((job.state, job.attempts), (jobs.QUEUED, 1))
+        self.assertGreater(job.run_at, datetime.utcnow())  # backing off
+        self.assertIn("boom", job.last_error)
+
+        job.run_at = datetime.utcnow()  # skip the wait
+        db.session.commit()
+        jobs.work_off(app)
+
+        job = Job.query.one()
+        self.assertEqual((job.state, job.attempts), (jobs.FAILED, 2))
+
+    def test_queue_limit(self):
+        limit = app.config['JOB_QUEUES']['default']
+        db.session.add_all([Job(queue='default', task='elsewhere',
+                                state=jobs.RUNNING, locked_by='another',
+                                locked_at=datetime.utcnow())
+                            for _ in range(limit)])
+        jobs.enqueue(record, 1)
+        db.session.commit()
+
+        self.assertEqual(jobs.work_off(app), 0)  # queue is full
+        self.assertEqual(done, [])
+
+    def test_periodic_task_queued_once_per_period(self):
+        jobs.schedule_periodic(['default'])
+        jobs.schedule_periodic(['default'])  # a second worker asking
+
+        self.assertEqual(jobs.work_off(app, ['default']), 1)
+        self.assertEqual(done, ['tick'])
+
+        # not for workers that don't serve its queue
+        db.session.query(Job).delete()
+        jobs.schedule_periodic(['timelines'])
+        self.assertEqual(Job.query.count(), 0)
+
+    def test_stale_job_requeued(self):
+        db.session.add(Job(queue='default', task=record.task.name,
+                           args='[7]', state=jobs.RUNNING, attempts=1,
+                           locked_by='gone',
+                           locked_at=datetime.utcnow() - timedelta(hours=1)))
+        db.session.commit()
+
+        self.assertEqual(jobs.requeue_stale(timeout=60), 1)
+        jobs.work_off(app)
+
+        self.assertEqual(done, [7])
+
+    def test_fan_out_queued(self):
+        author = User.signup("author", "author@test.com", "password", None)
+        reader = User.signup("reader", "reader@test.com", "password", None)
+        db.session.commit()
+        db.session.add(Follows(user_being_followed_id=author.id,
+                               user_following_id=reader.id))
+        msg = Message(text="warble", user_id=author.id)
+        db.session.add(msg)
+        db.session.flush()
+        timeline.post_message(msg)
+        db.session.commit()
+
+        # only the author's own timeline until a worker runs
+        self.assertEqual([entry.user_id for entry in TimelineEntry.query],
+                         [author.id])
+
+        jobs.work_off(app)
+        self.assertEqual(TimelineEntry.query.count(), 2)
+
+    def test_fan_out_and_backfill_in_either_order(self):
+        author = User.signup("author", "author@test.com", "password", None)
+        readers = [User.signup(f"reader{i}", f"reader{i}@test.com",
+                               "password", None) for i in range(2)]
+        db.session.commit()
+        author_id = author.id
+        reader_ids = [reader.id for reader in readers]
+        for reader_id in reader_ids:
+            db.session.add(Follows(user_being_followed_id=author_id,
+                                   user_following_id=reader_id))
+        db.session.commit()
+
+        for backfill_first in (True, False):
+            msg = Message(text="warble", user_id=author_id)
+            db.session.add(msg)
+            db.session.flush()
+            msg_id = msg.id
+
+            # a new follower's backfill and the post's fan-out, both
+            # pushing `msg` to the first reader
+            if backfill_first:
+                jobs.enqueue(timeline.add_follow, reader_ids[0], author_id)
+            timeline.post_message(msg)
+            if not backfill_first:
+                jobs.enqueue(timeline.add_follow, reader_ids[0], author_id)
+            db.session.commit()
+
+            jobs.work_off(app)
+
+            self.assertEqual({job.state for job in Job.query}, {jobs.DONE})
+            self.assertEqual(
+                sorted(entry.user_id for entry
+                       in TimelineEntry.query.filter_by(message_id=msg_id)),
+                sorted([author_id] + reader_ids))
+
+    def test_timelines_trimmed_hourly(self):
+        author = User.signup("author", "author@test.com", "password", None)
+        db.session.commit()
+        author_id = author.id
+        for i in range(3):
+            msg = Message(text=f"warble {i}", user_id=author_id)
+            db.session.add(msg)
+            db.session.flush()
+            timeline.post_message(msg)
+        db.session.commit()
+
+        with patch("timeline.TIMELINE_LENGTH", 2):
+            jobs.schedule_periodic(['maintenance'])
+            jobs.work_off(app, ['maintenance'])
+
+        self.assertEqual(
+            TimelineEntry.query.filter_by(user_id=author_id).count(), 2)
+
+    def test_queue_depth_metrics(self):
+        jobs.enqueue(record, 1)
+        db.session.commit()
+
+        with app.test_request_context():
+            lines = jobs.queue_depth_lines()
+
+        self.assertIn('warbler_job_queue_depth{queue="default",state="queued"} 1',
+                      lines)
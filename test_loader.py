@@ -0,0 +1,60 @@
+"""Bulk loader tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_loader.py
+
+
+import csv
+import io
+from unittest import TestCase
+
+from loader import CSVStream, Source
+from models import Follows, Likes, Message, User
+
+
+class LoaderTestCase(TestCase):
+    """Test the COPY stream and the renumbering of CSV rows."""
+
+    def test_stream_reads_in_pieces(self):
+        rows = [[n, f'text, with "quotes" {n}'] for n in range(2500)]
+        stream = CSVStream(iter(rows))
+
+        pieces = []
+        while True:
+            piece = stream.read(100)
+            if not piece:
+                break
+            self.assertLessEqual(len(piece), 100)
+            pieces.append(piece)
+
+        parsed = list(csv.reader(io.StringIO(''.join(pieces))))
+        self.assertEqual(parsed, [[str(n), text] for n, text in rows])
+
+    def test_append_offsets(self):
+        offsets = {User: 300, Message: 1000}
+
+        messages = Source(io.StringIO("text,timestamp,user_id\n"
+                                      "hi,2017-01-21 11:04:53,2\n"),
+                          Message, {'user_id': User}, offsets)
+        self.assertEqual(messages.columns,
+                         ['id', 'text', 'timestamp', 'user_id'])
+        self.assertEqual(list(messages.rows()),
+                         [[1001, 'hi', '2017-01-21 11:04:53', 302]])
+
+        follows = Source(io.StringIO("user_being_followed_id,"
+                                     "user_following_id\n1,2\n"),
+                         Follows, {'user_being_followed_id': User,
+                                   'user_following_id': User}, offsets)
+        self.assertEqual(list(follows.rows()), [[301, 302]])
+        self.assertEqual(follows.count, 1)
+
+    def test_like_times_left_null(self):
+        offsets = {User: 0, Message: 0}
+
+        likes = Source(io.StringIO("user_id,message_id\n1,2\n"), Likes,
+                       {'user_id': User, 'message_id': Message}, offsets)
+        # not "now": that would put every loaded like in the latest bucket
+        self.assertEqual(likes.columns,
+                         ['user_id', 'message_id', 'created_at'])
+        self.assertEqual(list(likes.rows()), [[1, 2, None]])
@@ -10,6 +10,7 @@ import os
 from unittest import TestCase
 from sqlalchemy import exc
 from models import db, User, Message, Follows, Likes
+import timeline
 
 # BEFORE we import our app, let's set an environmental variable
 # to use a different database for tests (we need to do this
@@ -35,6 +36,9 @@ class MessageModelTestCase(TestCase):
     def setUp(self):
         """Create test client, add sample data."""
 
+        self.context = app.app_context()  # queueing jobs reads the config
+        self.context.push()
+
         db.drop_all()
         db.create_all()
 
@@ -51,6 +55,7 @@ class MessageModelTestCase(TestCase):
         # calling super on teardown allows us to test more than one heirarchy multiple times
         res = super().tearDown()
         db.session.rollback()
+        self.context.pop()
         return res
 
 # Does the model work on a basic level?
@@ -111,3 +116,43 @@ class MessageModelTestCase(TestCase):
         self.assertEqual(len(l), 1)  # there should be one
         # the id of the first message in the likes list should be the same as our test liked message
         self.assertEqual(l[0].message_id, m1.id)
+
+# Does a new message land on the author's and their followers' timelines?
+    def test_timeline_fan_out(self):
+        follower = User.signup("follower", "f@email.com", "password", None)
+        follower.id = 777  # creating a follower of our test user
+        db.session.add(follower)
+        db.session.commit()
+
+        follower.following.append(self.u)
+        db.session.commit()  # follower now follows test user
+
+        m = Message(text="fanned out", user_id=self.uid)
+        db.session.add(m)
+        db.session.flush()
+        timeline.post_message(m)  # push to author
+        timeline.fan_out_to_followers(m.id)  # and, as its job would, followers
+        db.session.commit()
+
+        # message shows on both the author's and the follower's timelines
+        self.assertEqual(timeline.timeline_query(self.uid).all(), [m])
+        self.assertEqual(timeline.timeline_query(777).all(), [m])
+
+        timeline.remove_follow(777, self.uid)  # unfollowing clears it
+        db.session.commit()
+        self.assertEqual(timeline.timeline_query(777).all(), [])
+
+# Does an old self-follow leave the author with one timeline entry?
+    def test_timeline_fan_out_self_follow(self):
+        db.session.add(Follows(user_being_followed_id=self.uid,
+                               user_following_id=self.uid))
+        db.session.commit()
+
+        m = Message(text="to myself", user_id=self.uid)
+        db.session.add(m)
+        db.session.flush()
+        timeline.post_message(m)
+        timeline.fan_out_to_followers(m.id)  # the queued job's half
+        db.session.commit()
+
+        self.assertEqual(timeline.timeline_query(self.uid).all(), [m])
@@ -9,7 +9,9 @@ from app import app, CURR_USER_KEY
 import os
 from unittest import TestCase
 
-from models import db, connect_db, Message, User
+from models import db, connect_db, Message, User, Likes
+from query_counter import QueryCountMixin
+import timeline
 
 # BEFORE we import our app, let's set an environmental variable
 # to use a different database for tests (we need to do this
@@ -33,7 +35,7 @@ db.create_all()
 app.config['WTF_CSRF_ENABLED'] = False
 
 
-class MessageViewTestCase(TestCase):
+class MessageViewTestCase(QueryCountMixin, TestCase):
     """Test views for messages."""
 
     def setUp(self):
@@ -50,6 +52,7 @@ class MessageViewTestCase(TestCase):
                                     image_url=None)
 
         db.session.commit()
+        self.testuser_id = self.testuser.id
 # When you’re logged in, can you add a message as yourself?
 
     def test_add_message(self):
@@ -205,3 +208,83 @@ class MessageViewTestCase(TestCase):
 
             m = Message.query.get(1234)  # grab msg
             self.assertIsNotNone(m)  # ensure msg is still there
+
+# Does the home feed load message authors without a query per message?
+    def test_home_feed_query_count(self):
+        authors = [User.signup(f"author{i}", f"author{i}@test.com",
+                               "password", None) for i in range(5)]
+        db.session.commit()  # five authors for the feed
+
+        self.testuser.following.extend(authors)  # testuser follows them all
+        db.session.commit()
+
+        with app.app_context():  # queueing the fan-out reads the config
+            for author in authors:
+                for i in range(4):  # 20 messages across 5 authors
+                    m = Message(text=f"warble {i}", user_id=author.id)
+                    db.session.add(m)
+                    db.session.flush()
+                    timeline.post_message(m)
+                    timeline.fan_out_to_followers(m.id)
+            db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id  # logged in
+
+            # same handful of queries however many messages are shown;
+            # the feed streams, so its queries run as the body is read
+            with self.assertMaxQueries(7):
+                with c.get("/") as resp:
+                    html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("@author4", html)  # authors rendered
+
+# Is the home feed streamed, with the pager and likes still right?
+    def test_home_feed_streamed(self):
+        author = User.signup("author", "author@test.com", "password", None)
+        db.session.commit()
+
+        self.testuser.following.append(author)
+        db.session.commit()
+
+        with app.app_context():  # queueing the fan-out reads the config
+            for i in range(105):  # more than one page
+                m = Message(text=f"warble {i}", user_id=author.id)
+                db.session.add(m)
+                db.session.flush()
+                timeline.post_message(m)
+                timeline.fan_out_to_followers(m.id)
+            db.session.add(Likes(user_id=self.testuser.id, message_id=m.id))
+            db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id  # logged in
+
+            with c.get("/") as resp:
+                self.assertTrue(resp.is_streamed)  # not rendered up front
+
+                html = resp.get_data(as_text=True)
+                self.assertEqual(html.count('class="list-group-item"'), 100)
+                self.assertIn("btn-primary", html)  # the liked message
+                self.assertIn("before=", html)  # link to the older page
+
+# Does a flash on a streamed page show once, and leave the session?
+    def test_streamed_page_consumes_flashes(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id  # logged in
+                sess['_flashes'] = [('success', "Hello, testuser!")]
+
+            with c.get("/") as resp:
+                html = resp.get_data(as_text=True)
+            self.assertIn("Hello, testuser!", html)
+
+            with c.session_transaction() as sess:
+                self.assertNotIn('_flashes', sess)
+
+            with c.get("/") as resp:
+                html = resp.get_data(as_text=True)
+            self.assertNotIn("Hello, testuser!", html)
@@ -0,0 +1,63 @@
+"""Request metrics tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_metrics.py
+
+
+from unittest import TestCase
+
+from app import app
+from metrics import Histogram, registry
+
+
+class MetricsTestCase(TestCase):
+    """Test histograms and the /metrics endpoint."""
+
+    def setUp(self):
+        registry.clear()
+        self.client = app.test_client()
+        self.sample_rate = app.config['METRICS_SAMPLE_RATE']
+
+    def tearDown(self):
+        app.config['METRICS_SAMPLE_RATE'] = self.sample_rate
+
+    def test_histogram_buckets(self):
+        histogram = Histogram([1, 5])
+        for value in (0.5, 1, 3, 9):
+            histogram.observe(value)
+
+        lines = list(histogram.lines('x', 'endpoint="e"'))
+        self.assertEqual(lines, [
+            'x_bucket{endpoint="e",le="1"} 2',  # le is inclusive
+            'x_bucket{endpoint="e",le="5"} 3',
+            'x_bucket{endpoint="e",le="+Inf"} 4',
+            'x_sum{endpoint="e"} 13.5',
+            'x_count{endpoint="e"} 4',
+        ])
+
+    def test_sampled_request_recorded(self):
+        app.config['METRICS_SAMPLE_RATE'] = 1
+
+        self.client.get('/login')
+        self.client.get('/login')
+
+        latency = registry.get('warbler_request_seconds', 'warbler.login')
+        self.assertEqual(latency.count, 2)
+        render = registry.get('warbler_request_render_seconds',
+                              'warbler.login')
+        self.assertGreater(render.sum, 0)
+
+        body = self.client.get('/metrics').get_data(as_text=True)
+        self.assertIn('# TYPE warbler_request_queries histogram', body)
+        self.assertIn('warbler_request_seconds_count{endpoint="warbler.login"} 2',
+                      body)
+        self.assertNotIn('endpoint="metrics"', body)
+
+    def test_sampling_off(self):
+        app.config['METRICS_SAMPLE_RATE'] = 0
+
+        self.client.get('/login')
+
+        self.assertIsNone(registry.get('warbler_request_seconds',
+                                       'warbler.login'))
@@ -0,0 +1,62 @@
+"""Schema migration tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_migrations.py
+
+
+import os
+from unittest import TestCase
+from sqlalchemy import inspect
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+from models import db
+import migrations
+
+
+class MigrationsTestCase(TestCase):
+    """Test upgrade/downgrade and the hot query index check."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()  # tables + indexes as the models declare them
+        db.engine.execute(f"DROP TABLE IF EXISTS {migrations.MIGRATIONS_TABLE}")
+
+    def index_names(self, table):
+        return {index['name'] for index in inspect(db.engine).get_indexes(table)}
+
+    def test_models_cover_hot_queries(self):
+        missing = migrations.unindexed_hot_queries(
+            db.engine, db.Model.__subclasses__())
+        self.assertEqual(missing, [])  # every hot query has an index
+
+    def test_check_finds_missing_index(self):
+        db.engine.execute("DROP INDEX ix_messages_user_id_timestamp")
+
+        missing = migrations.unindexed_hot_queries(
+            db.engine, db.Model.__subclasses__())
+        self.assertEqual(missing, [('messages', ('user_id', 'timestamp'))])
+
+    def test_upgrade_is_repeatable(self):
+        # create_all already made everything; upgrading on top is harmless
+        ran = migrations.upgrade(db.engine)
+        self.assertEqual(ran, [m.revision for m in migrations.load_revisions()])
+
+        self.assertEqual(migrations.upgrade(db.engine), [])  # nothing pending
+
+    def test_downgrade_and_upgrade(self):
+        migrations.upgrade(db.engine)
+
+        migrations.downgrade(db.engine, '0001')  # revert the hot path indexes
+        self.assertNotIn("ix_messages_user_id_timestamp",
+                         self.index_names("messages"))
+        self.assertNotIn('0002', migrations.applied_revisions(db.engine))
+
+        migrations.upgrade(db.engine)  # and put them back
+        self.assertIn("ix_messages_user_id_timestamp",
+                      self.index_names("messages"))
@@ -0,0 +1,51 @@
+"""Keyset pagination tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_pagination.py
+
+
+from datetime import datetime
+from unittest import TestCase
+
+from models import Message
+from pagination import encode_cursor, decode_cursor, InvalidCursor
+
+
+class CursorTestCase(TestCase):
+    """Test cursor encoding."""
+
+    def test_round_trip(self):
+        key = (datetime(2020, 1, 2, 3, 4, 5, 678), 42)  # timestamp + id key
+        cursor = encode_cursor(key)
+
+        self.assertNotIn("=", cursor)  # safe to drop into a querystring
+        self.assertEqual(decode_cursor(cursor), key)  # comes back unchanged
+
+    def test_string_keys(self):
+        key = ("warbler", 7)  # username + id key
+        self.assertEqual(decode_cursor(encode_cursor(key)), key)
+
+    def test_garbage_cursor(self):
+        with self.assertRaises(InvalidCursor):  # not base64 json
+            decode_cursor("not a cursor!")
+
+        with self.assertRaises(InvalidCursor):  # json, but not a key
+            decode_cursor(encode_cursor([["d", "yesterday"]]))
+
+    def test_tampered_cursor(self):
+        keys = (Message.timestamp, Message.id)
+        key = (datetime(2020, 1, 2, 3, 4, 5, 678), 42)
+        self.assertEqual(decode_cursor(encode_cursor(key), keys), key)
+
+        with self.assertRaises(InvalidCursor):  # a key too short
+            decode_cursor(encode_cursor(key[:1]), keys)
+
+        with self.assertRaises(InvalidCursor):  # a key too long
+            decode_cursor(encode_cursor(key + (7,)), keys)
+
+        with self.assertRaises(InvalidCursor):  # id swapped for a string
+            decode_cursor(encode_cursor((key[0], "42")), keys)
+
+        with self.assertRaises(InvalidCursor):  # timestamp for a number
+            decode_cursor(encode_cursor((0, 42)), keys)
@@ -0,0 +1,51 @@
+"""Password hashing pool tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_passwords.py
+
+
+import threading
+from unittest import TestCase
+
+import passwords
+from passwords import HashPool, HashingBusy
+
+
+class HashPoolTestCase(TestCase):
+    """Test the bounded hashing pool."""
+
+    def test_runs_on_pool(self):
+        pool = HashPool(workers=1, max_queue=0)
+        name = pool.run(lambda: threading.current_thread().name)
+        self.assertTrue(name.startswith("bcrypt"))  # not the caller's thread
+        pool.shutdown()
+
+    def test_sheds_load_when_full(self):
+        pool = HashPool(workers=1, max_queue=0)  # one slot, no queue
+        started, release = threading.Event(), threading.Event()
+
+        def slow_hash():
+            started.set()
+            release.wait()
+
+        busy = threading.Thread(target=pool.run, args=(slow_hash,))
+        busy.start()
+        started.wait()  # the only slot is taken
+
+        with self.assertRaises(HashingBusy):
+            pool.run(lambda: None)
+
+        release.set()
+        busy.join()
+        self.assertEqual(pool.run(lambda: 42), 42)  # slot freed up again
+        pool.shutdown()
+
+    def test_needs_rehash(self):
+        hashed = passwords.bcrypt.generate_password_hash("password", 4).decode()
+        self.assertTrue(hashed.startswith("$2b$04$"))
+
+        self.assertTrue(passwords.needs_rehash(hashed))  # 4 != configured
+        self.assertFalse(passwords.needs_rehash(
+            hashed.replace("$04$", f"${passwords.default_hashing.rounds:02}$")))
+        self.assertTrue(passwords.needs_rehash("not a bcrypt hash"))
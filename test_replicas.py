@@ -0,0 +1,71 @@
+"""Read-replica routing tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_replicas.py
+#
+# Two SQLite files stand in for the primary and the replica; they hold
+# different data, so each page shows which one it was read from.
+
+
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from app import create_app, CURR_USER_KEY
+from config import Config
+from models import db, User
+
+
+class ReplicaRoutingTestCase(TestCase):
+    """Test which database each request reads."""
+
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+
+        class TestConfig(Config):
+            SQLALCHEMY_DATABASE_URI = (
+                f"sqlite:///{os.path.join(self.tmp.name, 'primary.db')}")
+            REPLICA_DATABASE_URI = (
+                f"sqlite:///{os.path.join(self.tmp.name, 'replica.db')}")
+            WTF_CSRF_ENABLED = False
+            METRICS_SAMPLE_RATE = 0
+
+        self.app = create_app(TestConfig)
+
+        with self.app.app_context():
+            for bind, name in ((None, 'primary'), ('replica', 'replica')):
+                engine = db.get_engine(self.app, bind=bind)
+                db.Model.metadata.create_all(engine)
+                engine.execute(User.__table__.insert().values(
+                    id=1, email=f'{name}@test.com', username=name,
+                    password='hash'))
+
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_read_only_view_uses_replica(self):
+        with self.client.get('/users/1') as resp:
+            self.assertIn(b'@replica', resp.data)
+
+    def test_other_views_use_primary(self):
+        with self.client.get('/users') as resp:
+            self.assertIn(b'@primary', resp.data)
+            self.assertNotIn(b'@replica', resp.data)
+
+    def test_sticky_after_post(self):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = 1
+
+        self.client.post('/messages/new', data={'text': 'hi'})
+        with self.client.get('/users/1') as resp:
+            self.assertIn(b'@primary', resp.data)
+            self.assertIn(b'hi', resp.data)  # the message we just wrote
+
+        with self.client.session_transaction() as sess:
+            sess['primary_until'] = 0  # as if the stickiness expired
+
+        with self.client.get('/users/1') as resp:
+            self.assertIn(b'@replica', resp.data)
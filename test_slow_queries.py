@@ -0,0 +1,78 @@
+"""Slow-query log tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_slow_queries.py
+
+
+from unittest import TestCase
+
+from sqlalchemy import create_engine
+
+from slow_queries import SlowQueryLog
+
+
+class SlowQueryLogTestCase(TestCase):
+    """Test what gets logged, on an in-memory SQLite database."""
+
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+        self.engine.execute('CREATE TABLE users (id INTEGER PRIMARY KEY, '
+                            'username TEXT, password TEXT)')
+
+    def test_logs_select_with_plan(self):
+        SlowQueryLog(threshold_ms=0).watch(self.engine)
+
+        with self.assertLogs('warbler.slow_queries') as logs:
+            self.engine.execute('SELECT id FROM users WHERE username LIKE ?',
+                                '%ann%')
+
+        entry = logs.output[0]
+        self.assertIn("SELECT id FROM users WHERE username LIKE ?", entry)
+        self.assertIn("('%ann%',)", entry)
+        self.assertIn("(outside a request)", entry)
+        self.assertIn("plan:\n  SCAN", entry)
+
+    def test_explains_each_statement_once(self):
+        SlowQueryLog(threshold_ms=0).watch(self.engine)
+
+        with self.assertLogs('warbler.slow_queries') as logs:
+            self.engine.execute('SELECT id FROM users')
+            self.engine.execute('SELECT id FROM users')
+            self.engine.execute("INSERT INTO users (username) VALUES ('x')")
+
+        self.assertIn("plan:", logs.output[0])
+        self.assertNotIn("plan:", logs.output[1])  # explained recently
+        self.assertNotIn("plan:", logs.output[2])  # not a SELECT
+
+    def test_forgets_old_statements(self):
+        log = SlowQueryLog(threshold_ms=0, explain_interval=0)
+        log.watch(self.engine)
+
+        with self.assertLogs('warbler.slow_queries') as logs:
+            for n in range(3):
+                self.engine.execute(f'SELECT id FROM users WHERE id = {n}')
+            self.engine.execute('SELECT id FROM users WHERE id = 0')
+
+        self.assertIn("plan:", logs.output[3])  # explained again
+        self.assertEqual(len(log._explained), 1)  # only the latest kept
+
+    def test_analyze_skips_locking_selects(self):
+        log = SlowQueryLog(threshold_ms=0, analyze=True)
+
+        self.assertEqual(log._explain_prefix(
+            'postgresql', 'SELECT id FROM users'), 'EXPLAIN ANALYZE ')
+        # running these again would take locks or change state
+        for statement in ('SELECT id FROM jobs FOR UPDATE SKIP LOCKED',
+                          'SELECT id FROM users FOR SHARE',
+                          "SELECT setval('users_id_seq', 1)",
+                          'SELECT pg_advisory_xact_lock(1)'):
+            self.assertEqual(log._explain_prefix('postgresql', statement),
+                             'EXPLAIN ')
+
+    def test_fast_queries_not_logged(self):
+        SlowQueryLog(threshold_ms=10000).watch(self.engine)
+
+        with self.assertRaises(AssertionError):
+            with self.assertLogs('warbler.slow_queries'):
+                self.engine.execute('SELECT id FROM users')
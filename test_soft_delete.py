@@ -0,0 +1,156 @@
+"""Soft delete and purge tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_soft_delete.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follows, Likes
+import counters
+import soft_delete
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+
+
+class SoftDeleteTestCase(TestCase):
+    """Test hiding deleted users and messages, then purging them."""
+
+    def setUp(self):
+        self.context = app.app_context()  # deletes queue their purge
+        self.context.push()
+
+        db.drop_all()
+        db.create_all()
+
+        author = User.signup("author", "author@test.com", "password", None)
+        fan = User.signup("fan", "fan@test.com", "password", None)
+        db.session.commit()
+        self.author_id, self.fan_id = author.id, fan.id
+
+        db.session.add(Follows(user_being_followed_id=self.author_id,
+                               user_following_id=self.fan_id))
+        messages = [Message(text=f"warble {i}", user_id=self.author_id)
+                    for i in range(5)]
+        db.session.add_all(messages)
+        db.session.commit()
+        self.message_ids = [m.id for m in messages]
+
+        db.session.add_all([Likes(user_id=self.fan_id, message_id=message_id)
+                            for message_id in self.message_ids])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+        self.context.pop()
+
+    def test_delete_message(self):
+        msg = Message.query.get(self.message_ids[0])
+        soft_delete.delete_message(msg)
+        db.session.commit()
+
+        self.assertIsNone(Message.query.get(self.message_ids[0]))  # hidden
+        self.assertEqual(Message.query.count(), 4)
+        self.assertIsNotNone(soft_delete.include_deleted(Message.query)
+                             .filter_by(id=self.message_ids[0]).first())
+
+        author = User.query.get(self.author_id)
+        fan = User.query.get(self.fan_id)
+        self.assertEqual(author.messages_count, 4)
+        self.assertEqual(fan.likes_count, 4)  # its like no longer counts
+
+    def test_delete_user(self):
+        soft_delete.delete_user(User.query.get(self.author_id))
+        db.session.commit()
+
+        self.assertIsNone(User.query.get(self.author_id))
+        self.assertIsNone(User.query.filter_by(username="author").first())
+        self.assertEqual(Message.query.count(), 0)  # their messages too
+
+        fan = User.query.get(self.fan_id)
+        self.assertEqual(fan.following_count, 0)
+        self.assertEqual(fan.likes_count, 0)
+        self.assertEqual(fan.following, [])
+
+    def test_unfollow_deleted_user(self):
+        soft_delete.delete_user(User.query.get(self.author_id))
+        db.session.commit()
+
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.fan_id
+
+            resp = c.post(f"/users/stop-following/{self.author_id}")
+            self.assertEqual(resp.status_code, 404)
+
+        # not taken off a second time
+        self.assertEqual(User.query.get(self.fan_id).following_count, 0)
+
+    def test_purge(self):
+        soft_delete.delete_message(Message.query.get(self.message_ids[0]))
+        soft_delete.delete_user(User.query.get(self.fan_id))
+        db.session.commit()
+
+        # small batches, so every table takes several
+        purged = soft_delete.purge(batch_size=2)
+
+        self.assertEqual(purged, (1, 1))
+        self.assertEqual(soft_delete.include_deleted(User.query).count(), 1)
+        self.assertEqual(
+            soft_delete.include_deleted(Message.query).count(), 4)
+        self.assertEqual(Follows.query.count(), 0)
+        self.assertEqual(Likes.query.count(), 0)
+
+        # nothing left for a second run
+        self.assertEqual(soft_delete.purge(batch_size=2), (0, 0))
+
+    def test_repair_counters_before_purge(self):
+        other = User.signup("other", "other@test.com", "password", None)
+        db.session.commit()
+        other_id = other.id
+        db.session.add(Follows(user_being_followed_id=self.fan_id,
+                               user_following_id=other_id))
+        db.session.commit()
+
+        soft_delete.delete_message(Message.query.get(self.message_ids[0]))
+        soft_delete.delete_user(User.query.get(other_id))
+        db.session.commit()
+
+        # hidden rows stay uncounted, before the purge and after it
+        for _ in range(2):
+            counters.recompute_counters()
+            db.session.expire_all()
+
+            author = User.query.get(self.author_id)
+            fan = User.query.get(self.fan_id)
+            self.assertEqual(author.messages_count, 4)
+            self.assertEqual(author.followers_count, 1)
+            self.assertEqual(fan.likes_count, 4)
+            self.assertEqual(fan.followers_count, 0)
+            self.assertEqual(fan.following_count, 1)
+
+            soft_delete.purge()
+
+    def test_eager_purge_after_commit(self):
+        app.config['JOBS_EAGER'] = True
+        try:
+            soft_delete.delete_message(Message.query.get(self.message_ids[0]))
+
+            # nothing committed or purged while the caller's transaction
+            # is still open
+            self.assertEqual(
+                soft_delete.include_deleted(Message.query).count(), 5)
+            db.session.rollback()
+            self.assertEqual(Message.query.count(), 5)  # and it never ran
+
+            soft_delete.delete_message(Message.query.get(self.message_ids[0]))
+            db.session.commit()
+        finally:
+            app.config['JOBS_EAGER'] = False
+
+        self.assertEqual(
+            soft_delete.include_deleted(Message.query).count(), 4)
@@ -0,0 +1,162 @@
+"""Trending messages tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_trending.py
+
+
+import io
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from loader import Source, insert_rows
+from models import db, User, Message, Likes, LikeBucket
+import soft_delete
+import trending
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class TrendingTestCase(TestCase):
+    """Test like buckets, the window rankings and their pages."""
+
+    def setUp(self):
+        self.context = app.app_context()
+        self.context.push()
+
+        db.drop_all()
+        db.create_all()
+        trending.top_messages().clear()
+
+        author = User.signup("author", "author@test.com", "password", None)
+        fans = [User.signup(f"fan{i}", f"fan{i}@test.com", "password", None)
+                for i in range(3)]
+        db.session.commit()
+        self.author_id = author.id
+        self.fan_ids = [fan.id for fan in fans]
+
+        messages = [Message(text=f"warble {i}", user_id=author.id)
+                    for i in range(3)]
+        db.session.add_all(messages)
+        db.session.commit()
+        self.message_ids = [msg.id for msg in messages]
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+        self.context.pop()
+
+    def like(self, fan_id, message_id, ago=timedelta()):
+        db.session.add(Likes(user_id=fan_id, message_id=message_id,
+                             created_at=datetime.utcnow() - ago))
+        db.session.commit()
+
+    def test_bucket_of(self):
+        self.assertEqual(trending.bucket_of(datetime(2024, 5, 1, 13, 47, 12)),
+                         datetime(2024, 5, 1, 13, 40))
+
+    def test_likes_fill_buckets(self):
+        first, second, _ = self.message_ids
+        for fan_id in self.fan_ids:
+            self.like(fan_id, first)
+        self.like(self.fan_ids[0], second)
+
+        self.assertEqual(trending.count_window(timedelta(hours=1), 10),
+                         [(first, 3), (second, 1)])
+
+        db.session.delete(Likes.query.get((self.fan_ids[0], first)))
+        db.session.commit()
+
+        self.assertEqual(trending.count_window(timedelta(hours=1), 10),
+                         [(first, 2), (second, 1)])
+        self.assertEqual(LikeBucket.query.count(), 2)
+
+    def test_windows(self):
+        first, second, third = self.message_ids
+        self.like(self.fan_ids[0], first)
+        self.like(self.fan_ids[1], second, ago=timedelta(hours=5))
+        self.like(self.fan_ids[2], second, ago=timedelta(hours=6))
+        self.like(self.fan_ids[0], third, ago=timedelta(days=3))
+
+        self.assertEqual(trending.top_messages().get('1h'), [(first, 1)])
+        self.assertEqual(trending.top_messages().get('24h'),
+                         [(second, 2), (first, 1)])
+        self.assertEqual(trending.top_messages().get('7d'),
+                         [(second, 2), (third, 1), (first, 1)])
+
+        # cached: a new like shows after the TTL (or a clear)
+        self.like(self.fan_ids[1], first)
+        self.assertEqual(trending.top_messages().get('1h'), [(first, 1)])
+        trending.top_messages().clear()
+        self.assertEqual(trending.top_messages().get('1h'), [(first, 2)])
+
+    def test_deleted_messages_left_out(self):
+        first, second, _ = self.message_ids
+        self.like(self.fan_ids[0], first)
+        self.like(self.fan_ids[0], second)
+
+        soft_delete.delete_message(Message.query.get(first))
+        db.session.commit()
+
+        self.assertEqual([(msg.id, count) for msg, count
+                          in trending.trending('1h')], [(second, 1)])
+
+    def test_rebuild_and_prune(self):
+        first, second, _ = self.message_ids
+        self.like(self.fan_ids[0], first)
+        self.like(self.fan_ids[1], first, ago=timedelta(days=2))
+        self.like(self.fan_ids[2], second, ago=timedelta(days=10))
+
+        db.session.query(LikeBucket).delete()
+        self.assertEqual(trending.rebuild(), 2)  # too old: not counted
+        db.session.commit()
+        self.assertEqual(trending.top_messages().get('7d'), [(first, 2)])
+
+        db.session.add(LikeBucket(message_id=second, likes=1,
+                                  bucket=datetime(2000, 1, 1)))
+        db.session.commit()
+        trending.prune_buckets()
+        db.session.commit()
+        self.assertEqual(LikeBucket.query.count(), 2)
+
+    def test_loaded_likes_not_counted(self):
+        rows = "".join(f"{fan_id},{self.message_ids[0]}\n"
+                       for fan_id in self.fan_ids)
+        source = Source(io.StringIO("user_id,message_id\n" + rows), Likes,
+                        {'user_id': User, 'message_id': Message},
+                        {User: 0, Message: 0})
+        insert_rows(db.engine, source, batch_size=100)
+
+        # their times are unknown, so no window has them
+        self.assertEqual(trending.rebuild(), 0)
+        db.session.commit()
+        self.assertEqual(trending.trending('7d'), [])
+
+    def test_pages(self):
+        first = self.message_ids[0]
+        self.like(self.fan_ids[0], first)
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.fan_ids[0]
+
+            resp = c.get("/trending?window=1h")
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("warble 0", resp.get_data(as_text=True))
+            self.assertIn("1 like", resp.get_data(as_text=True))
+
+            self.assertEqual(c.get("/trending?window=2h").status_code, 404)
+
+            data = c.get("/api/trending?window=1h").get_json()
+            self.assertEqual(data['window'], '1h')
+            self.assertEqual([(m['id'], m['likes'], m['liked'])
+                              for m in data['messages']], [(first, 1, True)])
+
+            self.assertEqual(c.get("/api/trending?window=2h").status_code,
+                             400)
@@ -8,7 +8,9 @@
 import os
 from unittest import TestCase
 from sqlalchemy import exc
-from models import db, User, Message, Follows
+from models import db, User, Message, Follows, Likes
+import counters
+import passwords
 
 # BEFORE we import our app, let's set an environmental variable
 # to use a different database for tests (we need to do this
@@ -83,6 +85,20 @@ class UserModelTestCase(TestCase):
         self.assertTrue(self.u2.is_followed_by(self.u1)) # check to see that u1 is follwoing u2 with assertTrue
         self.assertFalse(self.u1.is_followed_by(self.u2)) #check relationship in other direction
 
+# Can we get the follow state for a whole page of users in one go?
+    def test_follow_states(self):
+        u3 = User.signup("test3", "email3@email.com", "password", None)
+        u3.id = 3333  # a third user nobody follows
+        self.u1.following.append(self.u2)  # u1 follows u2
+        self.u2.following.append(self.u1)  # and u2 follows u1 back
+        db.session.commit()
+
+        states = self.u1.follow_states([self.uid2, 3333])
+        self.assertTrue(states[self.uid2].following)
+        self.assertTrue(states[self.uid2].followed_by)
+        self.assertFalse(states[3333].following)
+        self.assertFalse(states[3333].followed_by)
+
 # Does is_following successfully detect when user1 is not following user2?
 # Does is_followed_by successfully detect when user1 is not followed by user2?
     def test_user_follows(self):
@@ -97,6 +113,40 @@ class UserModelTestCase(TestCase):
         self.assertEqual(self.u2.followers[0].id, self.u1.id) #checking to see that the ids of u2's follower and u1 match
         self.assertEqual(self.u1.following[0].id, self.u2.id) #checking to see that u1's following id matches u2's
 
+# Are the denormalized counters kept current as rows come and go?
+    def test_counters(self):
+        db.session.add(Follows(user_being_followed_id=self.uid2,
+                               user_following_id=self.uid1))  # u1 follows u2
+        m = Message(id=4321, text="count me", user_id=self.uid2)
+        db.session.add(m)
+        db.session.commit()
+        db.session.add(Likes(user_id=self.uid1, message_id=4321))  # u1 likes it
+        db.session.commit()
+
+        u1 = User.query.get(self.uid1)
+        u2 = User.query.get(self.uid2)
+        self.assertEqual(u1.following_count, 1)
+        self.assertEqual(u2.followers_count, 1)
+        self.assertEqual(u2.messages_count, 1)
+        self.assertEqual(u1.likes_count, 1)
+
+        db.session.delete(Message.query.get(4321))  # likes go with it
+        db.session.commit()
+
+        u1 = User.query.get(self.uid1)
+        self.assertEqual(u1.likes_count, 0)
+        self.assertEqual(User.query.get(self.uid2).messages_count, 0)
+
+    def test_repair_counters(self):
+        self.u1.following.append(self.u2)  # bypasses the counter events
+        db.session.commit()
+        self.assertEqual(User.query.get(self.uid2).followers_count, 0)
+
+        counters.recompute_counters()  # recount from the follows table
+
+        self.assertEqual(User.query.get(self.uid2).followers_count, 1)
+        self.assertEqual(User.query.get(self.uid1).following_count, 1)
+
 # Does User.create successfully create a new user given valid credentials?
     def test_valid_signup(self):
         u_test = User.signup("testtesttest", "testtest@test.com", "password", None) #usimg signup method to create u to test against
@@ -139,6 +189,18 @@ class UserModelTestCase(TestCase):
         u = User.authenticate(self.u1.username, "password") #give a valid username/password
         self.assertIsNotNone(u) #check user existence
         self.assertEqual(u.id, self.uid1) #check u.id = u1 uid
+# Does logging in upgrade a hash made with an old work factor?
+    def test_rehash_on_login(self):
+        old_hash = passwords.bcrypt.generate_password_hash("password", 4)
+        self.u1.password = old_hash.decode()  # pretend it's an old, cheap hash
+        db.session.commit()
+
+        u = User.authenticate(self.u1.username, "password")
+        db.session.commit()  # the route commits after authenticate
+
+        self.assertTrue(u.password.startswith(f"$2b${passwords.hashing().rounds:02}$"))
+        self.assertTrue(User.authenticate(self.u1.username, "password"))
+
 # Does User.authenticate fail to return a user when the username is invalid?
     def test_invalid_username(self):
         self.assertFalse(User.authenticate("badusername", "password")) #check that a bad username is assertedFalse
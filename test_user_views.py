@@ -5,12 +5,16 @@
 #    FLASK_ENV=production python -m unittest test_user_views.py
 
 
-from app import app, CURR_USER_KEY
+from app import app, CURR_USER_KEY, remove_like
 import os
 from unittest import TestCase
+from unittest.mock import patch
 
 from models import db, connect_db, Message, User, Likes, Follows
+from pagination import encode_cursor
 from bs4 import BeautifulSoup
+from sqlalchemy.exc import IntegrityError
+from query_counter import QueryCountMixin
 
 # BEFORE we import our app, let's set an environmental variable
 # to use a different database for tests (we need to do this
@@ -34,7 +38,7 @@ db.create_all()
 app.config['WTF_CSRF_ENABLED'] = False
 
 
-class MessageViewTestCase(TestCase):
+class MessageViewTestCase(QueryCountMixin, TestCase):
     """Test views for messages."""
 
     def setUp(self):
@@ -83,6 +87,21 @@ class MessageViewTestCase(TestCase):
             self.assertIn("@hij", str(resp.data))
             self.assertIn("@testing", str(resp.data))
 
+    def test_users_index_pages(self):
+        with self.client as c, patch("app.USERS_PER_PAGE", 2):  # 2 per page
+            resp = c.get("/users")
+            soup = BeautifulSoup(str(resp.data), 'html.parser')
+            names = [p.text for p in soup.select(".card-link p")]
+
+            # alphabetical, first two of five, with the total shown
+            self.assertEqual(names, ["@abc", "@efg"])
+            self.assertIn("5 users", str(resp.data))
+
+            resp = c.get(soup.find("a", string="Next")["href"])
+            soup = BeautifulSoup(str(resp.data), 'html.parser')
+            names = [p.text for p in soup.select(".card-link p")]
+            self.assertEqual(names, ["@hij", "@testing"])  # next two
+
     def test_users_search(self):
         with self.client as c:
             resp = c.get("/users?q=test")
@@ -96,6 +115,37 @@ class MessageViewTestCase(TestCase):
             self.assertNotIn("@efg", str(resp.data))
             self.assertNotIn("@hij", str(resp.data))
 
+    def test_users_search_total(self):
+        with self.client as c, patch("app.USERS_PER_PAGE", 1):  # 1 per page
+            resp = c.get("/users?q=test")
+            soup = BeautifulSoup(str(resp.data), 'html.parser')
+            names = [p.text for p in soup.select(".card-link p")]
+
+            # the best match shown, counted out of every match
+            self.assertEqual(names, ["@testing"])
+            self.assertIn("showing 1 of", soup.select_one(".text-muted").text)
+            self.assertIn("2 users", soup.select_one(".text-muted").text)
+
+    def test_users_search_ranking(self):
+        with self.client as c:
+            resp = c.get("/users?q=TESTING")  # search ignores case
+            soup = BeautifulSoup(str(resp.data), 'html.parser')
+            names = [p.text for p in soup.select(".card-link p")]
+
+            # only the exact match: no longer username starts with it
+            self.assertEqual(names, ["@testing"])
+
+            resp = c.get("/users?q=test")
+            soup = BeautifulSoup(str(resp.data), 'html.parser')
+            names = [p.text for p in soup.select(".card-link p")]
+            # both share the prefix; the shorter username first
+            self.assertEqual(names, ["@testing", "@testuser"])
+
+    def test_users_search_wildcards(self):
+        with self.client as c:
+            resp = c.get("/users?q=%25")  # a literal %, not a wildcard
+            self.assertIn("Sorry, no users found", str(resp.data))
+
     def test_user_show(self):
         with self.client as c:
             resp = c.get(f"/users/{self.testuser_id}")  # route is users/userid
@@ -174,6 +224,32 @@ class MessageViewTestCase(TestCase):
             # checking that the likes with the user_id we have matches our test like
             self.assertEqual(likes[0].user_id, self.testuser_id)
 
+    def test_toggle_like_json(self):
+        m = Message(id=1985, text="Liked over XHR", user_id=self.u1_id)
+        db.session.add(m)
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id  # logged in
+
+            headers = {"Accept": "application/json"}
+            resp = c.post("/messages/1985/like", headers=headers)
+            self.assertEqual(resp.status_code, 200)  # no redirect
+            self.assertEqual(resp.get_json(), {"message_id": 1985, "liked": True})
+            self.assertIsNotNone(Likes.query.get((self.testuser_id, 1985)))
+
+            resp = c.post("/messages/1985/like", headers=headers)  # unlike
+            self.assertEqual(resp.get_json(), {"message_id": 1985, "liked": False})
+            self.assertIsNone(Likes.query.get((self.testuser_id, 1985)))
+
+    def test_duplicate_like_rejected(self):
+        self.setup_likes()  # testuser already likes message 9876
+
+        db.session.add(Likes(user_id=self.testuser_id, message_id=9876))
+        with self.assertRaises(IntegrityError):  # unique at the database
+            db.session.commit()
+
     def test_remove_like(self):
         self.setup_likes()  # setting up likes
 
@@ -204,6 +280,49 @@ class MessageViewTestCase(TestCase):
             likes = Likes.query.filter(Likes.message_id == m.id).all()
             # the like has been deleted #checking that the length of these likes is 0
 
+    def test_unlike_race_counts_once(self):
+        self.setup_likes()
+        like = Likes.query.get((self.testuser_id, 9876))
+
+        remove_like(like)
+        remove_like(like)  # a second request that loaded the same row
+        db.session.commit()
+
+        self.assertIsNone(Likes.query.get((self.testuser_id, 9876)))
+        self.assertEqual(User.query.get(self.testuser_id).likes_count, 0)
+
+    def test_likes_page_query_count(self):
+        for i in range(10):  # ten liked messages by u1
+            m = Message(id=5000 + i, text=f"warble {i}", user_id=self.u1_id)
+            db.session.add(m)
+        db.session.commit()
+        db.session.add_all([Likes(user_id=self.testuser_id, message_id=5000 + i)
+                            for i in range(10)])
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id  # logged in
+
+            # authors come with the liked messages, not one query each;
+            # the page streams, so its queries run as the body is read
+            with self.assertMaxQueries(7):
+                with c.get(f"/users/{self.testuser_id}/likes") as resp:
+                    html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("warble 9", html)
+
+    def test_follow_self_forbidden(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            resp = c.post(f"/users/follow/{self.testuser_id}")
+            self.assertEqual(resp.status_code, 403)
+
+        self.assertEqual(Follows.query.count(), 0)
+
     def test_unauthenticated_like(self):
         self.setup_likes()  # setting up likes, notice no CURR_KEY in this function
 
@@ -225,6 +344,74 @@ class MessageViewTestCase(TestCase):
             # The number of likes has not changed since making the request
             self.assertEqual(like_count, Likes.query.count())
 
+    def test_user_show_pages(self):
+        for i in range(101):  # one more message than fits on a page
+            db.session.add(Message(text=f"warble {i}", user_id=self.testuser_id))
+        db.session.commit()
+
+        with self.client as c:
+            resp = c.get(f"/users/{self.testuser_id}")
+            soup = BeautifulSoup(str(resp.data), 'html.parser')
+
+            # first page is full and links to the older messages
+            self.assertEqual(len(soup.select("#messages li")), 100)
+            older = soup.find("a", string="Older")
+            self.assertIsNotNone(older)
+
+            resp = c.get(older["href"])  # follow the cursor
+            soup = BeautifulSoup(str(resp.data), 'html.parser')
+            self.assertEqual(len(soup.select("#messages li")), 1)
+            self.assertIsNone(soup.find("a", string="Older"))  # last page
+            self.assertIsNotNone(soup.find("a", string="Newer"))
+
+    def test_user_show_not_modified(self):
+        with self.client as c:
+            # only its headers are read, so close the streamed body
+            with c.get(f"/users/{self.testuser_id}") as resp:
+                etag = resp.headers["ETag"]  # validator for this version
+                self.assertEqual(resp.headers["Cache-Control"],
+                                 "private, no-cache")
+
+            # unchanged profile: 304 with no body
+            resp = c.get(f"/users/{self.testuser_id}",
+                         headers={"If-None-Match": etag})
+            self.assertEqual(resp.status_code, 304)
+            self.assertEqual(resp.data, b"")
+
+            db.session.add(Message(text="something new", user_id=self.testuser_id))
+            db.session.commit()  # posting bumps the user's change stamp
+
+            with c.get(f"/users/{self.testuser_id}",
+                       headers={"If-None-Match": etag}) as resp:
+                self.assertEqual(resp.status_code, 200)
+                self.assertIn("something new", str(resp.data))
+
+    def test_user_show_graph_reload(self):
+        graph = app.extensions['follow_graph']
+        graph.refresh()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            with c.get(f"/users/{self.testuser_id}") as resp:
+                etag = resp.headers["ETag"]
+
+            # a new snapshot may change the "followed by" badge
+            graph.refresh()
+            with c.get(f"/users/{self.testuser_id}",
+                       headers={"If-None-Match": etag}) as resp:
+                self.assertEqual(resp.status_code, 200)
+
+    def test_user_show_bad_cursor(self):
+        with self.client as c:
+            resp = c.get(f"/users/{self.testuser_id}?before=garbage")
+            self.assertEqual(resp.status_code, 400)  # bad cursor is a 400
+
+            tampered = encode_cursor(["1 OR 1=1"])  # valid, but not a key
+            resp = c.get(f"/users/{self.testuser_id}?before={tampered}")
+            self.assertEqual(resp.status_code, 400)
+
 # When you’re logged in, can you see the follower / following pages for any user?
 
 
@@ -0,0 +1,179 @@
+"""Precomputed home timelines (fan-out on write).
+
+Every user has a capped list of message ids in `timeline_entries`. Posting a
+message pushes its id to the author and each of their followers, so the home
+page reads one short index range instead of searching the whole messages
+table for everyone the user follows. Fan-out only appends; an hourly job
+cuts timelines back to the cap.
+
+None of these functions commit; they run inside the caller's transaction.
+Pushing a post to followers and backfilling a new follow are @tasks, which
+routes queue for a worker (see jobs.py) rather than run in the request.
+"""
+
+from sqlalchemy import exists, func, literal, select, tuple_
+from sqlalchemy.orm import joinedload
+
+from models import db, Follows, Message, TimelineEntry, User
+import jobs
+
+# How many message ids we keep per user.
+TIMELINE_LENGTH = 800
+
+entries = TimelineEntry.__table__
+ENTRY_COLUMNS = ['user_id', 'message_id', 'timestamp']
+
+
+def timeline_query(user_id):
+    """Query for the messages on `user_id`'s home timeline, newest first.
+
+    Authors are joined in the same round trip, since the feed shows each
+    message's username and avatar.
+    """
+
+    return (Message
+            .query
+            .options(joinedload(Message.user))
+            .join(TimelineEntry, TimelineEntry.message_id == Message.id)
+            .filter(TimelineEntry.user_id == user_id)
+            .order_by(TimelineEntry.timestamp.desc()))
+
+
+def _followers_entries(user_id, message_id, timestamp):
+    # a follow backfill that ran first may have pushed it already
+    already = (exists()
+               .where(entries.c.user_id == Follows.user_following_id)
+               .where(entries.c.message_id == message_id))
+
+    return (select([Follows.user_following_id,
+                    literal(message_id),
+                    literal(timestamp)])
+            .where(Follows.user_being_followed_id == user_id)
+            # a self-follow left from before add_follow refused them; the
+            # author gets their own entry anyway
+            .where(Follows.user_following_id != user_id)
+            .where(~already))
+
+
+def post_message(message):
+    """Put a new (flushed) `message` on its author's timeline now, and
+    queue pushing it to their followers."""
+
+    db.session.execute(entries.insert().values(
+        user_id=message.user_id, message_id=message.id,
+        timestamp=message.timestamp))
+
+    jobs.enqueue(fan_out_to_followers, message.id,
+                 key=f'fan-out:{message.id}')
+
+
+@jobs.task('timelines')
+def fan_out_to_followers(message_id):
+    """Push `message_id` to its author's followers' timelines."""
+
+    message = (db.session.query(Message.user_id, Message.timestamp)
+               .filter(Message.id == message_id)
+               .first())
+
+    # deleted before we got to it
+    if message is None:
+        return
+
+    db.session.execute(entries.insert().from_select(
+        ENTRY_COLUMNS,
+        _followers_entries(message.user_id, message_id, message.timestamp)))
+
+
+def remove_message(message_id):
+    """Take a message off every timeline it was pushed to."""
+
+    db.session.execute(
+        entries.delete().where(entries.c.message_id == message_id))
+
+
+@jobs.task('timelines')
+def add_follow(follower_id, followed_id):
+    """Backfill `follower_id`'s timeline with `followed_id`'s recent posts.
+
+    Queued by the follow route, so by the time it runs the follow may be
+    gone again (then it does nothing), or a fan-out may already have
+    pushed some of those posts (they're skipped).
+    """
+
+    if Follows.query.get((followed_id, follower_id)) is None:
+        return
+
+    already = (exists()
+               .where(entries.c.user_id == follower_id)
+               .where(entries.c.message_id == Message.id))
+    recent = (select([literal(follower_id), Message.id, Message.timestamp])
+              .where(Message.user_id == followed_id)
+              .where(~already)
+              .order_by(Message.timestamp.desc())
+              .limit(TIMELINE_LENGTH))
+
+    db.session.execute(entries.insert().from_select(ENTRY_COLUMNS, recent))
+    trim_timelines([follower_id])
+
+
+def remove_follow(follower_id, followed_id):
+    """Drop `followed_id`'s posts from `follower_id`'s timeline."""
+
+    their_messages = select([Message.id]).where(Message.user_id == followed_id)
+
+    db.session.execute(
+        entries.delete()
+        .where(entries.c.user_id == follower_id)
+        .where(entries.c.message_id.in_(their_messages)))
+
+
+@jobs.task('maintenance', every=3600)
+def trim_timelines(user_ids=None):
+    """Cut timelines back to TIMELINE_LENGTH entries.
+
+    Fan-out only ever appends, so this runs after follow backfills, and
+    hourly (or by hand, `flask trim-timelines`) for everyone.
+    """
+
+    position = (func.row_number()
+                .over(partition_by=entries.c.user_id,
+                      order_by=entries.c.timestamp.desc())
+                .label('position'))
+    ranked = select([entries.c.user_id, entries.c.message_id, position])
+
+    if user_ids is not None:
+        ranked = ranked.where(entries.c.user_id.in_(user_ids))
+
+    ranked = ranked.alias('ranked')
+    overflow = (select([ranked.c.user_id, ranked.c.message_id])
+                .where(ranked.c.position > TIMELINE_LENGTH))
+
+    db.session.execute(
+        entries.delete()
+        .where(tuple_(entries.c.user_id, entries.c.message_id).in_(overflow)))
+
+
+def rebuild_timeline(user_id):
+    """Recompute `user_id`'s timeline from the follows and messages tables."""
+
+    authors = (select([Follows.user_being_followed_id])
+               .where(Follows.user_following_id == user_id)
+               .union(select([literal(user_id)])))
+    recent = (select([literal(user_id), Message.id, Message.timestamp])
+              .where(Message.user_id.in_(authors))
+              .order_by(Message.timestamp.desc())
+              .limit(TIMELINE_LENGTH))
+
+    db.session.execute(entries.delete().where(entries.c.user_id == user_id))
+    db.session.execute(entries.insert().from_select(ENTRY_COLUMNS, recent))
+
+
+def rebuild_all_timelines():
+    """Recompute every user's timeline (after seeding or a bulk import)."""
+
+    user_ids = [user_id for (user_id,) in db.session.query(User.id)]
+
+    for user_id in user_ids:
+        rebuild_timeline(user_id)
+
+    return len(user_ids)
@@ -0,0 +1,204 @@
+"""Trending messages: the most liked in the last hour, day and week.
+
+Ranking straight from `likes` would be a GROUP BY over every like in the
+window, on every request. Instead each like and unlike adds or takes one
+from its message's `like_buckets` row for that BUCKET of time (mapper
+events below, in the same transaction as the like, as in counters.py). A
+window's counts are then a sum over one index range of buckets: at most
+window / BUCKET rows per message, and only for messages liked in it.
+
+Each app, in each process, keeps the top TRENDING_SIZE (message id, likes)
+of every window for TRENDING_TTL seconds (`top_messages()`), so that sum
+runs about once a minute per window per process, whatever the traffic.
+Windows count whole buckets: "1h" is the last 60 to 70 minutes.
+
+An hourly job drops buckets too old for any window. `flask
+rebuild-trending` recounts them from likes.created_at, e.g. after a bulk
+load, which bypasses the events. Likes and unlikes made while it runs may
+be missed.
+"""
+
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import bindparam, event, func, select, text
+from sqlalchemy.orm import joinedload
+
+from models import db, LikeBucket, Likes, Message
+import jobs
+
+BUCKET = timedelta(minutes=10)
+
+WINDOWS = {
+    '1h': timedelta(hours=1),
+    '24h': timedelta(days=1),
+    '7d': timedelta(days=7),
+}
+DEFAULT_WINDOW = '24h'
+
+EPOCH = datetime(1970, 1, 1)
+
+buckets = LikeBucket.__table__
+likes = Likes.__table__
+
+# Postgres and SQLite (3.24+) both take this upsert
+_add_like = text("""
+    INSERT INTO like_buckets (message_id, bucket, likes)
+    VALUES (:message_id, :bucket, 1)
+    ON CONFLICT (message_id, bucket)
+    DO UPDATE SET likes = like_buckets.likes + 1
+""").bindparams(bindparam('bucket', type_=buckets.c.bucket.type))
+
+
+def bucket_of(when):
+    """Start of the BUCKET `when` falls in."""
+
+    return EPOCH + (when - EPOCH) // BUCKET * BUCKET
+
+
+@event.listens_for(Likes, 'after_insert')
+def like_added(mapper, connection, like):
+    connection.execute(_add_like, message_id=like.message_id,
+                       bucket=bucket_of(like.created_at))
+
+
+@event.listens_for(Likes, 'before_delete')
+def like_removed(mapper, connection, like):
+    _forget_like(connection, like)
+
+
+def forget_like(like):
+    """Take `like` out of its bucket after a Core delete of it."""
+
+    _forget_like(db.session, like)
+
+
+def _forget_like(connection, like):
+    if like.created_at is None:
+        # from before likes had times; never counted
+        return
+
+    # a bucket already pruned has nothing to take it from
+    connection.execute(
+        buckets.update()
+        .where(buckets.c.message_id == like.message_id)
+        .where(buckets.c.bucket == bucket_of(like.created_at))
+        .values(likes=buckets.c.likes - 1))
+
+
+def count_window(window, limit):
+    """[(message id, likes)]: the `limit` messages most liked in the
+    `window` (a timedelta) up to now, most first."""
+
+    since = bucket_of(datetime.utcnow() - window)
+    total = func.sum(buckets.c.likes)
+
+    rows = db.session.execute(
+        select([buckets.c.message_id, total])
+        .where(buckets.c.bucket >= since)
+        .group_by(buckets.c.message_id)
+        .having(total > 0)
+        .order_by(total.desc(), buckets.c.message_id.desc())
+        .limit(limit))
+
+    return [(message_id, count) for message_id, count in rows]
+
+
+class TopMessages:
+    """Each window's top `size` messages, recounted every `ttl` seconds."""
+
+    def __init__(self, size=50, ttl=60):
+        self.size = size
+        self.ttl = ttl
+        # window name: (expires at, [(message id, likes)])
+        self._ranked = {}
+
+    def get(self, window):
+        now = time.monotonic()
+        cached = self._ranked.get(window)
+
+        if cached is None or cached[0] <= now:
+            # two threads may both recount; the list is small either way
+            ranked = count_window(WINDOWS[window], self.size)
+            cached = (now + self.ttl, ranked)
+            self._ranked[window] = cached
+
+        return cached[1]
+
+    def clear(self):
+        self._ranked.clear()
+
+
+def top_messages():
+    """The current app's TopMessages."""
+
+    return current_app.extensions['trending']
+
+
+def trending(window=DEFAULT_WINDOW, limit=None):
+    """[(Message, likes)] for the most liked messages in `window` (one of
+    WINDOWS), authors loaded.
+
+    Messages deleted since the counts were cached are left out.
+    """
+
+    ranked = top_messages().get(window)[:limit]
+    ids = [message_id for message_id, _ in ranked]
+
+    messages = {}
+    if ids:
+        messages = {msg.id: msg for msg in (Message.query
+                                            .options(joinedload(Message.user))
+                                            .filter(Message.id.in_(ids)))}
+
+    return [(messages[message_id], count)
+            for message_id, count in ranked if message_id in messages]
+
+
+@jobs.task('maintenance', every=3600)
+def prune_buckets():
+    """Delete buckets older than the longest window."""
+
+    oldest = bucket_of(datetime.utcnow() - max(WINDOWS.values()))
+    db.session.execute(buckets.delete().where(buckets.c.bucket < oldest))
+
+
+def rebuild(batch_size=5000):
+    """Recount every bucket of the longest window from the likes table.
+
+    Scans the likes (created_at isn't indexed) and replaces all buckets;
+    doesn't commit. Returns the number of buckets written.
+    """
+
+    since = bucket_of(datetime.utcnow() - max(WINDOWS.values()))
+    counts = Counter()
+
+    liked = db.session.execute(
+        select([likes.c.message_id, likes.c.created_at])
+        .where(likes.c.created_at >= since))
+
+    for message_id, created_at in liked:
+        counts[message_id, bucket_of(created_at)] += 1
+
+    rows = [{'message_id': message_id, 'bucket': bucket, 'likes': count}
+            for (message_id, bucket), count in counts.items()]
+
+    db.session.execute(buckets.delete())
+    for start in range(0, len(rows), batch_size):
+        db.session.execute(buckets.insert(), rows[start:start + batch_size])
+
+    top_messages().clear()
+
+    return len(rows)
+
+
+def init_app(app):
+    """Size and refresh rate of the cached rankings."""
+
+    app.config.setdefault('TRENDING_SIZE', 50)
+    app.config.setdefault('TRENDING_TTL', 60)
+
+    app.extensions['trending'] = TopMessages(app.config['TRENDING_SIZE'],
+                                             app.config['TRENDING_TTL'])